@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,6 +6,63 @@ class Settings(BaseSettings):
     jwt_secret_key: str
     jwt_algorithm: str
     access_token_expire_minutes: int
+    database_startup_mode: str = "reset"  # 起動時のDBの扱い（reset: 全テーブルを作り直す / warm: データを残してロビーを復元する）
+    db_echo: bool = False  # 実行したSQLをログに出すか（開発時のみ）
+    db_pool_size: int = 10  # 接続プールに常に保持する接続数
+    db_max_overflow: int = 20  # 混雑時に pool_size を超えて作る接続数の上限
+    db_pool_timeout: float = 10.0  # プールの接続が空くのを待つ時間の上限（秒）
+    db_pool_recycle: int = 1800  # 接続を作り直すまでの秒数（MySQLのwait_timeoutより短くする）
+    db_pool_pre_ping: bool = True  # 接続を使う前に生きているか確認する（切れた接続によるエラーを防ぐ）
+    db_statement_cache_size: int = 500  # コンパイル済みSQLのキャッシュ件数
+    db_query_stats_enabled: bool = False  # リクエストごとのクエリ数・合計時間をレスポンスヘッダーに付けるか
+    db_query_stats_warn_ms: float = 200.0  # 1リクエストのクエリの合計時間がこれを超えたらログに出す（ミリ秒）
+    lobby_index_cell_deg: float = 0.02  # ロビー空間インデックスのセルサイズ（度）
+    batch_matching_enabled: bool = False  # 参加リクエストをまとめて割り当てるか
+    batch_matching_window_ms: int = 200  # バッチマッチングでリクエストを溜める時間（ミリ秒）
+    batch_matching_max_size: int = 100  # この件数に達したら待たずに割り当てる
+    mapbox_http2: bool = True  # MapboxへのHTTP/2接続を使うか
+    mapbox_max_connections: int = 20  # Mapboxへの同時接続数の上限
+    mapbox_max_keepalive_connections: int = 10  # 再利用のために保持する接続数
+    mapbox_keepalive_expiry: float = 30.0  # 保持している接続を閉じるまでの秒数
+    mapbox_timeout: float = 10.0  # Mapbox APIのタイムアウト（秒）
+    mapbox_connect_timeout: float = 5.0  # Mapbox APIの接続タイムアウト（秒）
+    mapbox_matrix_max_coordinates: int = 25  # Matrix APIの1リクエストあたりの座標数の上限（超える場合は分割）
+    mapbox_matrix_concurrency: int = 4  # 分割したMatrix APIリクエストを同時に送る数
+    matrix_cache_precision: int = 4  # 所要時間キャッシュで座標をスナップする桁数
+    matrix_cache_ttl_seconds: float = 3600.0  # 所要時間キャッシュの有効期間（秒）
+    matrix_cache_max_entries: int = 100000  # 所要時間キャッシュに保持するペア数の上限
+    directions_cache_precision: int = 5  # ルートキャッシュのキーで座標を丸める桁数
+    directions_cache_max_bytes: int = 64 * 1024 * 1024  # ルートキャッシュがメモリに保持する合計サイズ（バイト）
+    directions_cache_dir: Optional[str] = None  # ルートのディスクキャッシュの保存先（未設定ならメモリのみ）
+    route_solver_use_processes: bool = True  # 訪問順序の計算をプロセスプールで行うか（Falseならスレッドプール）
+    route_solver_workers: int = 2  # 訪問順序を同時に計算するワーカー数
+    route_solver_max_pending: int = 16  # 実行中＋待機中の計算数の上限
+    route_solver_profile: str = "fast"  # 訪問順序計算のプロファイル（fast / quality）
+    route_solver_time_limit_ms: Optional[int] = None  # 訪問順序計算の制限時間（未設定ならプロファイルの既定値）
+    route_exact_max_passengers: int = 4  # この乗客数以下ならOR-Toolsを使わず全列挙で訪問順序を求める
+    route_polyline_precision: int = 6  # ルートを保存するポリラインの精度（5 または 6）
+    route_payload_cache_max_bytes: int = 16 * 1024 * 1024  # ルート取得APIのレスポンスキャッシュの合計サイズ（バイト）
+    route_payload_compress_min_bytes: int = 1024  # このサイズ未満のレスポンスは圧縮しない（バイト）
+    route_payload_gzip_level: int = 6  # gzipの圧縮レベル（1〜9）
+    route_payload_brotli_quality: int = 5  # brotliの圧縮品質（0〜11）
+    ws_send_queue_size: int = 64  # WebSocket接続ごとの送信キューの上限
+    ws_send_timeout: float = 5.0  # WebSocketの1メッセージの送信の制限時間（秒）。超えた接続は切断する
+    ws_slow_consumer_policy: str = "drop_oldest"  # 送信キューが一杯のときの扱い（drop_oldest / drop_newest / disconnect）
+    ws_replay_buffer_size: int = 100  # 再接続時に再送するため、ユーザーごとに保持するメッセージ数
+    ws_session_ttl: float = 300.0  # 全ての接続が切れてからセッション（再送用のメッセージ）を保持する時間（秒）
+    ws_backplane: str = "memory"  # ワーカー間でWebSocketの通知を中継する方法（memory: 単一プロセス / redis: Redis pub/sub。redis は poetry install --extras redis が必要）
+    ws_backplane_redis_url: Optional[str] = None  # backplane=redis の場合のRedisのURL
+    ws_backplane_channel: str = "ridelink:ws"  # backplane=redis の場合のチャンネル名
+    lobby_store: str = "memory"  # ロビーの状態の保存先（memory: プロセス内 / redis: 複数ワーカーで共有。redis は poetry install --extras redis が必要）
+    lobby_store_redis_url: Optional[str] = None  # lobby_store=redis の場合のRedisのURL
+    lobby_store_prefix: str = "ridelink:"  # lobby_store=redis の場合のキーの接頭辞
+    lobby_lock_ttl_ms: int = 30000  # ロビーのロックの有効期限（ミリ秒。ロック中は1/3ごとに延長し、ワーカーが落ちた場合はこの時間で解放される）
+    lobby_lock_timeout_ms: int = 10000  # ロビーのロックを待つ時間の上限（ミリ秒）
+    routing_backend: str = "mapbox"  # 経路探索のバックエンド（mapbox / local）
+    local_road_graph_path: Optional[str] = None  # localバックエンドで使う道路グラフ（.npz）のパス
+    detour_scorer: str = "cached"  # ロビー候補の遠回り時間の見積もり方法（cached: 取得済みの所要時間を優先 / haversine: 直線距離のみ）
+    detour_speed_kmh: float = 30.0  # 遠回り時間の見積もりに使う平均速度（km/h）
+    detour_circuity: float = 1.3  # 道なりの距離が直線距離の何倍になるか
 
     class Config:
         env_file = ".env"
@@ -6,6 +6,9 @@ from models.models import Match, MatchUser, MatchHistory, MatchUsersHistory, Eva
 from services.Enums import UserRole, EvaluationStatus
 from dto.MatchDTO import MatchDTO, MatchUserDTO, ReviewTargetDTO
 
+# 書き込むとルート取得APIのレスポンスが変わる列
+ROUTE_COLUMNS = ("route_geojson", "route_summary", "route_steps")
+
 class MatchCRUD:
     def __init__(self, db_session: AsyncSession):
         """
@@ -37,6 +40,7 @@ class MatchCRUD:
             match_id=match.match_id,
             status=match.status,
             route_geojson=match.route_geojson,
+            route_summary=match.route_summary,
             max_passengers=match.max_passengers,
             max_distance=match.max_distance,
             preferences=match.preferences,
@@ -55,7 +59,7 @@ class MatchCRUD:
             ユーザーDTOのリスト
         """
         result = await self.db_session.execute(
-            select(MatchUser).where(MatchUser.match_id == match_id)
+            select(MatchUser).where(MatchUser.match_id == match_id).order_by(MatchUser.id)
         )
         match_users = result.scalars().all()
         
@@ -75,7 +79,67 @@ class MatchCRUD:
             )
             for match_user in match_users
         ]
+    
+    async def get_matches_by_status(self, statuses: List[str]) -> List[MatchDTO]:
+        """
+        指定したステータスのマッチをまとめて取得する（起動時のロビーの復元用）
         
+        Args:
+            statuses: 取得するステータスのリスト
+        
+        Returns:
+            マッチDTOのリスト（マッチID順）
+        """
+        result = await self.db_session.execute(
+            select(Match).where(Match.status.in_(statuses)).order_by(Match.match_id)
+        )
+        return [
+            MatchDTO(
+                match_id=match.match_id,
+                status=match.status,
+                route_geojson=match.route_geojson,
+                route_summary=match.route_summary,
+                max_passengers=match.max_passengers,
+                max_distance=match.max_distance,
+                preferences=match.preferences,
+                created_at=match.created_at.isoformat() if match.created_at else None,
+                updated_at=match.updated_at.isoformat() if match.updated_at else None,
+            )
+            for match in result.scalars().all()
+        ]
+    
+    async def get_users_by_matches(self, match_ids: List[int]) -> Dict[int, List[MatchUserDTO]]:
+        """
+        複数のマッチのユーザー情報を1回のクエリで取得する
+        
+        Args:
+            match_ids: マッチIDのリスト
+        
+        Returns:
+            マッチID -> ユーザーDTOのリスト（登録順）
+        """
+        users: Dict[int, List[MatchUserDTO]] = {match_id: [] for match_id in match_ids}
+        if not match_ids:
+            return users
+        
+        result = await self.db_session.execute(
+            select(MatchUser).where(MatchUser.match_id.in_(match_ids)).order_by(MatchUser.id)
+        )
+        for match_user in result.scalars().all():
+            users[match_user.match_id].append(MatchUserDTO(
+                id=match_user.id,
+                match_id=match_user.match_id,
+                user_id=match_user.user_id,
+                user_start_lat=match_user.user_start_lat,
+                user_start_lng=match_user.user_start_lng,
+                user_destination_lat=match_user.user_destination_lat,
+                user_destination_lng=match_user.user_destination_lng,
+                user_role=match_user.user_role,
+                user_status=match_user.user_status,
+                created_at=match_user.created_at.isoformat() if match_user.created_at else None,
+                updated_at=match_user.updated_at.isoformat() if match_user.updated_at else None,
+            ))
+        return users
     
     async def get_match_raw(self, match_id: int) -> Optional[MatchDTO]:
         """
@@ -146,6 +210,7 @@ class MatchCRUD:
             match_id=match.match_id,
             status=match.status,
             route_geojson=match.route_geojson,
+            route_summary=match.route_summary,
             max_passengers=match.max_passengers,
             max_distance=match.max_distance,
             preferences=match.preferences,
@@ -217,8 +282,12 @@ class MatchCRUD:
             return None
         
         for key, value in kwargs.items():
-            if hasattr(match, key):
+            # インスタンスで確認すると遅延読み込みの列（route_steps）の読み込みが走るため、クラスで確認する
+            if hasattr(Match, key):
                 setattr(match, key, value)
+        if any(key in kwargs for key in ROUTE_COLUMNS):
+            # 更新日時は秒単位で同じ秒の書き込みを区別できないため、番号をDB側で加算する（既存の行はNULL）
+            match.route_version = func.coalesce(Match.route_version, 0) + 1
         
         await self.db_session.commit()
         await self.db_session.refresh(match)
@@ -226,6 +295,7 @@ class MatchCRUD:
             match_id=match.match_id,
             status=match.status,
             route_geojson=match.route_geojson,
+            route_summary=match.route_summary,
             max_passengers=match.max_passengers,
             max_distance=match.max_distance,
             preferences=match.preferences,
@@ -319,7 +389,7 @@ class MatchCRUD:
             bool: 削除成功ならTrue、失敗ならFalse
         """
         result = await self.db_session.execute(
-            select(MatchUser).where(MatchUser.match_id == match_id)
+            select(MatchUser).where(MatchUser.match_id == match_id).order_by(MatchUser.id)
         )
         match_users = result.scalars().all()
         if not match_users:
@@ -365,11 +435,46 @@ class MatchCRUD:
         await self.db_session.commit()
         return True
 
+    async def get_route_steps(self, match_id: int) -> Optional[List[List[Dict[str, Any]]]]:
+        """
+        マッチの案内ステップを取得する（route_stepsは遅延読み込みのため個別に取得）
+        
+        Args:
+            match_id: マッチID
+        
+        Returns:
+            区間ごとの案内ステップのリスト
+        """
+        result = await self.db_session.execute(
+            select(Match.route_steps).where(Match.match_id == match_id)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_match_route_version(self, match_id: int) -> Optional[int]:
+        """
+        マッチのルートのバージョンだけを取得する（ルートのレスポンスキャッシュの確認用）
+        
+        Args:
+            match_id: マッチID
+        
+        Returns:
+            ルートを書き込んだ回数。マッチがない場合はNone
+        """
+        result = await self.db_session.execute(
+            select(Match.match_id, Match.route_version).where(Match.match_id == match_id)
+        )
+        row = result.first()
+        if not row:
+            return None
+        return row.route_version or 0
+
     async def save_to_match_history(self, match: MatchDTO) -> None:
         match_history = MatchHistory(
             match_id=match.match_id,
             status=match.status,
             route_geojson=match.route_geojson,
+            route_summary=match.route_summary,
+            route_steps=await self.get_route_steps(match.match_id),
             max_passengers=match.max_passengers,
             max_distance=match.max_distance,
             preferences=match.preferences,
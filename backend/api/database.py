@@ -5,15 +5,30 @@ from sqlalchemy.sql import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
+from sqlalchemy import event, inspect
+from contextvars import ContextVar
+from typing import Optional
+
 from models.models import Base
+from config import settings
 import asyncio
+import time
 
 # MySQL接続URL
 # この部分だけ変える
 SQLALCHEMY_DATABASE_URL = "mysql+aiomysql://root@db:3306/demo?charset=utf8"
 
-# エンジン作成
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+# エンジン作成（接続プールの設定はconfigから）
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    echo=settings.db_echo,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=settings.db_pool_pre_ping,
+    query_cache_size=settings.db_statement_cache_size
+)
 
 AsyncSessionLocal = sessionmaker(
     autocommit=False,
@@ -23,6 +38,46 @@ AsyncSessionLocal = sessionmaker(
 )
 
 
+class QueryStats:
+    """1リクエスト中に実行したクエリの件数と合計時間"""
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+
+    @property
+    def total_ms(self) -> float:
+        return self.total_seconds * 1000
+
+
+# 実行中のリクエストのクエリ集計（リクエスト外のクエリは集計しない）
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("db_query_stats", default=None)
+
+
+def start_query_stats() -> QueryStats:
+    """現在のリクエストのクエリ集計を開始する"""
+    stats = QueryStats()
+    _query_stats.set(stats)
+    return stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info["query_start_times"].pop()
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total_seconds += time.perf_counter() - started_at
+
+
+if settings.db_query_stats_enabled:
+    # AsyncEngineのイベントは内部の同期エンジンに登録する
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
 async def reset_database():
     """
     データベース内のすべてのテーブルを削除してリセット
@@ -41,4 +96,39 @@ async def reset_database():
         await connection.run_sync(Base.metadata.create_all)
         
         # 外部キー制約を有効化
-        await connection.execute(text("SET FOREIGN_KEY_CHECKS=1"))
\ No newline at end of file
+        await connection.execute(text("SET FOREIGN_KEY_CHECKS=1"))
+
+
+# 後から追加した列（create_all は既存のテーブルに列を追加しないため、create_tables で追加する）
+ADDED_COLUMNS = {
+    "matches": ["route_summary", "route_steps", "route_version"],
+    "match_history": ["route_summary", "route_steps"],
+}
+
+
+def _add_missing_columns(connection):
+    inspector = inspect(connection)
+    table_names = set(inspector.get_table_names())
+    preparer = connection.dialect.identifier_preparer
+    for table_name, column_names in ADDED_COLUMNS.items():
+        if table_name not in table_names:
+            continue  # テーブルごと作成される
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        table = Base.metadata.tables[table_name]
+        for column_name in column_names:
+            if column_name in existing:
+                continue
+            column_type = table.c[column_name].type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {preparer.quote(column_name)} {column_type} NULL"
+            ))
+            print(f"✅ {table_name}.{column_name} 列を追加しました")
+
+
+async def create_tables():
+    """
+    存在しないテーブルを作成し、既存のテーブルに足りない列を追加する（既存のデータは残す）
+    """
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.run_sync(_add_missing_columns)
@@ -18,6 +18,7 @@ from fastapi import Request
 from services.MatchingService import MatchingService
 from services.ConnectionManager import ConnectionManager
 from services.MatchedService import MatchedService
+from services.RouteCache import RoutePayloadCache
 
 load_dotenv()
 # JWT設定
@@ -83,4 +84,7 @@ def get_matching_service(request: Request) -> MatchingService:
     
 
 def get_connection_manager(request: Request) -> ConnectionManager:
-    return request.app.state.connection_manager
\ No newline at end of file
+    return request.app.state.connection_manager
+
+def get_route_payload_cache(request: Request) -> RoutePayloadCache:
+    return request.app.state.route_payload_cache
@@ -5,7 +5,8 @@ from typing import Optional, Dict, Any
 class MatchDTO:
     match_id: int  # マッチングの一意のID
     status: str  # 案内中のステータス（'pending'/'accepted'/'rejected'/'completed'）
-    route_geojson: Optional[Dict[str, Any]]  # 生成されたルートを保存するJSON
+    route_geojson: Optional[Dict[str, Any]]  # 生成されたルートを保存するJSON（旧形式）
+    route_summary: Optional[Dict[str, Any]]  # ルートのエンコード済みポリラインと概要
     max_passengers: int  # 最大乗車人数
     max_distance: float  # 最大距離
     preferences: Optional[Dict[str, Any]]  # ユーザーの好みを保存するJSON
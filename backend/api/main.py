@@ -4,27 +4,127 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from routers import User, Matching, Matched, Websocket
-from database import reset_database
+from database import reset_database, create_tables, start_query_stats
 # ← ★ WebSocketサービスをインポート
 from services.ConnectionManager import ConnectionManager
-from services.MatchingService import MatchingService
+from services.Backplane import InMemoryBackplane, RedisBackplane
+from services.MatchingService import MatchingService, RideLobby
+from services.LobbyStore import SharedLobbyStore, RedisStateBackend
+from services.BatchMatchingEngine import BatchMatchingEngine
+from services.MapboxClient import MapboxClient
+from services.RouteSolver import RouteSolverPool
+from services.RoutingBackend import MapboxRoutingBackend
+from services.LocalRoutingBackend import LocalRoutingBackend
+from services.LocalRoadGraph import LocalRoadGraph
+from services.RouteCache import RoutePayloadCache
+from config import settings
 
 app = FastAPI()
 
 # ← ★ WebSocketとMatchingServiceのインスタンスを作ってアプリに登録
-connection_manager = ConnectionManager()
+# WebSocketの通知のバックプレーン（複数ワーカーで動かす場合はredis）
+if settings.ws_backplane == "redis":
+    if not settings.ws_backplane_redis_url:
+        raise RuntimeError("ws_backplane=redis には ws_backplane_redis_url の設定が必要です")
+    backplane = RedisBackplane(settings.ws_backplane_redis_url, channel=settings.ws_backplane_channel)
+else:
+    backplane = InMemoryBackplane()
+connection_manager = ConnectionManager(
+    queue_size=settings.ws_send_queue_size,
+    send_timeout=settings.ws_send_timeout,
+    slow_consumer_policy=settings.ws_slow_consumer_policy,
+    replay_size=settings.ws_replay_buffer_size,
+    session_ttl=settings.ws_session_ttl,
+    backplane=backplane
+)
 matching_service = MatchingService()
 matching_service.set_connection_manager(connection_manager)
+# ロビーの状態の保存先（redisの場合は複数ワーカーで共有する）
+if settings.lobby_store == "redis":
+    if not settings.lobby_store_redis_url:
+        raise RuntimeError("lobby_store=redis には lobby_store_redis_url の設定が必要です")
+    matching_service.set_lobby_store(SharedLobbyStore(
+        RedisStateBackend(settings.lobby_store_redis_url),
+        RideLobby,
+        cell_size_deg=settings.lobby_index_cell_deg,
+        prefix=settings.lobby_store_prefix,
+        lock_ttl_ms=settings.lobby_lock_ttl_ms,
+        lock_timeout_ms=settings.lobby_lock_timeout_ms
+    ))
+mapbox_client = MapboxClient(
+    max_connections=settings.mapbox_max_connections,
+    max_keepalive_connections=settings.mapbox_max_keepalive_connections,
+    keepalive_expiry=settings.mapbox_keepalive_expiry,
+    timeout=settings.mapbox_timeout,
+    connect_timeout=settings.mapbox_connect_timeout,
+    http2=settings.mapbox_http2
+)
+matching_service.set_mapbox_client(mapbox_client)
+# 経路探索のバックエンド（localの場合は手元の道路グラフを使う）
+if settings.routing_backend == "local":
+    if not settings.local_road_graph_path:
+        raise RuntimeError("routing_backend=local には local_road_graph_path の設定が必要です")
+    routing_backend = LocalRoutingBackend(LocalRoadGraph.load(settings.local_road_graph_path))
+else:
+    routing_backend = MapboxRoutingBackend(
+        settings.mapbox_api_key,
+        mapbox_client,
+        matrix_max_coordinates=settings.mapbox_matrix_max_coordinates,
+        matrix_concurrency=settings.mapbox_matrix_concurrency
+    )
+matching_service.set_routing_backend(routing_backend)
+solver_pool = RouteSolverPool(
+    max_workers=settings.route_solver_workers,
+    max_pending=settings.route_solver_max_pending,
+    use_processes=settings.route_solver_use_processes
+)
+matching_service.set_solver_pool(solver_pool)
+if settings.batch_matching_enabled:
+    matching_service.set_batch_engine(BatchMatchingEngine(
+        matching_service,
+        window_seconds=settings.batch_matching_window_ms / 1000,
+        max_batch_size=settings.batch_matching_max_size
+    ))
 
 app.state.connection_manager = connection_manager
 app.state.matching_service = matching_service
+app.state.mapbox_client = mapbox_client
+# ルート取得APIのレスポンスキャッシュ（ルートの書き込みか参加ユーザーの変更があるまで同じレスポンスを使い回す）
+app.state.route_payload_cache = RoutePayloadCache(
+    max_bytes=settings.route_payload_cache_max_bytes,
+    compress_min_bytes=settings.route_payload_compress_min_bytes,
+    gzip_level=settings.route_payload_gzip_level,
+    brotli_quality=settings.route_payload_brotli_quality
+)
 
 @app.on_event("startup")
 async def startup_event():
-    # アプリケーション起動時にデータベースをリセット
-    await reset_database()
-    import logging
-    logging.getLogger("sqlalchemy.engine").disabled = True
+    if settings.database_startup_mode == "warm":
+        # データを残したまま起動し、募集中のロビーをDBから復元
+        # （復元では route_summary などの後から追加した列も読むため、先にテーブル・列を揃える）
+        await create_tables()
+        restored = await matching_service.restore_lobbies()
+        print(f"✅ ロビーを {restored} 件復元しました")
+    else:
+        # アプリケーション起動時にデータベースをリセット
+        await reset_database()
+    # Mapboxへの接続プールを作成
+    await mapbox_client.start()
+    # 訪問順序を計算するプールを作成
+    solver_pool.start()
+    # WebSocketの通知の受信を開始
+    await connection_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Mapboxへの接続プールを閉じる
+    await mapbox_client.close()
+    # 経路計算プールを閉じる
+    await solver_pool.close()
+    # WebSocket接続を閉じる
+    await connection_manager.close()
+    # ロビーの状態の保存先への接続を閉じる
+    await matching_service.lobby_store.close()
 
 # ルーター登録
 app.include_router(User.router)
@@ -33,6 +133,18 @@ app.include_router(Matched.router)
 app.include_router(Websocket.router)
 
 
+# リクエストごとのクエリ数・合計時間（診断用。db_query_stats_enabled の場合のみ）
+if settings.db_query_stats_enabled:
+    @app.middleware("http")
+    async def query_stats_middleware(request: Request, call_next):
+        stats = start_query_stats()
+        response = await call_next(request)
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Query-Time"] = f"{stats.total_ms:.1f}"
+        if stats.total_ms > settings.db_query_stats_warn_ms:
+            print(f"⚠️ {request.method} {request.url.path}: クエリ {stats.count} 件, 合計 {stats.total_ms:.1f}ms")
+        return response
+
 # バリデーションエラーをJSONで返す
 @app.exception_handler(RequestValidationError)
 async def handler(request: Request, exc: RequestValidationError):
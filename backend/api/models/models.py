@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, DECIMAL, DateTime, ForeignKey, func, JSON, Boolean
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
 Base = declarative_base()
 
@@ -18,7 +18,10 @@ class Match(Base):
     
     match_id = Column(Integer, primary_key=True)  # マッチングの一意のID
     status = Column(String(50), nullable=False)  # 案内中のステータス（'pending'/'accepted'/'rejected'/'completed'）
-    route_geojson = Column(JSON, nullable=True)  # 生成されたルートを保存するJSONカラム
+    route_geojson = Column(JSON, nullable=True)  # 生成されたルートを保存するJSONカラム（旧形式）
+    route_summary = Column(JSON, nullable=True)  # ルートのエンコード済みポリラインと概要
+    route_steps = deferred(Column(JSON, nullable=True))  # 区間ごとの案内ステップ（必要なときだけ読み込む）
+    route_version = Column(Integer, default=0, nullable=True)  # ルートを書き込むたびに増える番号（ルート取得APIのレスポンスキャッシュのキー）
     max_passengers = Column(Integer, default=1, nullable=False)  # 最大乗車人数
     max_distance = Column(DECIMAL(10, 6), default=5.0, nullable=False)  # 最大距離
     preferences = Column(JSON, nullable=True)  # ユーザーの好みを保存するJSONカラム
@@ -52,7 +55,9 @@ class MatchHistory(Base):
     id = Column(Integer, primary_key=True)
     match_id = Column(Integer, nullable=False)  # 元のマッチID
     status = Column(String(50), nullable=False)  # ステータス
-    route_geojson = Column(JSON, nullable=True)  # ルート情報
+    route_geojson = Column(JSON, nullable=True)  # ルート情報（旧形式）
+    route_summary = Column(JSON, nullable=True)  # ルートのエンコード済みポリラインと概要
+    route_steps = deferred(Column(JSON, nullable=True))  # 区間ごとの案内ステップ
     max_passengers = Column(Integer, nullable=False)  # 最大乗車人数
     max_distance = Column(DECIMAL(10, 6), nullable=False)  # 最大距離
     preferences = Column(JSON, nullable=True)  # ユーザーの好み
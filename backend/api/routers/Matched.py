@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from sqlalchemy.orm import Session
-from dependencies import get_db , get_connection_manager
+from dependencies import get_db , get_connection_manager, get_route_payload_cache
 import schemas.routes as route_schema
 from services.MatchedService import MatchedService
 from fastapi.responses import HTMLResponse
-from typing import Dict
+from typing import Dict, List, Literal, Optional
+import hashlib
+import json
 from config import settings
-from services.Enums import UserStatus
+from services.Enums import UserStatus, RouteFormat
 from services.ConnectionManager import ConnectionManager
+from services.RouteCache import RoutePayloadCache
 import schemas.routes as route_schema
 
 router = APIRouter(
@@ -117,11 +120,24 @@ async def get_review_targets(
     return review_target
 
 @router.get("/{match_id}/route") # , response_model=route_schema.RouteResponse
-async def get_route(match_id: int, db: Session = Depends(get_db), connection_manager: ConnectionManager = Depends(get_connection_manager)):
+async def get_route(
+    match_id: int,
+    request: Request,
+    format: Literal["geojson", "polyline"] = RouteFormat.GEOJSON,
+    steps: bool = False,
+    db: Session = Depends(get_db),
+    connection_manager: ConnectionManager = Depends(get_connection_manager),
+    payload_cache: RoutePayloadCache = Depends(get_route_payload_cache)
+):
     """決定したマッチのルート情報とユーザーの位置を取得する
 
+    マッチのルートが書き込まれるか参加ユーザーの一覧が変わるまでは、シリアライズ・圧縮済みのレスポンスを使い回す。
+    If-None-MatchがETagと一致する場合は304を返す。
+
     Args:
         match_id : マッチID
+        format : geojson（Directions APIと同じ形式）または polyline（エンコード済みポリライン）
+        steps : 案内ステップを含めるか
         db (Session, optional): データベースセッション. Defaults to Depends(get_db).
 
     Returns:
@@ -130,23 +146,84 @@ async def get_route(match_id: int, db: Session = Depends(get_db), connection_man
     """
     # マッチングサービスのインスタンスを作成
     matching_service = MatchedService(db, connection_manager)
-    # ルート情報を取得
-    route = await matching_service.get_matched_route(match_id)
 
-    if not route:
+    # ルートのバージョンだけを確認し、キャッシュ済みならルートを組み立て直さない
+    route_version = await matching_service.get_match_route_version(match_id)
+    if route_version is None:
         return {"error": "ルート情報が見つかりません"}
-    
-    users = await matching_service.get_users_by_match(match_id)
-    
-    
+
+    # 参加ユーザーの一覧はルートと関係なく変わるため毎回取得し、内容のハッシュをキーに含める
+    users_list = await _build_users_list(matching_service, match_id)
+    cache_key = payload_cache.make_key(match_id, route_version, _users_version(users_list), format, steps)
+    payload = payload_cache.get(cache_key)
+    if payload is None:
+        data = await _build_route_payload(matching_service, match_id, format, steps, users_list)
+        if data is None:
+            return {"error": "ルート情報が見つかりません"}
+        payload = await payload_cache.set(cache_key, data)
+
+    encoding = payload.select_encoding(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": payload.etag(encoding),
+        "Cache-Control": "no-cache",  # 毎回ETagで確認させる
+        "Vary": "Accept-Encoding"
+    }
+    if payload.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.bodies[encoding], media_type="application/json", headers=headers)
+
+
+async def _build_users_list(matching_service: MatchedService, match_id: int) -> List[Dict]:
+    """ルート取得APIのレスポンスに含める参加ユーザーの一覧"""
+    users = await matching_service.get_users_by_match(match_id) or []
+
     users_list = []
     for user in users:
         users_list.append({
             "user_id": user.user_id,
-            "start": [user.user_start_lat, user.user_start_lng],
-            "destination": [user.user_destination_lat, user.user_destination_lng],
+            # DECIMAL列はそのままではJSONにできないため float にする
+            "start": [float(user.user_start_lat), float(user.user_start_lng)],
+            "destination": [float(user.user_destination_lat), float(user.user_destination_lng)],
             "role": user.user_role,
         })
+    return users_list
+
+
+def _users_version(users_list: List[Dict]) -> str:
+    """参加ユーザーの一覧の内容から作るバージョン（レスポンスキャッシュのキーに使う）"""
+    body = json.dumps(users_list, sort_keys=True)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+
+async def _build_route_payload(matching_service: MatchedService, match_id: int, format: str, steps: bool, users_list: List[Dict]) -> Optional[Dict]:
+    """ルート取得APIのレスポンスを組み立てる（ルートがない場合はNone）"""
+    # ルート情報を取得
+    route = await matching_service.get_matched_route(match_id, route_format=format, include_steps=steps)
+
+    if not route:
+        return None
     
     return {"route": route, "users": users_list}
 
+
+@router.get("/{match_id}/route/steps")
+async def get_route_steps(match_id: int, db: Session = Depends(get_db), connection_manager: ConnectionManager = Depends(get_connection_manager)):
+    """決定したマッチのルートの案内ステップを取得する（ルート本体とは別に必要なときだけ取得）
+
+    Args:
+        match_id : マッチID
+        db (Session, optional): データベースセッション. Defaults to Depends(get_db).
+
+    Returns:
+        dict: 区間ごとの案内ステップ
+    """
+    matching_service = MatchedService(db, connection_manager)
+    steps = await matching_service.get_route_steps(match_id)
+
+    if steps is None:
+        return {"error": "ルート情報が見つかりません"}
+
+    return {"steps": steps}
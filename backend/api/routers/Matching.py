@@ -22,6 +22,7 @@ async def create_lobby(
         driver_id=match_data.driver_id,
         starting_location=match_data.driver_location,
         destination=match_data.destination,
+        solver_profile=match_data.solver_profile,
     )
 
 # ロビーの取得API
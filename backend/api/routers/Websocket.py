@@ -18,14 +18,23 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=1008)  # 不正なパラメータの場合は接続を閉じる
         return
 
+    # 再接続の場合は、前回のセッションIDと最後に受け取った通番から再開する
+    session_id = websocket.query_params.get("session_id")
+    last_seq = websocket.query_params.get("last_seq")
+    try:
+        last_seq = int(last_seq) if last_seq is not None else None
+    except ValueError:
+        last_seq = None
+
     connection_manager: ConnectionManager = websocket.app.state.connection_manager
-    await connection_manager.connect(user_id, websocket)
+    await connection_manager.connect(user_id, websocket, session_id=session_id, last_seq=last_seq)
 
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        await connection_manager.disconnect(user_id)
+        # 同じユーザーの他の接続は取り除かない
+        await connection_manager.disconnect(user_id, websocket)
 
 
 
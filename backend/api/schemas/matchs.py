@@ -13,6 +13,7 @@ class MatchCreate(BaseModel):
     driver_id: int = Field(..., example=1)
     driver_location: Tuple[float, float] = Field(..., example=(35.681236, 139.767125)) # 東京駅
     destination: Tuple[float, float] = Field(..., example=(35.671667, 139.763056)) # 銀座
+    solver_profile: Optional[str] = Field(None, example="fast") # 確定時の訪問順序計算のプロファイル（fast / quality）
 
 class MatchJoin(BaseModel):
     passenger_id: int = Field(..., example=2)
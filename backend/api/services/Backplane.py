@@ -0,0 +1,111 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import json
+import uuid
+
+try:
+    import redis.asyncio as aioredis  # 任意（backplane=redis の場合のみ必要）
+except ImportError:
+    aioredis = None
+
+# 受け取ったメッセージを処理する関数（各ワーカーのConnectionManagerが自分の接続に配信する）
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class Backplane:
+    """
+    WebSocketの通知をワーカー（プロセス・Pod）間で中継するバックプレーンの共通インターフェース
+
+    publish したメッセージは、自分を含む全てのワーカーの handler に届く。
+    メッセージは {"user_id": 宛先（Noneなら全員）, "json": 辞書} または {"user_id": ..., "text": 文字列}
+    """
+    name = "base"
+
+    def __init__(self):
+        self.handler: Optional[MessageHandler] = None
+
+    async def start(self, handler: MessageHandler):
+        """受信を開始する"""
+        self.handler = handler
+
+    async def publish(self, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryBackplane(Backplane):
+    """単一プロセス用（そのまま自分の handler を呼ぶ）"""
+    name = "memory"
+
+    async def publish(self, message: Dict[str, Any]):
+        if self.handler is not None:
+            await self.handler(message)
+
+
+class RedisBackplane(Backplane):
+    """Redisのpub/subで全ワーカーに中継する"""
+    name = "redis"
+
+    def __init__(self, url: str, channel: str = "ridelink:ws", reconnect_delay: float = 1.0):
+        """
+        :param url: RedisのURL（redis://host:6379/0 など）
+        :param channel: 使用するpub/subのチャンネル名
+        :param reconnect_delay: 購読が切れたときに再接続するまでの待ち時間（秒）
+        """
+        super().__init__()
+        if aioredis is None:
+            raise RuntimeError("backplane=redis には redis パッケージが必要です（poetry install --extras redis）")
+        self.url = url
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.worker_id = uuid.uuid4().hex  # メッセージの origin に付け、ログで送信元のワーカーを区別する
+        self.client = None
+        self.listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        self.client = aioredis.from_url(self.url)
+        self.listener = asyncio.create_task(self._listen())
+
+    async def publish(self, message: Dict[str, Any]):
+        """チャンネルにメッセージを送る（送信元のワーカーIDを origin として付け、受信側の失敗のログに出す）"""
+        payload = json.dumps({**message, "origin": self.worker_id}, ensure_ascii=False, separators=(",", ":"))
+        await self.client.publish(self.channel, payload)
+
+    async def _listen(self):
+        """チャンネルを購読し、受け取ったメッセージを handler に渡す（切れた場合は再接続する）"""
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    message = None
+                    try:
+                        message = json.loads(item["data"])
+                        await self.handler(message)
+                    except Exception as e:
+                        origin = message.get("origin") if isinstance(message, dict) else None
+                        print(f"⚠️ バックプレーンのメッセージの処理に失敗しました（送信元のワーカー: {origin}）: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Redisの購読が切れました。{self.reconnect_delay}秒後に再接続します: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def close(self):
+        if self.listener:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+        if self.client is not None:
+            await self.client.close()
@@ -0,0 +1,88 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+from database import AsyncSessionLocal
+
+class BatchMatchingEngine:
+    """一定時間内の参加リクエストをまとめてロビーに割り当てるバッチマッチングエンジン"""
+    def __init__(self, matching_service, window_seconds: float = 0.2, max_batch_size: int = 100):
+        """
+        :param matching_service: 割り当てと参加処理を行うMatchingService
+        :param window_seconds: リクエストを溜める時間（秒）
+        :param max_batch_size: この件数に達したら待たずに割り当てる
+        """
+        self.matching_service = matching_service
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self,
+                     passenger_id: int,
+                     passenger_location: Tuple[float, float],
+                     passenger_destination: Optional[Tuple[float, float]] = None,
+                     max_distance: float = 5.0) -> Dict[str, Any]:
+        """参加リクエストをキューに追加し、割り当て結果を待つ"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(({
+            "passenger_id": passenger_id,
+            "passenger_location": passenger_location,
+            "passenger_destination": passenger_destination,
+            "max_distance": max_distance
+        }, future))
+
+        if len(self.pending) >= self.max_batch_size:
+            # 件数が上限に達したらウィンドウを待たずに割り当て
+            if self.flush_task:
+                self.flush_task.cancel()
+            self.flush_task = asyncio.create_task(self._flush())
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_after_window())
+
+        return await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window_seconds)
+        await self._flush()
+
+    async def _flush(self):
+        """溜まったリクエストをまとめて割り当て、各リクエストに結果を返す"""
+        batch, self.pending = self.pending, []
+        self.flush_task = None
+        if not batch:
+            return
+
+        print(f"バッチマッチング: {len(batch)}件")
+        try:
+            assignments = await self.matching_service.assign_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # このタスクは最初の呼び出し元のリクエストのDBセッションを引き継いでいるが、
+        # そのセッションは呼び出し元に結果を返した時点で閉じられるため、参加処理ごとに専用のセッションを使う
+        for (request, future), lobby_info in zip(batch, assignments):
+            if future.done():
+                continue  # 呼び出し元がキャンセル済み
+
+            if lobby_info is None:
+                future.set_result({"success": False, "error": "条件に合うロビーが見つかりませんでした"})
+                continue
+
+            try:
+                async with AsyncSessionLocal() as session:
+                    self.matching_service.set_db(session)
+                    result = await self.matching_service.join_selected_lobby(
+                        request["passenger_id"],
+                        lobby_info,
+                        request["passenger_location"],
+                        request["passenger_destination"]
+                    )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+
+            if not future.done():
+                future.set_result(result)
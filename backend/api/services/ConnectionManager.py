@@ -1,41 +1,281 @@
 # services/ConnectionManager.py
 from fastapi import WebSocket
-from typing import Dict
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from services.Enums import SlowConsumerPolicy
+from services.Backplane import Backplane, InMemoryBackplane
 import asyncio
+import json
+import time
+import uuid
+
+# 送信が遅いクライアントを切断するときのクローズコード（Try Again Later）
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+class ClientConnection:
+    """1つのWebSocket接続と、その送信キュー・送信タスク"""
+    def __init__(self, user_id: int, websocket: WebSocket, manager: "ConnectionManager"):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.manager = manager
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=manager.queue_size)
+        self.closed = False
+        self.writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: str) -> bool:
+        """送信キューにメッセージを入れる（待たない）。入れられなかった場合はFalse"""
+        if self.closed:
+            return False
+
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        policy = self.manager.slow_consumer_policy
+        if policy == SlowConsumerPolicy.DISCONNECT:
+            print(f"⚠️ User {self.user_id} の送信が追いつかないため切断します")
+            self.manager.discard(self, code=SLOW_CONSUMER_CLOSE_CODE)
+            return False
+        if policy == SlowConsumerPolicy.DROP_NEWEST:
+            print(f"⚠️ User {self.user_id} の送信キューが一杯のため、新しいメッセージを破棄しました")
+            return False
+
+        # DROP_OLDEST: 一番古いメッセージを捨てて入れ直す
+        self.queue.get_nowait()
+        self.queue.put_nowait(message)
+        print(f"⚠️ User {self.user_id} の送信キューが一杯のため、古いメッセージを破棄しました")
+        return True
+
+    async def _write_loop(self):
+        """キューのメッセージを順に送信する（遅い・切れた接続は切断する）"""
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=self.manager.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"⚠️ User {self.user_id} への送信がタイムアウトしたため切断します")
+            self.manager.discard(self, code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception as e:
+            print(f"⚠️ User {self.user_id} への送信に失敗しました: {e}")
+            self.manager.discard(self)
+
+    async def close(self, code: int = 1000):
+        """送信タスクを止めてWebSocketを閉じる"""
+        self.closed = True
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # すでに切断済み
+
+
+class UserSession:
+    """ユーザーの接続（複数可）と、再接続時に再送するための通番付きメッセージ"""
+    def __init__(self, user_id: int, replay_size: int):
+        self.user_id = user_id
+        self.session_id = uuid.uuid4().hex  # サーバー再起動などで通番が振り直されたことを区別する
+        self.seq = 0  # 最後に振った通番
+        self.buffer: Deque[Tuple[int, str]] = deque(maxlen=replay_size)
+        self.connections: List[ClientConnection] = []
+
+    def record(self, message: dict) -> str:
+        """メッセージに通番を振って保持し、送信する文字列を返す"""
+        self.seq += 1
+        text = json.dumps({**message, "seq": self.seq}, ensure_ascii=False, separators=(",", ":"))
+        self.buffer.append((self.seq, text))
+        return text
+
+    def replay_since(self, last_seq: int) -> Optional[List[str]]:
+        """last_seq より後のメッセージ。保持している範囲から外れている場合はNone"""
+        if last_seq > self.seq:
+            return None
+        oldest = self.buffer[0][0] if self.buffer else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
+        return [text for seq, text in self.buffer if seq > last_seq]
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-        self.lock = asyncio.Lock()
+    def __init__(self,
+                 queue_size: int = 64,
+                 send_timeout: float = 5.0,
+                 slow_consumer_policy: str = SlowConsumerPolicy.DROP_OLDEST,
+                 replay_size: int = 100,
+                 session_ttl: float = 300.0,
+                 backplane: Optional[Backplane] = None):
+        """
+        :param queue_size: 接続ごとの送信キューの上限
+        :param send_timeout: 1メッセージの送信の制限時間（秒）
+        :param slow_consumer_policy: 送信キューが一杯のときの扱い（SlowConsumerPolicy）
+        :param replay_size: ユーザーごとに再送用に保持するメッセージ数
+        :param session_ttl: 全ての接続が切れてからセッションを保持する時間（秒）
+        :param backplane: ワーカー間でメッセージを中継するバックプレーン（Noneの場合は単一プロセス用）
+        """
+        self.sessions: Dict[int, UserSession] = {}
+        # 接続がなくなったセッション（user_id -> 接続がなくなった時刻、古い順）
+        self.idle_sessions: "OrderedDict[int, float]" = OrderedDict()
+        self.lock = asyncio.Lock()  # sessions の操作のみを保護（送信中は保持しない）
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        self.replay_size = replay_size
+        self.session_ttl = session_ttl
+        self.closing_tasks = set()  # 切断処理中のタスク（完了前に破棄されないよう参照を持つ）
+        # 送信するメッセージは全てバックプレーンを経由し、宛先の接続を持つワーカーが配信する
+        self.backplane = backplane or InMemoryBackplane()
+
+    async def start(self):
+        """バックプレーンからの受信を開始する（アプリケーション起動時）"""
+        await self.backplane.start(self._on_backplane_message)
+
+    @property
+    def active_connections(self) -> Dict[int, List[ClientConnection]]:
+        """接続中のユーザーとその接続"""
+        return {user_id: session.connections for user_id, session in self.sessions.items() if session.connections}
 
-    async def connect(self, user_id: int, websocket: WebSocket):
+    async def connect(self, user_id: int, websocket: WebSocket, session_id: Optional[str] = None, last_seq: Optional[int] = None):
+        """
+        接続を追加する（同じユーザーの他の接続はそのまま）
+        :param session_id: 前回の接続で受け取ったセッションID（再開する場合）
+        :param last_seq: 前回の接続で最後に受け取った通番（再開する場合）
+        """
         await websocket.accept()
+        connection = ClientConnection(user_id, websocket, self)
+        connection.start()
         async with self.lock:
-            self.active_connections[user_id] = websocket
-            print(f"✅ User {user_id} connected.")
+            self._purge_idle_sessions()
+            session = self.sessions.get(user_id)
+            if session is None:
+                session = self.sessions[user_id] = UserSession(user_id, self.replay_size)
+            self.idle_sessions.pop(user_id, None)
 
-    async def disconnect(self, user_id: int):
+            # 通番を振るのはこのロックの中だけなので、再送と新しいメッセージの間に抜けは出ない
+            missed = None
+            if session_id == session.session_id and last_seq is not None:
+                missed = session.replay_since(last_seq)
+                if missed is not None and len(missed) >= self.queue_size:
+                    missed = None  # 送信キューに収まらない場合はHTTPで取り直してもらう
+
+            connection.enqueue(json.dumps({
+                "type": "session",
+                "session_id": session.session_id,
+                "seq": session.seq,
+                "resumed": missed is not None  # Falseの場合、クライアントは状態をHTTPで取り直す
+            }))
+            for text in missed or []:
+                connection.enqueue(text)
+            session.connections.append(connection)
+            print(f"✅ User {user_id} connected. (接続数: {len(session.connections)}, 再送: {len(missed or [])})")
+
+    async def disconnect(self, user_id: int, websocket: Optional[WebSocket] = None):
+        """
+        接続を取り除く
+        :param websocket: 取り除く接続（Noneの場合はユーザーの全ての接続）
+        """
         async with self.lock:
-            if user_id in self.active_connections:
-                del self.active_connections[user_id]
-                print(f"❌ User {user_id} disconnected.")
+            session = self.sessions.get(user_id)
+            if session is None:
+                return
+            removed = [c for c in session.connections if websocket is None or c.websocket is websocket]
+            for connection in removed:
+                self._remove(session, connection)
+
+        for connection in removed:
+            if connection.writer:
+                connection.writer.cancel()
+
+    def _remove(self, session: UserSession, connection: ClientConnection):
+        """セッションから接続を外す（接続がなくなったセッションは一定時間だけ残す）"""
+        connection.closed = True
+        if connection in session.connections:
+            session.connections.remove(connection)
+            print(f"❌ User {session.user_id} disconnected. (接続数: {len(session.connections)})")
+        if not session.connections:
+            self.idle_sessions[session.user_id] = time.monotonic()
+            self.idle_sessions.move_to_end(session.user_id)
+
+    def _purge_idle_sessions(self):
+        """保持期間を過ぎたセッションを削除"""
+        expires_before = time.monotonic() - self.session_ttl
+        while self.idle_sessions:
+            user_id, idle_since = next(iter(self.idle_sessions.items()))
+            if idle_since > expires_before:
+                break
+            self.idle_sessions.popitem(last=False)
+            self.sessions.pop(user_id, None)
+
+    def discard(self, connection: ClientConnection, code: int = 1000):
+        """送信に失敗した・遅すぎる接続を取り除いて閉じる（ロックを待たずに呼べる）"""
+        if connection.closed:
+            return
+        # 辞書・リストの操作だけなので、await を挟まなければロックなしで安全
+        session = self.sessions.get(connection.user_id)
+        if session is not None:
+            self._remove(session, connection)
+        connection.closed = True
+        task = asyncio.create_task(connection.close(code))
+        self.closing_tasks.add(task)
+        task.add_done_callback(self.closing_tasks.discard)
+
+    async def _publish(self, message: Dict[str, Any]):
+        """
+        バックプレーンにメッセージを送る
+        通知はDBのコミット後に送るため、失敗しても呼び出し元（マッチング処理）には投げずにログに残す
+        （届かなかったメッセージは、クライアントが再接続時にHTTPで状態を取り直す）
+        """
+        try:
+            await self.backplane.publish(message)
+        except Exception as e:
+            print(f"⚠️ 通知の送信に失敗しました（宛先: User {message.get('user_id')}, バックプレーン: {self.backplane.name}）: {e}")
 
     async def send_to_text_user(self, user_id: int, message: str):
-        async with self.lock:
-            ws = self.active_connections.get(user_id)
-            if ws:
-                await ws.send_text(message)
-    
+        """テキストを送信する（通番は振らず、再送の対象にもならない）"""
+        await self._publish({"user_id": user_id, "text": message})
+
     async def send_to_json_user(self, user_id: int, message: dict):
-        async with self.lock:
-            print(f"user_id: {user_id}")
-            print(f"active_connections: {self.active_connections}")
-            ws = self.active_connections.get(user_id)
-            print(f"Sending message to user {ws}: {message}")
-            if ws:
-                await ws.send_json(message)
+        """通番を振って、ユーザーの全ての接続に送信する（切断中でもセッションがあれば再送用に保持）"""
+        print(f"Sending message to user {user_id}: {message}")
+        await self._publish({"user_id": user_id, "json": message})
 
     async def broadcast(self, message: str):
+        await self._publish({"user_id": None, "text": message})
+
+    async def _on_backplane_message(self, envelope: Dict[str, Any]):
+        """バックプレーンから届いたメッセージを、このワーカーの接続に配信する"""
+        user_id = envelope.get("user_id")
+        async with self.lock:
+            if user_id is None:
+                connections = [c for session in self.sessions.values() for c in session.connections]
+            else:
+                session = self.sessions.get(user_id)
+                if session is None:
+                    return  # このワーカーに接続していないユーザー
+                connections = list(session.connections)
+
+            if "text" in envelope:
+                text = envelope["text"]
+            elif user_id is None:
+                text = json.dumps(envelope["json"], ensure_ascii=False, separators=(",", ":"))
+            else:
+                # 通番はセッションを持つワーカーが振る（送信タスクでの再シリアライズを避けるため、ここで文字列にしておく）
+                text = session.record(envelope["json"])
+
+        for connection in connections:
+            connection.enqueue(text)
+
+    async def close(self):
+        """全ての接続を閉じる（アプリケーション終了時）"""
         async with self.lock:
-            for ws in self.active_connections.values():
-                await ws.send_text(message)
+            connections = [c for session in self.sessions.values() for c in session.connections]
+            self.sessions.clear()
+            self.idle_sessions.clear()
+        await asyncio.gather(*[connection.close(1001) for connection in connections])
+        await self.backplane.close()
@@ -0,0 +1,92 @@
+from typing import List, Optional, Tuple
+import math
+from services.LobbyRoutePlan import LobbyRoutePlan
+from services.RouteCache import DurationMatrixCache
+from services.RouteCorridor import EARTH_RADIUS_KM
+
+Coordinate = Tuple[float, float]
+
+def _haversine_km(origin: Coordinate, destination: Coordinate) -> float:
+    """2点間の大圏距離（km）"""
+    lat1, lng1 = math.radians(origin[0]), math.radians(origin[1])
+    lat2, lng2 = math.radians(destination[0]), math.radians(destination[1])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+class DetourScorer:
+    """
+    ロビー候補ごとに、乗客を乗せることでドライバーが遠回りする時間（秒）を見積もるスコアラー
+    Mapbox APIは呼ばず、手元にある情報だけで見積もる
+    """
+    def duration(self, origin: Coordinate, destination: Coordinate) -> float:
+        """2地点間の所要時間（秒）の見積もり"""
+        raise NotImplementedError
+
+    def estimate(self, lobby, passenger_location: Coordinate, passenger_destination: Optional[Coordinate]) -> float:
+        """
+        ロビーの現在の訪問順序に乗客を最安で挿入した場合の遠回り時間（秒）を見積もる
+
+        Args:
+            lobby: 候補のRideLobby
+            passenger_location: 乗客の出発地
+            passenger_destination: 乗客の目的地（Noneの場合は乗車地点だけで見積もる）
+        """
+        dropoff = passenger_destination or passenger_location
+        driver = lobby.get_driver()
+
+        plan = lobby.route_plan
+        if plan is None:
+            if driver.user_destination is None:
+                # 目的地のないドライバーは乗車地点まで迎えに行き、降車地点まで送る
+                return self.duration(driver.user_location, passenger_location) + self.duration(passenger_location, dropoff)
+            plan = LobbyRoutePlan(driver.user_location, driver.user_destination)
+
+        coordinates = plan.candidate_coordinates(passenger_location, dropoff)
+        matrix = self._build_matrix(plan, coordinates)
+        insertion = plan.best_insertion(matrix, len(coordinates) - 2, len(coordinates) - 1)
+        return insertion[1] if insertion else float("inf")
+
+    def _build_matrix(self, plan: LobbyRoutePlan, coordinates: List[Coordinate]) -> List[List[float]]:
+        """プランで取得済みの所要時間を優先し、残りを見積もりで埋めた行列を作成"""
+        known = plan.matrix
+        size = len(coordinates)
+        matrix = [[0.0] * size for _ in range(size)]
+        for i in range(size):
+            for j in range(size):
+                if i == j:
+                    continue
+                if i < len(known) and j < len(known) and known[i][j] is not None:
+                    matrix[i][j] = known[i][j]
+                else:
+                    matrix[i][j] = self.duration(coordinates[i], coordinates[j])
+        return matrix
+
+
+class HaversineDetourScorer(DetourScorer):
+    """直線距離と平均速度から所要時間を見積もるスコアラー"""
+    def __init__(self, speed_kmh: float = 30.0, circuity: float = 1.3):
+        """
+        :param speed_kmh: 平均走行速度（km/h）
+        :param circuity: 道なりの距離が直線距離の何倍になるか
+        """
+        self.speed_kmh = speed_kmh
+        self.circuity = circuity
+
+    def duration(self, origin: Coordinate, destination: Coordinate) -> float:
+        return _haversine_km(origin, destination) * self.circuity / self.speed_kmh * 3600
+
+
+class CachedDurationDetourScorer(HaversineDetourScorer):
+    """Matrix APIで取得済みの所要時間を使い、キャッシュにない区間だけ直線距離で見積もるスコアラー"""
+    def __init__(self, matrix_cache: DurationMatrixCache, speed_kmh: float = 30.0, circuity: float = 1.3):
+        """
+        :param matrix_cache: 共有の所要時間キャッシュ
+        """
+        super().__init__(speed_kmh=speed_kmh, circuity=circuity)
+        self.matrix_cache = matrix_cache
+
+    def duration(self, origin: Coordinate, destination: Coordinate) -> float:
+        cached = self.matrix_cache.get(origin, destination)
+        if cached is not None:
+            return cached
+        return super().duration(origin, destination)
@@ -26,4 +26,27 @@ class LobbyStatus:
 class EvaluationStatus:
     """評価のステータス"""
     WAITING = "waiting"  # 評価待ち
-    COMPLETED = "completed"  # 評価済み
\ No newline at end of file
+    COMPLETED = "completed"  # 評価済み
+
+class RouteStatus:
+    """ロビーのルート生成状況"""
+    NONE = "none"        # 目的地がないためルートなし
+    PENDING = "pending"  # バックグラウンドで生成中
+    READY = "ready"      # 生成完了
+    FAILED = "failed"    # 生成失敗
+
+class SolverProfile:
+    """訪問順序計算のプロファイル"""
+    FAST = "fast"        # 初期解＋軽い改善のみ、短い制限時間
+    QUALITY = "quality"  # ガイド付き局所探索、長めの制限時間
+
+class RouteFormat:
+    """ルート取得APIのレスポンス形式"""
+    GEOJSON = "geojson"    # Directions APIと同じGeoJSON形式
+    POLYLINE = "polyline"  # エンコード済みポリライン＋概要
+
+class SlowConsumerPolicy:
+    """WebSocketの送信キューが一杯になったときの扱い"""
+    DROP_OLDEST = "drop_oldest"  # 古いメッセージを捨てて新しいメッセージを入れる
+    DROP_NEWEST = "drop_newest"  # 新しいメッセージを捨てる
+    DISCONNECT = "disconnect"    # 接続を切断する（クライアントは再接続して状態を取り直す）
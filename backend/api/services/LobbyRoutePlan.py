@@ -0,0 +1,126 @@
+from typing import Any, Dict, List, Optional, Tuple
+import math
+from services.RoutePlanner import route_cost
+
+Coordinate = Tuple[float, float]
+
+class LobbyRoutePlan:
+    """ロビーの現在の訪問順序と所要時間行列を保持し、乗客を差分で挿入するプラン"""
+    DRIVER_START = 0  # ドライバーの出発地の地点番号
+    DRIVER_END = 1    # ドライバーの目的地の地点番号
+
+    def __init__(self, driver_location: Coordinate, driver_destination: Coordinate):
+        """
+        :param driver_location: ドライバーの出発地
+        :param driver_destination: ドライバーの目的地
+        """
+        # 地点の座標（0: ドライバー出発地, 1: ドライバー目的地, 以降は乗客の乗車地・降車地の順）
+        self.coordinates: List[Coordinate] = [driver_location, driver_destination]
+        # 地点間の所要時間（未取得の要素はNone）
+        self.matrix: List[List[Optional[float]]] = [[0, None], [None, 0]]
+        # 現在の訪問順序
+        self.order: List[int] = [self.DRIVER_START, self.DRIVER_END]
+        # 乗客ID -> (乗車地の地点番号, 降車地の地点番号)
+        self.passenger_nodes: Dict[int, Tuple[int, int]] = {}
+
+    @property
+    def cost(self) -> float:
+        """現在の訪問順序の総所要時間"""
+        return route_cost(self.matrix, self.order)
+
+    def pickups_deliveries(self) -> List[Tuple[int, int]]:
+        return list(self.passenger_nodes.values())
+
+    def candidate_coordinates(self, pickup: Coordinate, dropoff: Coordinate) -> List[Coordinate]:
+        """乗客を追加した場合の地点の座標（所要時間行列の取得に使う）"""
+        return self.coordinates + [pickup, dropoff]
+
+    def best_insertion(self, matrix: List[List[Optional[float]]], pickup_node: int, dropoff_node: int) -> Optional[Tuple[List[int], float]]:
+        """
+        現在の訪問順序を崩さずに、乗車地→降車地の順で最も安く挿入できる位置を探す
+
+        Args:
+            matrix: 追加する地点を含む所要時間行列
+            pickup_node: 乗車地の地点番号
+            dropoff_node: 降車地の地点番号
+
+        Returns:
+            (挿入後の訪問順序, 挿入による増加時間)。挿入できない場合はNone
+        """
+        def cost(a: int, b: int) -> float:
+            value = matrix[a][b]
+            if value is None or not math.isfinite(value):
+                return math.inf
+            return int(value)
+
+        order = self.order
+        best: Optional[Tuple[float, int, int]] = None
+        # 出発地の後〜目的地の前の各区間に乗車地・降車地を挿入する
+        for i in range(len(order) - 1):
+            pickup_delta = cost(order[i], pickup_node) + cost(pickup_node, order[i + 1]) - cost(order[i], order[i + 1])
+            for j in range(i, len(order) - 1):
+                if j == i:
+                    # 同じ区間に続けて挿入（... a → pickup → dropoff → b ...）
+                    delta = (cost(order[i], pickup_node) + cost(pickup_node, dropoff_node)
+                             + cost(dropoff_node, order[i + 1]) - cost(order[i], order[i + 1]))
+                else:
+                    delta = (pickup_delta + cost(order[j], dropoff_node) + cost(dropoff_node, order[j + 1])
+                             - cost(order[j], order[j + 1]))
+                if best is None or delta < best[0]:
+                    best = (delta, i, j)
+
+        if best is None or math.isinf(best[0]):
+            return None
+
+        delta, i, j = best
+        new_order = order[:i + 1] + [pickup_node] + order[i + 1:j + 1] + [dropoff_node] + order[j + 1:]
+        return new_order, delta
+
+    def add_passenger(self, passenger_id: int, pickup: Coordinate, dropoff: Coordinate,
+                      matrix: List[List[Optional[float]]], order: List[int]):
+        """best_insertion の結果で乗客を追加"""
+        pickup_node = len(self.coordinates)
+        self.coordinates = self.candidate_coordinates(pickup, dropoff)
+        self.matrix = matrix
+        self.order = order
+        self.passenger_nodes[passenger_id] = (pickup_node, pickup_node + 1)
+
+    def remove_passenger(self, passenger_id: int):
+        """乗客を取り除き、残りの地点を詰めて番号を振り直す（残りの訪問順序はそのまま）"""
+        nodes = self.passenger_nodes.pop(passenger_id, None)
+        if nodes is None:
+            return
+
+        removed = set(nodes)
+        kept = [i for i in range(len(self.coordinates)) if i not in removed]
+        new_index = {old: new for new, old in enumerate(kept)}
+
+        self.coordinates = [self.coordinates[i] for i in kept]
+        self.matrix = [[self.matrix[i][j] for j in kept] for i in kept]
+        self.order = [new_index[i] for i in self.order if i not in removed]
+        self.passenger_nodes = {
+            pid: (new_index[p], new_index[d]) for pid, (p, d) in self.passenger_nodes.items()
+        }
+
+    def to_state(self) -> Dict[str, Any]:
+        """共有のロビー保存先に置くための、JSONにできる辞書（到達できない・未取得の所要時間はNone）"""
+        return {
+            "coordinates": [list(coordinate) for coordinate in self.coordinates],
+            "matrix": [
+                [float(value) if value is not None and math.isfinite(value) else None for value in row]
+                for row in self.matrix
+            ],
+            "order": list(self.order),
+            "passenger_nodes": [[pid, p, d] for pid, (p, d) in self.passenger_nodes.items()]
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "LobbyRoutePlan":
+        """to_state の辞書から復元"""
+        coordinates = [tuple(coordinate) for coordinate in state["coordinates"]]
+        plan = cls(coordinates[cls.DRIVER_START], coordinates[cls.DRIVER_END])
+        plan.coordinates = coordinates
+        plan.matrix = state["matrix"]
+        plan.order = state["order"]
+        plan.passenger_nodes = {pid: (p, d) for pid, p, d in state["passenger_nodes"]}
+        return plan
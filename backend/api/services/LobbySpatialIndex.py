@@ -0,0 +1,103 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import math
+
+# 緯度1度あたりの距離（km）
+KM_PER_DEG_LAT = 110.574
+# 赤道上での経度1度あたりの距離（km）
+KM_PER_DEG_LNG = 111.320
+
+class LobbySpatialIndex:
+    """オープン中のロビーを一様グリッドで管理する空間インデックス"""
+    def __init__(self, cell_size_deg: float = 0.02):
+        """
+        :param cell_size_deg: グリッド1セルの大きさ（度）
+        """
+        self.cell_size_deg = cell_size_deg
+        # セル -> そのセルにかかるロビーIDの集合
+        self.cells: Dict[Tuple[int, int], Set[int]] = {}
+        # ロビーID -> 登録しているセルのリスト（削除用）
+        self.lobby_cells: Dict[int, List[Tuple[int, int]]] = {}
+
+    def __contains__(self, lobby_id: int) -> bool:
+        return lobby_id in self.lobby_cells
+
+    def __len__(self) -> int:
+        return len(self.lobby_cells)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        """座標が属するセルを返す"""
+        return (math.floor(lat / self.cell_size_deg), math.floor(lng / self.cell_size_deg))
+
+    def _cells_in_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[Tuple[int, int]]:
+        """バウンディングボックスにかかるセルを列挙"""
+        lat_from, lng_from = self._cell(min_lat, min_lng)
+        lat_to, lng_to = self._cell(max_lat, max_lng)
+        return [
+            (i, j)
+            for i in range(lat_from, lat_to + 1)
+            for j in range(lng_from, lng_to + 1)
+        ]
+
+    def cells_for_points(self, points: Iterable[Optional[Tuple[float, float]]]) -> List[Tuple[int, int]]:
+        """座標の集合のバウンディングボックスにかかるセル（登録時に使う）"""
+        coords = [(float(p[0]), float(p[1])) for p in points if p is not None and p[0] is not None]
+        if not coords:
+            return []
+
+        lats = [lat for lat, _ in coords]
+        lngs = [lng for _, lng in coords]
+        return self._cells_in_bbox(min(lats), min(lngs), max(lats), max(lngs))
+
+    def cells_for_query(self, location: Tuple[float, float], radius_km: float) -> List[Tuple[int, int]]:
+        """指定地点から半径radius_km以内にかかるセル（検索時に使う）"""
+        lat, lng = float(location[0]), float(location[1])
+        d_lat = radius_km / KM_PER_DEG_LAT
+        d_lng = radius_km / (KM_PER_DEG_LNG * max(math.cos(math.radians(lat)), 0.01))
+        return self._cells_in_bbox(lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng)
+
+    def add(self, lobby_id: int, points: Iterable[Optional[Tuple[float, float]]]) -> None:
+        """
+        ロビーを登録する（登録済みの場合は置き換え）
+
+        Args:
+            lobby_id: ロビーID
+            points: ドライバーの出発地・目的地・ルート座標など (lat, lng) のリスト
+        """
+        self.remove(lobby_id)
+
+        cells = self.cells_for_points(points)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(lobby_id)
+        self.lobby_cells[lobby_id] = cells
+
+    def remove(self, lobby_id: int) -> None:
+        """ロビーを削除する（未登録の場合は何もしない）"""
+        cells = self.lobby_cells.pop(lobby_id, None)
+        if not cells:
+            return
+
+        for cell in cells:
+            lobby_ids = self.cells.get(cell)
+            if lobby_ids is None:
+                continue
+            lobby_ids.discard(lobby_id)
+            if not lobby_ids:
+                del self.cells[cell]
+
+    def query(self, location: Tuple[float, float], radius_km: float) -> Set[int]:
+        """
+        指定地点から半径radius_km以内にかかり得るロビーIDを返す
+
+        Args:
+            location: 基準点の座標 (lat, lng)
+            radius_km: 検索半径（km）
+
+        Returns:
+            候補となるロビーIDの集合（距離の厳密な判定は呼び出し側で行う）
+        """
+        candidates: Set[int] = set()
+        for cell in self.cells_for_query(location, radius_km):
+            lobby_ids = self.cells.get(cell)
+            if lobby_ids:
+                candidates |= lobby_ids
+        return candidates
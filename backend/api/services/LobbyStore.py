@@ -0,0 +1,553 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import json
+import time
+import uuid
+from services.LobbySpatialIndex import LobbySpatialIndex
+
+try:
+    import redis.asyncio as aioredis  # 任意（lobby_store=redis の場合のみ必要）
+except ImportError:
+    aioredis = None
+
+# ロビー作成中のドライバーに割り当てる仮のロビーID（DBのIDは1から振られる）
+CREATING_LOBBY = 0
+
+class LobbyLockTimeout(Exception):
+    """ロビーのロックを制限時間内に取得できなかった"""
+    pass
+
+
+class LobbyLockLost(Exception):
+    """ロビーのロックの有効期限が切れて他のワーカーに取られたため、保存しなかった"""
+    pass
+
+
+class LobbyStore:
+    """
+    ロビーの状態（ロビー本体・ユーザーの所属・空間インデックス）の保存先の共通インターフェース
+
+    ロビーを変更するときは lock(lobby_id) の中で get し直し、変更後に save する。
+    ユーザーの所属は claim_user で「未所属の場合のみ」設定するため、複数のロビーへの同時参加は起きない。
+    """
+    def lock(self, lobby_id: int):
+        """ロビー単位の排他ロック（async with で使う）"""
+        raise NotImplementedError
+
+    async def get(self, lobby_id: int) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def get_many(self, lobby_ids: Iterable[int]) -> List[Any]:
+        """存在するロビーだけを返す"""
+        raise NotImplementedError
+
+    async def all(self) -> List[Any]:
+        raise NotImplementedError
+
+    async def add(self, lobby: Any, user_ids: Iterable[int]):
+        """ロビーを登録し、ユーザー（ドライバー）の所属を設定する"""
+        raise NotImplementedError
+
+    async def save(self, lobby: Any):
+        """変更したロビーを保存する（ロビーのロックの中で呼ぶ）"""
+        raise NotImplementedError
+
+    async def save_route(self, lobby: Any):
+        """ロビーのルートを保存する（ルートは大きいため、変わったときだけ保存する）"""
+        raise NotImplementedError
+
+    async def remove(self, lobby_id: int, user_ids: Iterable[int]):
+        """ロビーを削除し、このロビーに所属しているユーザーの所属を外す"""
+        raise NotImplementedError
+
+    async def get_user_lobby(self, user_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    async def claim_user(self, user_id: int, lobby_id: int) -> bool:
+        """ユーザーがどのロビーにも所属していない場合のみ所属を設定する（成功したらTrue）"""
+        raise NotImplementedError
+
+    async def release_user(self, user_id: int, lobby_id: int):
+        """ユーザーがこのロビーに所属している場合のみ所属を外す"""
+        raise NotImplementedError
+
+    async def index(self, lobby_id: int, points: List[Optional[Tuple[float, float]]], reindex: bool = False):
+        """ロビーを空間インデックスに登録（登録済みの場合は reindex=True のときだけ登録し直す）"""
+        raise NotImplementedError
+
+    async def unindex(self, lobby_id: int):
+        raise NotImplementedError
+
+    async def query(self, location: Tuple[float, float], radius_km: float) -> Set[int]:
+        """指定地点から半径radius_km以内にかかり得るロビーID"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryLobbyStore(LobbyStore):
+    """プロセス内の辞書に保持する（単一ワーカー用）"""
+    def __init__(self, cell_size_deg: float = 0.02):
+        """
+        :param cell_size_deg: 空間インデックスのセルサイズ（度）
+        """
+        # 辞書の操作の間に await を挟まないため、ロビー単位のロック以外のロックは不要
+        self.lobbies: Dict[int, Any] = {}
+        self.user_lobbies: Dict[int, int] = {}
+        self.spatial_index = LobbySpatialIndex(cell_size_deg=cell_size_deg)
+        self.locks: Dict[int, asyncio.Lock] = {}
+
+    @asynccontextmanager
+    async def lock(self, lobby_id: int) -> AsyncIterator[None]:
+        lock = self.locks.setdefault(lobby_id, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            # 削除されたロビーのロックは残さない
+            if lobby_id not in self.lobbies and not lock.locked():
+                self.locks.pop(lobby_id, None)
+
+    async def get(self, lobby_id: int) -> Optional[Any]:
+        return self.lobbies.get(lobby_id)
+
+    async def get_many(self, lobby_ids: Iterable[int]) -> List[Any]:
+        return [self.lobbies[lobby_id] for lobby_id in lobby_ids if lobby_id in self.lobbies]
+
+    async def all(self) -> List[Any]:
+        return list(self.lobbies.values())
+
+    async def add(self, lobby: Any, user_ids: Iterable[int]):
+        self.lobbies[lobby.lobby_id] = lobby
+        for user_id in user_ids:
+            self.user_lobbies[user_id] = lobby.lobby_id
+
+    async def save(self, lobby: Any):
+        pass  # 同じオブジェクトを保持しているため不要
+
+    async def save_route(self, lobby: Any):
+        pass
+
+    async def remove(self, lobby_id: int, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            if self.user_lobbies.get(user_id) == lobby_id:
+                del self.user_lobbies[user_id]
+        self.lobbies.pop(lobby_id, None)
+        self.spatial_index.remove(lobby_id)
+
+    async def get_user_lobby(self, user_id: int) -> Optional[int]:
+        return self.user_lobbies.get(user_id)
+
+    async def claim_user(self, user_id: int, lobby_id: int) -> bool:
+        if user_id in self.user_lobbies:
+            return False
+        self.user_lobbies[user_id] = lobby_id
+        return True
+
+    async def release_user(self, user_id: int, lobby_id: int):
+        if self.user_lobbies.get(user_id) == lobby_id:
+            del self.user_lobbies[user_id]
+
+    async def index(self, lobby_id: int, points: List[Optional[Tuple[float, float]]], reindex: bool = False):
+        if lobby_id not in self.lobbies:
+            return
+        if reindex or lobby_id not in self.spatial_index:
+            self.spatial_index.add(lobby_id, points)
+
+    async def unindex(self, lobby_id: int):
+        self.spatial_index.remove(lobby_id)
+
+    async def query(self, location: Tuple[float, float], radius_km: float) -> Set[int]:
+        return self.spatial_index.query(location, radius_km)
+
+
+class SharedStateBackend:
+    """SharedLobbyStore が使うキー・バリューストアの操作（Redisと同じ意味）"""
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, nx: bool = False, px: Optional[int] = None) -> bool:
+        """値を設定（nx=True の場合はキーがないときだけ。px はミリ秒の有効期限）"""
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        """値が一致する場合のみ削除（アトミック）"""
+        raise NotImplementedError
+
+    async def expire_if_equal(self, key: str, value: str, px: int) -> bool:
+        """値が一致する場合のみ有効期限を px ミリ秒後に延ばす（アトミック）"""
+        raise NotImplementedError
+
+    async def set_if_equal(self, check_key: str, check_value: str, key: str, value: str) -> bool:
+        """check_key の値が check_value の場合のみ key に value を設定（アトミック）"""
+        raise NotImplementedError
+
+    async def sadd(self, key: str, *members: str):
+        raise NotImplementedError
+
+    async def srem(self, key: str, *members: str):
+        raise NotImplementedError
+
+    async def smembers(self, key: str) -> Set[str]:
+        raise NotImplementedError
+
+    async def sunion(self, keys: List[str]) -> Set[str]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalStateBackend(SharedStateBackend):
+    """プロセス内でRedisの代わりをする実装（テスト・動作確認用）"""
+    def __init__(self):
+        # キー -> (値, 有効期限（monotonic）またはNone)
+        self.values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.sets: Dict[str, Set[str]] = {}
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._get(key)
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return [self._get(key) for key in keys]
+
+    async def set(self, key: str, value: str, nx: bool = False, px: Optional[int] = None) -> bool:
+        if nx and self._get(key) is not None:
+            return False
+        self.values[key] = (value, time.monotonic() + px / 1000 if px is not None else None)
+        return True
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.values.pop(key, None)
+            self.sets.pop(key, None)
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        if self._get(key) != value:
+            return False
+        del self.values[key]
+        return True
+
+    async def expire_if_equal(self, key: str, value: str, px: int) -> bool:
+        if self._get(key) != value:
+            return False
+        self.values[key] = (value, time.monotonic() + px / 1000)
+        return True
+
+    async def set_if_equal(self, check_key: str, check_value: str, key: str, value: str) -> bool:
+        if self._get(check_key) != check_value:
+            return False
+        self.values[key] = (value, None)
+        return True
+
+    async def sadd(self, key: str, *members: str):
+        self.sets.setdefault(key, set()).update(members)
+
+    async def srem(self, key: str, *members: str):
+        members_set = self.sets.get(key)
+        if members_set is None:
+            return
+        members_set.difference_update(members)
+        if not members_set:
+            del self.sets[key]
+
+    async def smembers(self, key: str) -> Set[str]:
+        return set(self.sets.get(key, ()))
+
+    async def sunion(self, keys: List[str]) -> Set[str]:
+        result: Set[str] = set()
+        for key in keys:
+            result |= self.sets.get(key, set())
+        return result
+
+
+class RedisStateBackend(SharedStateBackend):
+    """Redisを使う実装"""
+    # 値が一致する場合のみ削除するスクリプト（ロックの解放・所属の解除に使う）
+    DELETE_IF_EQUAL_SCRIPT = """
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("DEL", KEYS[1])
+    end
+    return 0
+    """
+    # 値が一致する場合のみ有効期限を延ばすスクリプト（ロックの延長に使う）
+    EXPIRE_IF_EQUAL_SCRIPT = """
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    # 別のキーの値が一致する場合のみ設定するスクリプト（ロックを持っているか確認してからロビーを保存する）
+    SET_IF_EQUAL_SCRIPT = """
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        redis.call("SET", KEYS[2], ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url: str):
+        """
+        :param url: RedisのURL（redis://host:6379/0 など）
+        """
+        if aioredis is None:
+            raise RuntimeError("lobby_store=redis には redis パッケージが必要です（poetry install --extras redis）")
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self.delete_if_equal_script = self.client.register_script(self.DELETE_IF_EQUAL_SCRIPT)
+        self.expire_if_equal_script = self.client.register_script(self.EXPIRE_IF_EQUAL_SCRIPT)
+        self.set_if_equal_script = self.client.register_script(self.SET_IF_EQUAL_SCRIPT)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(key)
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        return await self.client.mget(keys)
+
+    async def set(self, key: str, value: str, nx: bool = False, px: Optional[int] = None) -> bool:
+        return bool(await self.client.set(key, value, nx=nx, px=px))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        return bool(await self.delete_if_equal_script(keys=[key], args=[value]))
+
+    async def expire_if_equal(self, key: str, value: str, px: int) -> bool:
+        return bool(await self.expire_if_equal_script(keys=[key], args=[value, px]))
+
+    async def set_if_equal(self, check_key: str, check_value: str, key: str, value: str) -> bool:
+        return bool(await self.set_if_equal_script(keys=[check_key, key], args=[check_value, value]))
+
+    async def sadd(self, key: str, *members: str):
+        if members:
+            await self.client.sadd(key, *members)
+
+    async def srem(self, key: str, *members: str):
+        if members:
+            await self.client.srem(key, *members)
+
+    async def smembers(self, key: str) -> Set[str]:
+        return set(await self.client.smembers(key))
+
+    async def sunion(self, keys: List[str]) -> Set[str]:
+        if not keys:
+            return set()
+        return set(await self.client.sunion(keys))
+
+    async def close(self):
+        await self.client.close()
+
+
+class SharedLobbyStore(LobbyStore):
+    """
+    複数のワーカー・ノードで共有するキー・バリューストアに保持する
+
+    ロビーはJSONにして保存し、ルート（座標列）は変わったときだけ別のキーに保存する。
+    ロビーのロックは有効期限付きのキーで取り、同じワーカー内の待ち合わせはプロセス内のロックで行う。
+    ロックを持っている間は有効期限を延長し続け、ロック中の保存はロックがまだ自分のものである場合だけ行う
+    （延長できずに他のワーカーに取られた場合は LobbyLockLost を投げ、相手の変更を上書きしない）。
+    """
+    def __init__(self,
+                 backend: SharedStateBackend,
+                 lobby_class: Any,
+                 cell_size_deg: float = 0.02,
+                 prefix: str = "ridelink:",
+                 lock_ttl_ms: int = 30000,
+                 lock_timeout_ms: int = 10000):
+        """
+        :param backend: キー・バリューストア（RedisStateBackend / LocalStateBackend）
+        :param lobby_class: to_state / route_state / from_state を持つロビーのクラス
+        :param cell_size_deg: 空間インデックスのセルサイズ（度）
+        :param prefix: キーの接頭辞
+        :param lock_ttl_ms: ロビーのロックの有効期限（ミリ秒）。ロック中はこの1/3ごとに延長し、ワーカーが落ちた場合はこの時間で解放される
+        :param lock_timeout_ms: ロビーのロックを待つ時間の上限（ミリ秒）
+        """
+        self.backend = backend
+        self.lobby_class = lobby_class
+        self.prefix = prefix
+        self.lock_ttl_ms = lock_ttl_ms
+        self.lock_timeout_ms = lock_timeout_ms
+        self.spatial_index = LobbySpatialIndex(cell_size_deg=cell_size_deg)  # セルの計算のみに使う
+        self.local_locks: Dict[int, asyncio.Lock] = {}
+        # ロビーID -> このワーカーが持っているロックのトークン（ロック中の保存で確認する）
+        self.held_tokens: Dict[int, str] = {}
+        # ロビーID -> 最後に復元したロビー（ルートが変わっていなければ座標列・近傍探索用のデータを使い回す）
+        self.route_cache: Dict[int, Any] = {}
+
+    def _key(self, *parts: Any) -> str:
+        return self.prefix + ":".join(str(part) for part in parts)
+
+    @asynccontextmanager
+    async def lock(self, lobby_id: int) -> AsyncIterator[None]:
+        local_lock = self.local_locks.setdefault(lobby_id, asyncio.Lock())
+        try:
+            async with local_lock:
+                key = self._key("lock", lobby_id)
+                token = uuid.uuid4().hex
+                deadline = time.monotonic() + self.lock_timeout_ms / 1000
+                delay = 0.005
+                while not await self.backend.set(key, token, nx=True, px=self.lock_ttl_ms):
+                    if time.monotonic() > deadline:
+                        raise LobbyLockTimeout(f"ロビー {lobby_id} のロックを取得できませんでした")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.1)
+                self.held_tokens[lobby_id] = token
+                heartbeat = asyncio.create_task(self._keep_lease(lobby_id, key, token))
+                try:
+                    yield
+                finally:
+                    heartbeat.cancel()
+                    try:
+                        await heartbeat
+                    except asyncio.CancelledError:
+                        pass
+                    self.held_tokens.pop(lobby_id, None)
+                    await self.backend.delete_if_equal(key, token)
+        finally:
+            if not local_lock.locked():
+                self.local_locks.pop(lobby_id, None)
+
+    async def _keep_lease(self, lobby_id: int, key: str, token: str):
+        """ロックを持っている間、有効期限の1/3ごとに延長する（延長できなかった場合はやめる）"""
+        while True:
+            await asyncio.sleep(self.lock_ttl_ms / 3000)
+            if not await self.backend.expire_if_equal(key, token, self.lock_ttl_ms):
+                print(f"⚠️ ロビー {lobby_id} のロックの有効期限が切れ、他のワーカーに取られた可能性があります")
+                return
+
+    async def _write(self, lobby_id: int, key: str, value: str):
+        """ロビーのキーに書き込む（ロック中は、ロックがまだ自分のものである場合のみ）"""
+        token = self.held_tokens.get(lobby_id)
+        if token is None:
+            await self.backend.set(key, value)
+        elif not await self.backend.set_if_equal(self._key("lock", lobby_id), token, key, value):
+            raise LobbyLockLost(f"ロビー {lobby_id} のロックを失ったため保存しませんでした")
+
+    def _decode(self, state: Dict[str, Any], route: Optional[Dict[str, Any]]) -> Any:
+        """保存した辞書からロビーを復元（route がNoneの場合は前回復元したロビーのルートを使い回す）"""
+        lobby_id = state["lobby_id"]
+        cached = self.route_cache.get(lobby_id)
+        if route is None and cached is not None and cached.route_version == state["route_version"]:
+            lobby = self.lobby_class.from_state(state, route_from=cached)
+        else:
+            lobby = self.lobby_class.from_state(state, route=route or {})
+        self.route_cache[lobby_id] = lobby
+        return lobby
+
+    def _needs_route(self, state: Dict[str, Any]) -> bool:
+        cached = self.route_cache.get(state["lobby_id"])
+        return cached is None or cached.route_version != state["route_version"]
+
+    async def get(self, lobby_id: int) -> Optional[Any]:
+        lobbies = await self.get_many([lobby_id])
+        return lobbies[0] if lobbies else None
+
+    async def get_many(self, lobby_ids: Iterable[int]) -> List[Any]:
+        lobby_ids = list(lobby_ids)
+        raws = await self.backend.mget([self._key("lobby", lobby_id) for lobby_id in lobby_ids])
+
+        states = []
+        for lobby_id, raw in zip(lobby_ids, raws):
+            if raw is None:
+                self.route_cache.pop(lobby_id, None)
+                continue
+            states.append(json.loads(raw))
+
+        # ルートが変わったロビーだけルートを取得する
+        # （取得を待つ間に他の処理が remove・get_many でキャッシュを外すことがあるため、外れたものは取り直す）
+        routes: Dict[int, Dict[str, Any]] = {}
+        while True:
+            route_ids = [state["lobby_id"] for state in states if state["lobby_id"] not in routes and self._needs_route(state)]
+            if not route_ids:
+                break
+            route_raws = await self.backend.mget([self._key("route", lobby_id) for lobby_id in route_ids])
+            routes.update({lobby_id: json.loads(raw) if raw else {} for lobby_id, raw in zip(route_ids, route_raws)})
+
+        # ここから復元までは await を挟まないため、キャッシュは確認したときのまま
+        return [self._decode(state, routes.get(state["lobby_id"])) for state in states]
+
+    async def all(self) -> List[Any]:
+        lobby_ids = await self.backend.smembers(self._key("lobbies"))
+        return await self.get_many(sorted(int(lobby_id) for lobby_id in lobby_ids))
+
+    async def add(self, lobby: Any, user_ids: Iterable[int]):
+        await self.save_route(lobby)
+        await self.save(lobby)
+        await self.backend.sadd(self._key("lobbies"), str(lobby.lobby_id))
+        for user_id in user_ids:
+            await self.backend.set(self._key("user", user_id), str(lobby.lobby_id))
+
+    async def save(self, lobby: Any):
+        await self._write(lobby.lobby_id, self._key("lobby", lobby.lobby_id), json.dumps(lobby.to_state(), ensure_ascii=False))
+
+    async def save_route(self, lobby: Any):
+        await self._write(lobby.lobby_id, self._key("route", lobby.lobby_id), json.dumps(lobby.route_state(), ensure_ascii=False))
+        self.route_cache[lobby.lobby_id] = lobby
+
+    async def remove(self, lobby_id: int, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            await self.backend.delete_if_equal(self._key("user", user_id), str(lobby_id))
+        await self.unindex(lobby_id)
+        await self.backend.srem(self._key("lobbies"), str(lobby_id))
+        await self.backend.delete(self._key("lobby", lobby_id), self._key("route", lobby_id))
+        self.route_cache.pop(lobby_id, None)
+
+    async def get_user_lobby(self, user_id: int) -> Optional[int]:
+        value = await self.backend.get(self._key("user", user_id))
+        return int(value) if value is not None else None
+
+    async def claim_user(self, user_id: int, lobby_id: int) -> bool:
+        return await self.backend.set(self._key("user", user_id), str(lobby_id), nx=True)
+
+    async def release_user(self, user_id: int, lobby_id: int):
+        await self.backend.delete_if_equal(self._key("user", user_id), str(lobby_id))
+
+    async def index(self, lobby_id: int, points: List[Optional[Tuple[float, float]]], reindex: bool = False):
+        cells_key = self._key("cells", lobby_id)
+        if not reindex and await self.backend.get(cells_key) is not None:
+            return
+        if await self.backend.get(self._key("lobby", lobby_id)) is None:
+            return
+
+        await self.unindex(lobby_id)
+        cells = self.spatial_index.cells_for_points(points)
+        for cell in cells:
+            await self.backend.sadd(self._key("cell", *cell), str(lobby_id))
+        await self.backend.set(cells_key, json.dumps(cells))
+
+    async def unindex(self, lobby_id: int):
+        cells_key = self._key("cells", lobby_id)
+        raw = await self.backend.get(cells_key)
+        if raw is None:
+            return
+        for cell in json.loads(raw):
+            await self.backend.srem(self._key("cell", *cell), str(lobby_id))
+        await self.backend.delete(cells_key)
+
+    async def query(self, location: Tuple[float, float], radius_km: float) -> Set[int]:
+        keys = [self._key("cell", *cell) for cell in self.spatial_index.cells_for_query(location, radius_km)]
+        return {int(lobby_id) for lobby_id in await self.backend.sunion(keys)}
+
+    async def close(self):
+        await self.backend.close()
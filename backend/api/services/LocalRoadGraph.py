@@ -0,0 +1,188 @@
+from typing import List, Optional, Tuple
+import heapq
+import math
+import numpy as np
+from services.RouteCorridor import EARTH_RADIUS_KM
+
+Coordinate = Tuple[float, float]
+
+class LocalRoadGraph:
+    """
+    OSMから作成した道路グラフ（CSR形式の有向グラフ）
+
+    .npz ファイルには次の配列を保存しておく
+        indptr:    (ノード数 + 1,) 各ノードの出る辺が indices 上で始まる位置
+        indices:   (辺数,) 辺の行き先ノード
+        durations: (辺数,) 辺の所要時間（秒）
+        lat, lng:  (ノード数,) ノードの座標
+        distances: (辺数,) 辺の長さ（メートル、任意。あればA*の推定に使う）
+    """
+    def __init__(self,
+                 indptr: np.ndarray,
+                 indices: np.ndarray,
+                 durations: np.ndarray,
+                 lat: np.ndarray,
+                 lng: np.ndarray,
+                 distances: Optional[np.ndarray] = None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.node_count = len(self.lat)
+        # 探索中はPythonのリストの方が要素アクセスが速い
+        self.indptr: List[int] = np.asarray(indptr).tolist()
+        self.indices: List[int] = np.asarray(indices).tolist()
+        self.durations: List[float] = np.asarray(durations, dtype=np.float64).tolist()
+        self.distances: Optional[List[float]] = None
+        # A*の推定に使う最高速度（m/s）。距離がない場合は推定なし（ダイクストラ）
+        self.max_speed: Optional[float] = None
+
+        if distances is not None:
+            distances = np.asarray(distances, dtype=np.float64)
+            self.distances = distances.tolist()
+            durations_array = np.asarray(durations, dtype=np.float64)
+            moving = durations_array > 0
+            if moving.any():
+                self.max_speed = float((distances[moving] / durations_array[moving]).max())
+
+        # 最近傍ノードの探索用（正距円筒図法の平面座標）
+        self.cos_lat = math.cos(math.radians(float(self.lat.mean()))) if self.node_count else 1.0
+        self.lat_rad = np.radians(self.lat).tolist()
+        self.lng_rad = np.radians(self.lng).tolist()
+
+    @classmethod
+    def load(cls, path: str) -> "LocalRoadGraph":
+        """.npz ファイルから道路グラフを読み込む"""
+        with np.load(path) as data:
+            graph = cls(
+                indptr=data["indptr"],
+                indices=data["indices"],
+                durations=data["durations"],
+                lat=data["lat"],
+                lng=data["lng"],
+                distances=data["distances"] if "distances" in data.files else None
+            )
+        print(f"道路グラフを読み込みました: ノード数 {graph.node_count}, 辺数 {len(graph.indices)}")
+        return graph
+
+    def snap(self, coordinate: Coordinate) -> int:
+        """座標に最も近いノードを返す"""
+        dy = self.lat - float(coordinate[0])
+        dx = (self.lng - float(coordinate[1])) * self.cos_lat
+        return int(np.argmin(dx * dx + dy * dy))
+
+    def node_coordinate(self, node: int) -> Coordinate:
+        return (float(self.lat[node]), float(self.lng[node]))
+
+    def _straight_meters(self, a: int, b: int) -> float:
+        """2ノード間の大圏距離（メートル）"""
+        lat1, lng1 = self.lat_rad[a], self.lng_rad[a]
+        lat2, lng2 = self.lat_rad[b], self.lng_rad[b]
+        h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * 1000 * math.asin(math.sqrt(min(h, 1.0)))
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[float, float, List[int]]]:
+        """
+        A*（距離がない場合はダイクストラ）で最短時間の経路を探索
+
+        Returns:
+            (所要時間（秒）, 距離（メートル）, 経由ノードのリスト)。到達できない場合はNone
+        """
+        if source == target:
+            return 0.0, 0.0, [source]
+
+        def heuristic(node: int) -> float:
+            if self.max_speed is None:
+                return 0.0
+            return self._straight_meters(node, target) / self.max_speed
+
+        indptr, indices, durations = self.indptr, self.indices, self.durations
+        best = {source: 0.0}
+        previous = {source: (-1, -1)}  # ノード -> (直前のノード, 通った辺)
+        heap = [(heuristic(source), 0.0, source)]
+        settled = set()
+
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == target:
+                break
+
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[edge]
+                new_cost = cost + durations[edge]
+                if new_cost < best.get(neighbor, math.inf):
+                    best[neighbor] = new_cost
+                    previous[neighbor] = (node, edge)
+                    heapq.heappush(heap, (new_cost + heuristic(neighbor), new_cost, neighbor))
+
+        if target not in settled:
+            return None
+
+        nodes = []
+        distance = 0.0
+        node = target
+        while node != -1:
+            nodes.append(node)
+            node, edge = previous[node]
+            if edge != -1 and self.distances is not None:
+                distance += self.distances[edge]
+        nodes.reverse()
+
+        if self.distances is None:
+            # 距離がないグラフでは直線距離の合計で代用
+            distance = sum(self._straight_meters(a, b) for a, b in zip(nodes, nodes[1:]))
+
+        return best[target], distance, nodes
+
+    def many_to_many(self, sources: List[int], targets: List[int]) -> np.ndarray:
+        """
+        複数の出発ノードから複数の目的ノードへの最短所要時間をまとめて計算
+        出発ノードごとに1回ずつダイクストラ探索し（重複した出発ノードは1回にまとめる）、
+        各探索は全ての目的ノードが確定した時点で打ち切る
+
+        Returns:
+            (len(sources), len(targets)) の所要時間（秒）。到達できない組み合わせは inf
+        """
+        result = np.full((len(sources), len(targets)), np.inf, dtype=np.float64)
+        target_columns: dict = {}
+        for col, target in enumerate(targets):
+            target_columns.setdefault(target, []).append(col)
+
+        source_rows: dict = {}
+        for row, source in enumerate(sources):
+            source_rows.setdefault(source, []).append(row)
+
+        for source, rows in source_rows.items():
+            distances = self._dijkstra_to_targets(source, set(target_columns))
+            for target, columns in target_columns.items():
+                duration = distances.get(target)
+                if duration is not None:
+                    result[np.ix_(rows, columns)] = duration
+
+        return result
+
+    def _dijkstra_to_targets(self, source: int, targets: set) -> dict:
+        """1つの出発ノードから、指定した全ノードが確定するまでダイクストラ探索"""
+        indptr, indices, durations = self.indptr, self.indices, self.durations
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = {}
+        remaining = len(targets)
+
+        while heap and remaining:
+            cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = cost
+            if node in targets:
+                remaining -= 1
+
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[edge]
+                new_cost = cost + durations[edge]
+                if new_cost < best.get(neighbor, math.inf):
+                    best[neighbor] = new_cost
+                    heapq.heappush(heap, (new_cost, neighbor))
+
+        return {target: settled[target] for target in targets if target in settled}
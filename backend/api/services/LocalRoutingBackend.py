@@ -0,0 +1,79 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import numpy as np
+from services.LocalRoadGraph import LocalRoadGraph
+from services.RoutingBackend import RoutingBackend
+
+Coordinate = Tuple[float, float]
+
+class LocalRoutingBackend(RoutingBackend):
+    """手元の道路グラフで経路探索するバックエンド（負荷試験・CIやMapboxのレート制限回避用）"""
+    name = "local"
+
+    def __init__(self, graph: LocalRoadGraph):
+        """
+        :param graph: 読み込み済みの道路グラフ
+        """
+        self.graph = graph
+
+    async def matrix(self, coordinates: List[Coordinate], sources: List[int], destinations: List[int]) -> List[List[Optional[float]]]:
+        return await asyncio.to_thread(self._matrix, coordinates, sources, destinations)
+
+    def _matrix(self, coordinates: List[Coordinate], sources: List[int], destinations: List[int]) -> List[List[Optional[float]]]:
+        nodes = [self.graph.snap(coordinate) for coordinate in coordinates]
+        durations = self.graph.many_to_many([nodes[i] for i in sources], [nodes[j] for j in destinations])
+        # 他のバックエンドと同じく、経路がない組み合わせはNoneで返す
+        return [[float(value) if np.isfinite(value) else None for value in row] for row in durations]
+
+    async def directions(self, coordinates: List[Coordinate], options: Dict[str, str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._directions, coordinates, options)
+
+    def _directions(self, coordinates: List[Coordinate], options: Dict[str, str]) -> Dict[str, Any]:
+        """経由地の間を順に探索し、Mapbox Directions APIと同じ形式で返す"""
+        nodes = [self.graph.snap(coordinate) for coordinate in coordinates]
+        with_steps = options.get("steps") == "true"
+
+        legs = []
+        route_nodes: List[int] = []
+        for source, target in zip(nodes, nodes[1:]):
+            path = self.graph.shortest_path(source, target)
+            if path is None:
+                return {"code": "NoRoute", "message": "経路が見つかりませんでした", "routes": []}
+
+            duration, distance, leg_nodes = path
+            leg_geometry = {
+                "type": "LineString",
+                "coordinates": [[lng, lat] for lat, lng in map(self.graph.node_coordinate, leg_nodes)]
+            }
+            steps = []
+            if with_steps:
+                # 曲がる方向などの案内はないため、区間全体を1ステップとして返す
+                steps.append({
+                    "duration": duration,
+                    "distance": distance,
+                    "geometry": leg_geometry,
+                    "maneuver": {"type": "depart", "location": leg_geometry["coordinates"][0]}
+                })
+            legs.append({"duration": duration, "distance": distance, "summary": "", "steps": steps})
+
+            # 区間の境目のノードが重複しないようにつなげる
+            route_nodes.extend(leg_nodes if not route_nodes else leg_nodes[1:])
+
+        return {
+            "code": "Ok",
+            "routes": [{
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": [[lng, lat] for lat, lng in map(self.graph.node_coordinate, route_nodes)]
+                },
+                "legs": legs,
+                "duration": sum(leg["duration"] for leg in legs),
+                "distance": sum(leg["distance"] for leg in legs),
+                "weight": sum(leg["duration"] for leg in legs),
+                "weight_name": "duration"
+            }],
+            "waypoints": [
+                {"name": "", "location": [lng, lat]}
+                for lat, lng in map(self.graph.node_coordinate, nodes)
+            ]
+        }
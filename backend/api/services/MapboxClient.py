@@ -0,0 +1,64 @@
+from typing import Any, Dict, Optional
+import httpx
+
+MAPBOX_BASE_URL = "https://api.mapbox.com"
+
+class MapboxClient:
+    """Mapbox APIへのコネクションをアプリケーション全体で共有するクライアント"""
+    def __init__(self,
+                 max_connections: int = 20,
+                 max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0,
+                 timeout: float = 10.0,
+                 connect_timeout: float = 5.0,
+                 http2: bool = True):
+        """
+        :param max_connections: 同時接続数の上限
+        :param max_keepalive_connections: 再利用のために保持する接続数の上限
+        :param keepalive_expiry: 保持している接続を閉じるまでの時間（秒）
+        :param timeout: 読み込み・書き込み・プール待ちのタイムアウト（秒）
+        :param connect_timeout: 接続確立のタイムアウト（秒）
+        :param http2: HTTP/2を使うか（Falseの場合はHTTP/1.1）
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = http2
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """接続プールを作成（アプリ起動時に呼ぶ）"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=MAPBOX_BASE_URL,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2
+            )
+
+    async def close(self):
+        """接続プールを閉じる（アプリ終了時に呼ぶ）"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get_json(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Mapbox APIにGETリクエストを送り、JSONを返す
+
+        Args:
+            path: APIのパス（例: /directions/v5/mapbox/driving/...）
+            params: クエリパラメータ（access_tokenを含む）
+
+        Returns:
+            レスポンスのJSON
+        """
+        if self.client is None:
+            await self.start()
+
+        response = await self.client.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
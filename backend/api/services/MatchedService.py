@@ -1,7 +1,9 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from typing import Optional, Dict, Any
-from services.Enums import UserStatus
+from typing import Optional, Dict, Any, List
+from services.Enums import UserStatus, RouteFormat
+from services.RouteEncoding import compact_route, expand_route
+from config import settings
 from cruds.MatchCRUD import MatchCRUD
 from services.ConnectionManager import ConnectionManager
 import asyncio
@@ -40,10 +42,20 @@ class MatchedService:
         
         return match_user.user_status
     
-    async def get_matched_route(self, match_id: int) -> Optional[Dict[str, Any]]:
+    async def get_match_route_version(self, match_id: int) -> Optional[int]:
+        """
+        マッチのルートのバージョンを取得する（ルートのレスポンスキャッシュのキーに使う）
+        :param match_id: マッチID
+        :return: ルートのバージョン（マッチがない場合はNone）
+        """
+        return await self.match_crud.get_match_route_version(match_id)
+    
+    async def get_matched_route(self, match_id: int, route_format: str = RouteFormat.GEOJSON, include_steps: bool = False) -> Optional[Dict[str, Any]]:
         """
         マッチングされたルートを取得する
         :param match_id: マッチID
+        :param route_format: geojson（Directions APIと同じ形式）または polyline（エンコード済みポリライン）
+        :param include_steps: 案内ステップを含めるか
         :return: マッチングされたルートの情報
         """
         # マッチIDからマッチング情報を取得
@@ -51,7 +63,42 @@ class MatchedService:
         if not match:
             return None
         
-        return match.route_geojson
+        route_summary = match.route_summary
+        steps = None
+        if route_summary is None:
+            # 旧形式（レスポンス全体）で保存されたルート
+            if not match.route_geojson:
+                return None
+            route_summary, steps = compact_route(match.route_geojson, settings.route_polyline_precision)
+            if route_summary is None:
+                return None
+        elif include_steps:
+            steps = await self.match_crud.get_route_steps(match_id)
+        
+        if route_format == RouteFormat.POLYLINE:
+            route = dict(route_summary)
+            if include_steps:
+                route["steps"] = steps or []
+            return route
+        
+        return expand_route(route_summary, steps if include_steps else None)
+    
+    async def get_route_steps(self, match_id: int) -> Optional[List[List[Dict[str, Any]]]]:
+        """
+        マッチングされたルートの案内ステップを取得する
+        :param match_id: マッチID
+        :return: 区間ごとの案内ステップ
+        """
+        steps = await self.match_crud.get_route_steps(match_id)
+        if steps is not None:
+            return steps
+        
+        # 旧形式（レスポンス全体）で保存されたルート
+        match = await self.match_crud.get_match(match_id)
+        if not match or not match.route_geojson:
+            return None
+        _, steps = compact_route(match.route_geojson)
+        return steps
     
     async def get_users_by_match(self, match_id: int) -> Optional[Dict[str, Any]]:
         """
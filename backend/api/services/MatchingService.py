@@ -1,5 +1,6 @@
 from typing import List, Optional, Dict, Any, Set, Tuple
 from datetime import datetime, timedelta
+from contextvars import ContextVar
 from fastapi import WebSocket
 from sqlalchemy.orm import Session
 import asyncio
@@ -11,8 +12,22 @@ from services.RouteGenerateService import RouteGenerateService
 from config import settings
 from models.models import Match, MatchUser
 from cruds.MatchCRUD import MatchCRUD
+from dto.MatchDTO import MatchDTO, MatchUserDTO
 from services.ConnectionManager import ConnectionManager
-from services.Enums import UserRole, UserStatus, LobbyStatus
+from services.MapboxClient import MapboxClient
+from services.RoutingBackend import RoutingBackend
+from services.RouteCache import DurationMatrixCache, DirectionsCache
+from services.RouteSolver import RouteSolverPool
+from services.LobbyStore import LobbyStore, InMemoryLobbyStore, CREATING_LOBBY
+from services.RouteCorridor import RouteCorridor
+from services.LobbyRoutePlan import LobbyRoutePlan
+from services.RouteEncoding import compact_route, decode_polyline
+from services.DetourScorer import DetourScorer, HaversineDetourScorer, CachedDurationDetourScorer
+from services.Enums import UserRole, UserStatus, LobbyStatus, RouteStatus, SolverProfile
+from database import AsyncSessionLocal
+
+# リクエストごとのDBセッション（ロビー単位で並行処理するため、シングルトンに直接保持しない）
+_db_session: ContextVar[Optional[Session]] = ContextVar("matching_db_session", default=None)
 
 class UserData:
     """ユーザーのデータを保持するクラス"""
@@ -35,8 +50,10 @@ class RideLobby:
                  max_distance: float,
                  max_passengers: int,
                  preferences: Dict[str, Any] = {},
-                 route_geojson: Optional[Dict] = None,  # ルートのGeoJSON
+                 route_summary: Optional[Dict] = None,  # ルートのエンコード済みポリラインと概要
                  route_coordinates: Optional[List[Tuple[float, float]]] = None,  # ルート上の座標点リスト
+                 route_status: str = RouteStatus.NONE,  # ルートの生成状況
+                 solver_profile: str = SolverProfile.FAST,  # 確定時の訪問順序計算のプロファイル
                  ):
         self.lobby_id = lobby_id # ロビーID
         self.max_distance = max_distance # 最大距離
@@ -44,14 +61,20 @@ class RideLobby:
         self.preferences = preferences # その他の設定
         self.created_at = time.time()
         self.status = LobbyStatus.OPEN
+        self.solver_profile = solver_profile # 確定時の訪問順序計算のプロファイル
+        
         # ルート情報を追加
-        self.route_geojson = route_geojson
-        self.route_coordinates = route_coordinates or []
+        self.route_status = route_status
+        self.route_version = 0  # ルートを設定するたびに増やす（共有の保存先でルートの再取得を判定する）
+        self.set_route(route_summary, route_coordinates or [])
         
         # ロビーの人物管理: {passenger_id: {"status": status, "timestamp": time, passenger_location: (lat, lng), passenger_destination: (lat, lng)}}
         # 承認状態も含む
         self.participants: Dict[int, UserData] = {driver_id: UserData(driver_id, UserRole.DRIVER, starting_location, destination, user_status)}
         
+        # 現在の訪問順序と所要時間行列（乗客の参加ごとに差分で更新。目的地がない場合はNone）
+        self.route_plan: Optional[LobbyRoutePlan] = LobbyRoutePlan(starting_location, destination) if destination else None
+        
     def add_user(self, passenger_id: int, user_role: str, passenger_location: tuple, passenger_destination: tuple, user_status: str) -> bool:
         """ユーザーを追加"""
         # 新しいユーザーを追加
@@ -63,6 +86,61 @@ class RideLobby:
             user_status=user_status
         )
         return True
+    
+    def set_route(self, route_summary: Optional[Dict], route_coordinates: List[Tuple[float, float]]):
+        """ルート情報を設定し、近傍探索用のデータを作り直す（Directionsのレスポンス全体は保持しない）"""
+        self.route_summary = route_summary
+        self.route_coordinates = route_coordinates
+        self.route_version += 1
+        self.route_corridor = self._build_route_corridor()
+    
+    def set_encoded_route(self, route_summary: Optional[Dict]):
+        """エンコード済みポリラインだけを設定（座標列・近傍探索用のデータは最初に使うときに作る）"""
+        self.route_summary = route_summary
+        self.route_coordinates = None
+        self.route_version += 1
+    
+    @property
+    def route_coordinates(self) -> List[Tuple[float, float]]:
+        """ルート上の座標点リスト（未展開の場合はポリラインから展開する）"""
+        if self._route_coordinates is None:
+            if self.route_summary and self.route_summary.get("polyline"):
+                self._route_coordinates = [
+                    (lat, lng)
+                    for lng, lat in decode_polyline(self.route_summary["polyline"], self.route_summary.get("precision", 6))
+                ]
+            else:
+                self._route_coordinates = []
+        return self._route_coordinates
+    
+    @route_coordinates.setter
+    def route_coordinates(self, route_coordinates: Optional[List[Tuple[float, float]]]):
+        self._route_coordinates = route_coordinates
+        self._route_corridor = None
+    
+    @property
+    def route_coordinates_loaded(self) -> bool:
+        """座標列を展開済みかどうか"""
+        return self._route_coordinates is not None
+    
+    @property
+    def route_corridor(self) -> RouteCorridor:
+        """近傍探索用のデータ（未作成の場合は作成する）"""
+        if self._route_corridor is None:
+            self._route_corridor = self._build_route_corridor()
+        return self._route_corridor
+    
+    @route_corridor.setter
+    def route_corridor(self, route_corridor: Optional[RouteCorridor]):
+        self._route_corridor = route_corridor
+    
+    def _build_route_corridor(self) -> RouteCorridor:
+        # 近傍探索用のNumPy配列と、max_distanceで広げたエンベロープ・簡略化ルート
+        return RouteCorridor(
+            self.route_coordinates,
+            buffer_km=self.max_distance,
+            simplify_tolerance_km=self.max_distance
+        )
         
     def is_full(self) -> bool:
         """ロビーが満員かどうか"""
@@ -78,6 +156,7 @@ class RideLobby:
             "max_passengers": self.max_passengers,
             "current_users": len(self.participants),
             "status": self.status,
+            "route_status": self.route_status,
             "created_at": self.created_at,
             "preferences": self.preferences
         }
@@ -95,6 +174,89 @@ class RideLobby:
     def get_passengers(self) -> List[UserData]:
         """乗客情報を取得"""
         return [user for user in self.participants.values() if user.user_role == UserRole.PASSENGER]
+    
+    def get_index_points(self) -> List[Tuple[float, float]]:
+        """空間インデックスに登録する座標（出発地・目的地・ルート座標）を取得"""
+        driver = self.get_driver()
+        return [driver.user_location, driver.user_destination] + list(self.route_coordinates)
+    
+    def to_state(self) -> Dict[str, Any]:
+        """共有のロビー保存先に置くための、JSONにできる辞書（ルートは route_state で別に保存する）"""
+        return {
+            "lobby_id": self.lobby_id,
+            "max_distance": self.max_distance,
+            "max_passengers": self.max_passengers,
+            "preferences": self.preferences,
+            "created_at": self.created_at,
+            "status": self.status,
+            "route_status": self.route_status,
+            "route_version": self.route_version,
+            "solver_profile": self.solver_profile,
+            "participants": [
+                {
+                    "user_id": user.user_id,
+                    "user_role": user.user_role,
+                    "user_location": list(user.user_location) if user.user_location is not None else None,
+                    "user_destination": list(user.user_destination) if user.user_destination is not None else None,
+                    "user_status": user.user_status,
+                    "timestamp": user.timestamp
+                }
+                for user in self.participants.values()
+            ],
+            "route_plan": self.route_plan.to_state() if self.route_plan is not None else None
+        }
+    
+    def route_state(self) -> Dict[str, Any]:
+        """ルートの概要と座標列（変わったときだけ保存する。座標列が未展開の場合はポリラインのみ）"""
+        return {
+            "route_summary": self.route_summary,
+            "route_coordinates": [list(coordinate) for coordinate in self.route_coordinates] if self.route_coordinates_loaded else None
+        }
+    
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], route: Optional[Dict[str, Any]] = None, route_from: Optional["RideLobby"] = None) -> "RideLobby":
+        """
+        to_state の辞書から復元
+        :param route: route_state の辞書
+        :param route_from: ルートが同じロビー（指定した場合はルートと近傍探索用のデータを作り直さずに使う）
+        """
+        lobby = cls.__new__(cls)
+        lobby.lobby_id = state["lobby_id"]
+        lobby.max_distance = state["max_distance"]
+        lobby.max_passengers = state["max_passengers"]
+        lobby.preferences = state["preferences"]
+        lobby.created_at = state["created_at"]
+        lobby.status = state["status"]
+        lobby.route_status = state["route_status"]
+        lobby.solver_profile = state["solver_profile"]
+        
+        if route_from is not None:
+            lobby.route_summary = route_from.route_summary
+            lobby.route_coordinates = route_from._route_coordinates
+            lobby.route_corridor = route_from._route_corridor
+        else:
+            lobby.route_version = 0
+            route = route or {}
+            if route.get("route_coordinates") is None:
+                lobby.set_encoded_route(route.get("route_summary"))
+            else:
+                lobby.set_route(route.get("route_summary"), [tuple(coordinate) for coordinate in route["route_coordinates"]])
+        lobby.route_version = state["route_version"]
+        
+        lobby.participants = {}
+        for user_state in state["participants"]:
+            user = UserData(
+                user_state["user_id"],
+                user_state["user_role"],
+                tuple(user_state["user_location"]) if user_state["user_location"] is not None else None,
+                tuple(user_state["user_destination"]) if user_state["user_destination"] is not None else None,
+                user_state["user_status"]
+            )
+            user.timestamp = user_state["timestamp"]
+            lobby.participants[user.user_id] = user
+        
+        lobby.route_plan = LobbyRoutePlan.from_state(state["route_plan"]) if state["route_plan"] is not None else None
+        return lobby
 
 class MatchingService:
     _instance = None
@@ -107,22 +269,111 @@ class MatchingService:
 
     def __init__(self, db=None, connection_manager: ConnectionManager = None):
         if not self._initialized:
-            self.ride_lobbies: Dict[str, RideLobby] = {}
-            self.user_lobbies: Dict[int, str] = {}
-            self.lock = asyncio.Lock()
+            # ロビー・ユーザーの所属・空間インデックスの保存先（複数ワーカーで動かす場合はset_lobby_storeで共有の保存先に差し替える）
+            self.lobby_store: LobbyStore = InMemoryLobbyStore(cell_size_deg=settings.lobby_index_cell_deg)
+            self.route_tasks: Set[asyncio.Task] = set()  # バックグラウンドのルート生成タスク
             self.connection_manager = connection_manager  # ← 追加
+            self.batch_engine = None  # バッチマッチング（有効な場合のみ設定）
+            self.mapbox_client: Optional[MapboxClient] = None  # アプリ全体で共有するMapboxクライアント
+            self.solver_pool: Optional[RouteSolverPool] = None  # 訪問順序を計算するプール
+            self.routing_backend: Optional[RoutingBackend] = None  # 経路探索のバックエンド（未設定ならMapbox）
+            # 地点間の所要時間キャッシュ（Matrix APIの呼び出しを減らす）
+            self.matrix_cache = DurationMatrixCache(
+                precision=settings.matrix_cache_precision,
+                ttl_seconds=settings.matrix_cache_ttl_seconds,
+                max_entries=settings.matrix_cache_max_entries
+            )
+            # 経由地の並びごとのルートキャッシュ（Directions APIの呼び出しを減らす）
+            self.directions_cache = DirectionsCache(
+                precision=settings.directions_cache_precision,
+                max_bytes=settings.directions_cache_max_bytes,
+                disk_dir=settings.directions_cache_dir
+            )
+            # ロビー候補の遠回り時間を見積もるスコアラー（set_detour_scorerで差し替え可能）
+            if settings.detour_scorer == "haversine":
+                self.detour_scorer: DetourScorer = HaversineDetourScorer(
+                    speed_kmh=settings.detour_speed_kmh,
+                    circuity=settings.detour_circuity
+                )
+            else:
+                self.detour_scorer = CachedDurationDetourScorer(
+                    self.matrix_cache,
+                    speed_kmh=settings.detour_speed_kmh,
+                    circuity=settings.detour_circuity
+                )
             self._initialized = True
 
         if db is not None:
             self.set_db(db)
 
     def set_db(self, db: Session):
-        self.db = db
-        self.match_crud = MatchCRUD(self.db)
+        _db_session.set(db)
+    
+    @property
+    def db(self) -> Optional[Session]:
+        return _db_session.get()
+    
+    @property
+    def match_crud(self) -> MatchCRUD:
+        return MatchCRUD(self.db)
     
     def set_connection_manager(self, connection_manager: ConnectionManager):
         self.connection_manager = connection_manager
     
+    def set_batch_engine(self, batch_engine):
+        self.batch_engine = batch_engine
+    
+    def set_mapbox_client(self, mapbox_client: MapboxClient):
+        self.mapbox_client = mapbox_client
+    
+    def set_solver_pool(self, solver_pool: RouteSolverPool):
+        self.solver_pool = solver_pool
+    
+    def set_routing_backend(self, routing_backend: RoutingBackend):
+        self.routing_backend = routing_backend
+    
+    def set_detour_scorer(self, detour_scorer: DetourScorer):
+        self.detour_scorer = detour_scorer
+    
+    def set_lobby_store(self, lobby_store: LobbyStore):
+        self.lobby_store = lobby_store
+    
+    def _create_route_service(self, coordinates: List[Tuple[float, float]], start_index: int, end_index: int, pickups_deliveries: List[Tuple[int, int]] = [], solver_profile: Optional[str] = None) -> RouteGenerateService:
+        """共有のクライアント・キャッシュを使うRouteGenerateServiceを作成（solver_profileがNoneの場合は設定の既定値）"""
+        return RouteGenerateService(
+            api_key=settings.mapbox_api_key, # Mapbox APIキー
+            coordinates=coordinates, # 経路座標
+            pickups_deliveries=pickups_deliveries, # ピックアップとドロップオフの座標
+            start_index=start_index, # ドライバーの出発地
+            end_index=end_index, # ドライバーの目的地
+            client=self.mapbox_client, # 共有のMapboxクライアント
+            matrix_cache=self.matrix_cache, # 共有の所要時間キャッシュ
+            directions_cache=self.directions_cache, # 共有のルートキャッシュ
+            solver_pool=self.solver_pool, # 共有の経路計算プール
+            solver_profile=solver_profile or settings.route_solver_profile, # 訪問順序計算のプロファイル
+            solver_time_limit_ms=settings.route_solver_time_limit_ms, # 訪問順序計算の制限時間
+            exact_max_pairs=settings.route_exact_max_passengers, # 全列挙で解く乗客数の上限
+            backend=self.routing_backend # 経路探索のバックエンド
+        )
+    
+    async def _refresh_lobby_index(self, lobby: RideLobby, reindex: bool = False):
+        """ロビーの状態に合わせて空間インデックスを更新（参加可能なロビーのみ登録）"""
+        if lobby.status == LobbyStatus.OPEN and not lobby.is_full():
+            await self.lobby_store.index(lobby.lobby_id, lobby.get_index_points(), reindex=reindex)
+        else:
+            await self.lobby_store.unindex(lobby.lobby_id)
+    
+    async def _find_candidate_lobbies(self, passenger_location: Tuple[float, float], passenger_destination: Optional[Tuple[float, float]], max_distance: float) -> List[RideLobby]:
+        """空間インデックスから距離制限内にかかり得るロビーを取得"""
+        lobby_ids = await self.lobby_store.query(passenger_location, max_distance)
+        if passenger_destination:
+            lobby_ids &= await self.lobby_store.query(passenger_destination, max_distance)
+        return await self.lobby_store.get_many(lobby_ids)
+    
+    async def _get_lobby(self, lobby_id: int) -> Optional[RideLobby]:
+        """ロビーを取得（変更する場合は lobby_store.lock の中で取得し直す）"""
+        return await self.lobby_store.get(lobby_id)
+    
     async def calculate_distance(self, coord1: Tuple[float, float], coord2: Tuple[float, float]) -> float:
         """2点間の距離を計算"""
         if coord1 is None or coord2 is None:
@@ -136,93 +387,263 @@ class MatchingService:
                                 destination: Optional[Tuple[float, float]] = None,
                                 max_distance: float = 5.0,
                                 max_passengers: int = 1,
-                                preferences: Dict[str, Any] = {}) -> Dict[str, Any]:
-        """ドライバーがロビーを作成"""
-        async with self.lock:
-            # ドライバーが既にロビーを持っているか確認
-            active_lobby = await self.match_crud.get_active_lobby_by_driver(driver_id)
-            if active_lobby:
-                return {"success": False, "error": "すでにロビーに所属しています"}
-            
-            # 出発地から目的地へのルートを生成
-            route_geojson = None
-            if (destination):
-                route_service = RouteGenerateService(
-                    api_key=settings.mapbox_api_key,
-                    coordinates=[starting_location, destination],
-                    
-                    start_index=0,
-                    end_index=1
-                )
-                route_data = await route_service.get_geojson_route()
-                route_coordinates = []
-
-                if route_data and 'routes' in route_data:
-                    geometry = route_data['routes'][0]['geometry']
-                    if geometry['type'] == 'LineString':
-                        route_coordinates = [(coord[1], coord[0]) for coord in geometry['coordinates']]
-            
-            # DBにロビーを保存
-            match_data = {
-                "status": LobbyStatus.OPEN,
-                "max_passengers": max_passengers,
-                "max_distance": max_distance,
-                "preferences": preferences if preferences else {},
-                "route_geojson": route_geojson
-            }
-            try:
-                match = await self.match_crud.create_match(match_data) # コミットはしていない
-            except Exception as e:
-                return {"success": False, "error": f"DB保存に失敗しました: {str(e)}"}
+                                preferences: Dict[str, Any] = {},
+                                solver_profile: Optional[str] = None) -> Dict[str, Any]:
+        """
+        ドライバーがロビーを作成
+        :param solver_profile: マッチング確定時の訪問順序計算のプロファイル（Noneの場合は設定の既定値）
+        """
+        solver_profile = solver_profile or settings.route_solver_profile
+        if solver_profile not in (SolverProfile.FAST, SolverProfile.QUALITY):
+            return {"success": False, "error": f"不明なプロファイルです: {solver_profile}"}
+        
+        # 同じドライバーの同時作成を防ぐ（作成中は仮のロビーIDで所属を確保する）
+        if not await self.lobby_store.claim_user(driver_id, CREATING_LOBBY):
+            return {"success": False, "error": "すでにロビーに所属しています"}
+        
+        try:
+            return await self._create_driver_lobby(driver_id, starting_location, destination, max_distance, max_passengers, preferences, solver_profile)
+        finally:
+            # 作成に成功した場合は所属がロビーIDに置き換わっているため、失敗した場合のみ外れる
+            await self.lobby_store.release_user(driver_id, CREATING_LOBBY)
+    
+    async def _create_driver_lobby(self, 
+                                   driver_id: int,
+                                   starting_location: Tuple[float, float],
+                                   destination: Optional[Tuple[float, float]],
+                                   max_distance: float,
+                                   max_passengers: int,
+                                   preferences: Dict[str, Any],
+                                   solver_profile: str) -> Dict[str, Any]:
+        """ロビー作成の本体（DB保存はロックの外で行い、ルートはバックグラウンドで生成）"""
+        # ドライバーが既にロビーを持っているか確認
+        active_lobby = await self.match_crud.get_active_lobby_by_driver(driver_id)
+        if active_lobby:
+            return {"success": False, "error": "すでにロビーに所属しています"}
+        
+        # DBにロビーを保存（ルートは生成後に保存）
+        match_data = {
+            "status": LobbyStatus.OPEN,
+            "max_passengers": max_passengers,
+            "max_distance": max_distance,
+            # 再起動時の復元でも同じプロファイルを使うため、設定と一緒に保存する
+            "preferences": {**(preferences or {}), "solver_profile": solver_profile},
+            "route_summary": None
+        }
+        try:
+            match = await self.match_crud.create_match(match_data) # コミットはしていない
+        except Exception as e:
+            return {"success": False, "error": f"DB保存に失敗しました: {str(e)}"}
+        
+        driver_data = {
+            "match_id": match.match_id,
+            "user_id": driver_id,
+            "user_start_lat": starting_location[0],
+            "user_start_lng": starting_location[1],
+            "user_destination_lat": destination[0] if destination else None,
+            "user_destination_lng": destination[1] if destination else None,
+            "user_status": UserStatus.IN_LOBBY,
+            "user_role": UserRole.DRIVER
+        }
+        try:
+            driver = await self.match_crud.add_match_user(driver_data) # ここでコミット
+        except Exception as e:
+            return {"success": False, "error": f"DB保存に失敗しました: {str(e)}"}
+        
+        # ロビー作成（ルートは生成中）
+        lobby = RideLobby(
+            lobby_id=match.match_id,
+            driver_id=driver.user_id,
+            starting_location=(driver.user_start_lat, driver.user_start_lng),
+            destination=(driver.user_destination_lat, driver.user_destination_lng),
+            max_distance=match.max_distance,
+            max_passengers=match.max_passengers,
+            preferences=match.max_passengers,
+            user_status=driver.user_status,
+            route_status=RouteStatus.PENDING if destination else RouteStatus.NONE,
+            solver_profile=solver_profile
+        )
+        
+        # ロビーを登録
+        await self.lobby_store.add(lobby, [driver.user_id])
+        await self._refresh_lobby_index(lobby)
+        
+        # 出発地から目的地へのルートをバックグラウンドで生成
+        if destination:
+            task = asyncio.create_task(self._generate_lobby_route(lobby.lobby_id, starting_location, destination))
+            self.route_tasks.add(task)
+            task.add_done_callback(self.route_tasks.discard)
+        
+        return {
+            "success": True,
+            "lobby_id": match.match_id,
+            "lobby": lobby.to_dict()
+        }
+    
+    async def _generate_lobby_route(self, lobby_id: int, starting_location: Tuple[float, float], destination: Tuple[float, float]):
+        """ロビーのルートを生成してロビー・DBに反映し、ドライバーに通知する"""
+        route_data = None
+        route_coordinates = []
+        try:
+            route_service = self._create_route_service(
+                coordinates=[starting_location, destination],
+                start_index=0,
+                end_index=1
+            )
+            route_data = await route_service.get_geojson_route()
+        except Exception as e:
+            print(f"❌ ロビー {lobby_id} のルート生成に失敗しました: {e}")
+
+        if route_data and 'routes' in route_data:
+            geometry = route_data['routes'][0]['geometry']
+            if geometry['type'] == 'LineString':
+                route_coordinates = [(coord[1], coord[0]) for coord in geometry['coordinates']]
+        
+        async with self.lobby_store.lock(lobby_id):
+            # 生成中にロビーが閉じられた・マッチングが確定した場合は反映しない（満員で承認待ちの場合は反映する）
+            lobby = await self.lobby_store.get(lobby_id)
+            if lobby is None or lobby.status not in (LobbyStatus.OPEN, LobbyStatus.WAITING_APPROVAL):
+                return
             
-            driver_data = {
-                "match_id": match.match_id,
-                "user_id": driver_id,
-                "user_start_lat": starting_location[0],
-                "user_start_lng": starting_location[1],
-                "user_destination_lat": destination[0] if destination else None,
-                "user_destination_lng": destination[1] if destination else None,
-                "user_status": UserStatus.IN_LOBBY,
-                "user_role": UserRole.DRIVER
-            }
-            try:
-                driver = await self.match_crud.add_match_user(driver_data) # ここでコミット
-            except Exception as e:
-                return {"success": False, "error": f"DB保存に失敗しました: {str(e)}"}
+            if route_coordinates:
+                route_summary, route_steps = compact_route(route_data, settings.route_polyline_precision)
+                lobby.set_route(route_summary, route_coordinates)
+                lobby.route_status = RouteStatus.READY
+                try:
+                    async with AsyncSessionLocal() as session:
+                        await MatchCRUD(session).update_match(match_id=lobby.lobby_id, route_summary=route_summary, route_steps=route_steps)
+                except Exception as e:
+                    print(f"❌ ロビー {lobby.lobby_id} のルート保存に失敗しました: {e}")
+                await self.lobby_store.save_route(lobby)
+            else:
+                lobby.route_status = RouteStatus.FAILED
+            await self.lobby_store.save(lobby)
             
-            # ロビー作成
-            lobby = RideLobby(
-                lobby_id=match.match_id,
-                driver_id=driver.user_id,
-                starting_location=(driver.user_start_lat, driver.user_start_lng),
-                destination=(driver.user_destination_lat, driver.user_destination_lng),
-                max_distance=match.max_distance,
-                max_passengers=match.max_passengers,
-                preferences=match.max_passengers,
-                user_status=driver.user_status,
-                route_geojson=route_data,
-                route_coordinates=route_coordinates
-            )
+            # ルート座標を含めて空間インデックスに登録し直す
+            await self._refresh_lobby_index(lobby, reindex=True)
             
-            # ロビーを登録
-            self.ride_lobbies[match.match_id] = lobby
-            self.user_lobbies[driver.user_id] = match.match_id
+            if self.connection_manager:
+                await self.connection_manager.send_to_json_user(lobby.get_driver().user_id, {
+                    "type": "status_update",
+                    "lobby_id": lobby.lobby_id,
+                    "route_status": lobby.route_status
+                })
+    
+    async def restore_lobbies(self) -> int:
+        """
+        DBの募集中・承認待ちのマッチからロビーを復元する（reset_databaseを行わずに起動した場合）
+        ルートはポリラインのまま保持し、座標列の展開と空間インデックスへの登録はバックグラウンドで行う
+
+        Returns:
+            復元したロビーの数
+        """
+        async with AsyncSessionLocal() as session:
+            crud = MatchCRUD(session)
+            matches = await crud.get_matches_by_status([LobbyStatus.OPEN, LobbyStatus.WAITING_APPROVAL])
+            users_by_match = await crud.get_users_by_matches([match.match_id for match in matches])
+        
+        restored = []
+        for match in matches:
+            lobby = self._restore_lobby(match, users_by_match[match.match_id])
+            if lobby is None:
+                continue
+            # 共有の保存先に残っているロビーはそのまま使う
+            if await self.lobby_store.get(lobby.lobby_id) is not None:
+                continue
             
-            return {
-                "success": True,
-                "lobby_id": match.match_id,
-                "lobby": lobby.to_dict()
-            }
+            for user_id in lobby.participants:
+                if not await self.lobby_store.claim_user(user_id, lobby.lobby_id):
+                    print(f"⚠️ User {user_id} は別のロビーに所属しているため、ロビー {lobby.lobby_id} の所属を復元しません")
+            await self.lobby_store.add(lobby, [])
+            restored.append(lobby.lobby_id)
+        
+        if restored:
+            task = asyncio.create_task(self._index_restored_lobbies(restored))
+            self.route_tasks.add(task)
+            task.add_done_callback(self.route_tasks.discard)
+        return len(restored)
+    
+    def _restore_lobby(self, match: MatchDTO, users: List[MatchUserDTO]) -> Optional[RideLobby]:
+        """マッチとその参加者からロビーを組み立てる（DBの座標・距離はDecimalのためfloatに変換）"""
+        driver = next((user for user in users if user.user_role == UserRole.DRIVER), None)
+        if driver is None:
+            print(f"⚠️ マッチ {match.match_id} にドライバーがいないため復元しません")
+            return None
+        
+        def to_point(lat, lng) -> Optional[Tuple[float, float]]:
+            return (float(lat), float(lng)) if lat is not None and lng is not None else None
+        
+        destination = to_point(driver.user_destination_lat, driver.user_destination_lng)
+        route_summary = match.route_summary
+        if route_summary is None and match.route_geojson:
+            # 旧形式（GeoJSON）で保存されたルート
+            route_summary, _ = compact_route(match.route_geojson, settings.route_polyline_precision)
+        
+        if route_summary:
+            route_status = RouteStatus.READY
+        elif destination:
+            route_status = RouteStatus.PENDING  # 生成中に再起動したため、作り直す
+        else:
+            route_status = RouteStatus.NONE
+        
+        lobby = RideLobby(
+            lobby_id=match.match_id,
+            driver_id=driver.user_id,
+            starting_location=to_point(driver.user_start_lat, driver.user_start_lng),
+            destination=destination,
+            user_status=driver.user_status,
+            max_distance=float(match.max_distance),
+            max_passengers=match.max_passengers,
+            preferences=match.preferences or {},
+            route_status=route_status,
+            solver_profile=(match.preferences or {}).get("solver_profile", settings.route_solver_profile)
+        )
+        if route_summary:
+            lobby.set_encoded_route(route_summary)
+        lobby.status = match.status
+        if match.created_at:
+            lobby.created_at = datetime.fromisoformat(match.created_at).timestamp()
+        
+        for user in users:
+            if user.user_role == UserRole.PASSENGER:
+                lobby.add_user(
+                    user.user_id,
+                    UserRole.PASSENGER,
+                    to_point(user.user_start_lat, user.user_start_lng),
+                    to_point(user.user_destination_lat, user.user_destination_lng),
+                    user_status=user.user_status
+                )
+        if lobby.get_passengers():
+            # 所要時間行列は保存していないため、確定時に訪問順序を一から計算する
+            lobby.route_plan = None
+        return lobby
+    
+    async def _index_restored_lobbies(self, lobby_ids: List[int]):
+        """復元したロビーを空間インデックスに登録し、生成途中だったルートを作り直す"""
+        for lobby_id in lobby_ids:
+            async with self.lobby_store.lock(lobby_id):
+                lobby = await self.lobby_store.get(lobby_id)
+                if lobby is None:
+                    continue
+                await self._refresh_lobby_index(lobby)
+            
+            if lobby.route_status == RouteStatus.PENDING:
+                driver = lobby.get_driver()
+                task = asyncio.create_task(self._generate_lobby_route(lobby_id, driver.user_location, driver.user_destination))
+                self.route_tasks.add(task)
+                task.add_done_callback(self.route_tasks.discard)
+            # 座標列の展開が続いてもリクエストの処理を止めない
+            await asyncio.sleep(0)
+        print(f"✅ 復元したロビー {len(lobby_ids)} 件を空間インデックスに登録しました")
     
     async def close_lobby(self, driver_id: int, lobby_id: str) -> Dict[str, Any]:
         """ドライバーがロビーを閉じる"""
-        async with self.lock:
+        async with self.lobby_store.lock(lobby_id):
             # ロビーの存在確認
-            if lobby_id not in self.ride_lobbies:
+            lobby = await self.lobby_store.get(lobby_id)
+            if lobby is None:
                 return {"success": False, "error": "ロビーが存在しません"}
             
-            lobby = self.ride_lobbies[lobby_id]
-            
             # 権限チェック
             if lobby.get_driver().user_id != driver_id:
                 return {"success": False, "error": "ロビーを閉じる権限がありません"}
@@ -249,142 +670,230 @@ class MatchingService:
                             "lobby_id": lobby_id,
                             "message": "ドライバーがロビーを閉じました"
                         })
-                        
-                        # 乗客のロビー関連情報をクリア
-                        if passenger_id in self.user_lobbies and self.user_lobbies[passenger_id] == lobby_id:
-                            del self.user_lobbies[passenger_id]
-            
-            # ドライバーの情報もクリア
-            del self.user_lobbies[driver_id]
             
-            # ロビーを削除
-            del self.ride_lobbies[lobby_id]
+            # ロビーを削除し、ドライバー・乗客のロビー関連情報をクリア
+            await self.lobby_store.remove(lobby_id, lobby.participants.keys())
             
             return {"success": True}
     
-    async def find_random_lobby_by_distance(self, 
-                                        passenger_id: int, 
-                                        passenger_location: Tuple[float, float],
-                                        passenger_destination: Optional[Tuple[float, float]] = None,
-                                        max_distance: float = 5.0) -> Optional[Dict[str, Any]]:
-        """距離制限内のランダムなロビーを見つける（ドライバーのルートを考慮）"""
-        async with self.lock:
-            # 参加可能なロビーをフィルタリング
-            available_lobbies = []
+    async def _collect_candidates(self, 
+                                  passenger_id: int, 
+                                  passenger_location: Tuple[float, float],
+                                  passenger_destination: Optional[Tuple[float, float]] = None,
+                                  max_distance: float = 5.0) -> List[Dict[str, Any]]:
+        """距離制限内で参加可能なロビーの候補を列挙"""
+        # ロックは取らない（参加時にrequest_rideで再検証する）
+        lobbies = await self._find_candidate_lobbies(passenger_location, passenger_destination, max_distance)
+        
+        # 参加可能なロビーをフィルタリング
+        available_lobbies = []
+        
+        for lobby in lobbies:
+            # オープン状態で満員でないロビーのみ対象
+            if lobby.status != LobbyStatus.OPEN or lobby.is_full():
+                continue
             
-            for lobby in self.ride_lobbies.values():
-                # オープン状態で満員でないロビーのみ対象
-                if lobby.status != LobbyStatus.OPEN or lobby.is_full():
-                    continue
-                
-                # 既にリクエスト済みのロビーは除外
-                if passenger_id in lobby.participants:
-                    continue
-                
-                driver_id = lobby.get_driver().user_id
-                driver_data = lobby.participants[driver_id]
+            # 既にリクエスト済みのロビーは除外
+            if passenger_id in lobby.participants:
+                continue
+            
+            driver_id = lobby.get_driver().user_id
+            driver_data = lobby.participants[driver_id]
+            
+            # ルート情報があるか確認
+            if not lobby.route_coordinates or len(lobby.route_coordinates) < 2:
+                # ルート情報がない場合は従来の距離計算
+                start_distance = await self.calculate_distance(passenger_location, driver_data.user_location)
                 
-                # ルート情報があるか確認
-                if not lobby.route_coordinates or len(lobby.route_coordinates) < 2:
-                    # ルート情報がない場合は従来の距離計算
-                    start_distance = await self.calculate_distance(passenger_location, driver_data.user_location)
-                    
-                    destination_distance = float('inf')
-                    if passenger_destination and driver_data.user_destination:
-                        destination_distance = await self.calculate_distance(passenger_destination, driver_data.user_destination)
-                    
-                    if start_distance <= max_distance and (destination_distance <= max_distance or passenger_destination is None):
-                        available_lobbies.append({
-                            "lobby": lobby,
-                            "start_distance": start_distance,
-                            "destination_distance": destination_distance if destination_distance != float('inf') else None,
-                            "route_match": False
-                        })
-                    continue
+                destination_distance = float('inf')
+                if passenger_destination and driver_data.user_destination:
+                    destination_distance = await self.calculate_distance(passenger_destination, driver_data.user_destination)
                 
-                # 乗客の出発地がドライバーのルート上にあるか確認
-                pickup_point_idx, pickup_distance = await self._find_closest_point_on_route(
-                    passenger_location, 
-                    lobby.route_coordinates, 
+                if start_distance <= max_distance and (destination_distance <= max_distance or passenger_destination is None):
+                    available_lobbies.append({
+                        "lobby": lobby,
+                        "start_distance": start_distance,
+                        "destination_distance": destination_distance if destination_distance != float('inf') else None,
+                        "detour_seconds": self.detour_scorer.estimate(lobby, passenger_location, passenger_destination),
+                        "route_match": False
+                    })
+                continue
+            
+            # エンベロープで乗降地点を含み得ないロビーを先に除外
+            if not lobby.route_corridor.may_contain(passenger_location, max_distance):
+                continue
+            if passenger_destination and not lobby.route_corridor.may_contain(passenger_destination, max_distance):
+                continue
+            
+            # 乗客の出発地がドライバーのルート上にあるか確認
+            pickup_point_idx, pickup_distance = self._find_closest_point_on_route(
+                passenger_location, 
+                lobby.route_corridor, 
+                max_distance
+            )
+            
+            if pickup_point_idx == -1:
+                continue  # ルート上に乗車地点が見つからない
+            
+            # 乗客の目的地がドライバーのルート上にあるか確認
+            dropoff_point_idx = -1
+            dropoff_distance = float('inf')
+            
+            if passenger_destination:
+                dropoff_point_idx, dropoff_distance = self._find_closest_point_on_route(
+                    passenger_destination,
+                    lobby.route_corridor,
                     max_distance
                 )
                 
-                if pickup_point_idx == -1:
-                    continue  # ルート上に乗車地点が見つからない
-                
-                # 乗客の目的地がドライバーのルート上にあるか確認
-                dropoff_point_idx = -1
-                dropoff_distance = float('inf')
-                
-                if passenger_destination:
-                    dropoff_point_idx, dropoff_distance = await self._find_closest_point_on_route(
-                        passenger_destination,
-                        lobby.route_coordinates,
-                        max_distance
-                    )
-                    
-                    # 目的地が見つからない場合はスキップ
-                    if dropoff_point_idx == -1:
-                        continue
-                    
-                    # 逆走防止: 乗車地点が降車地点よりも後にある場合はスキップ
-                    if pickup_point_idx >= dropoff_point_idx:
-                        continue
+                # 目的地が見つからない場合はスキップ
+                if dropoff_point_idx == -1:
+                    continue
                 
-                # 条件を満たすロビーを追加
-                available_lobbies.append({
-                    "lobby": lobby,
-                    "start_distance": pickup_distance,
-                    "destination_distance": dropoff_distance if dropoff_distance != float('inf') else None,
-                    "pickup_idx": pickup_point_idx,
-                    "dropoff_idx": dropoff_point_idx,
-                    "route_match": True
-                })
+                # 逆走防止: 乗車地点が降車地点よりも後にある場合はスキップ
+                if pickup_point_idx >= dropoff_point_idx:
+                    continue
             
-            if not available_lobbies:
-                return None
+            # 条件を満たすロビーを追加
+            available_lobbies.append({
+                "lobby": lobby,
+                "start_distance": pickup_distance,
+                "destination_distance": dropoff_distance if dropoff_distance != float('inf') else None,
+                "pickup_idx": pickup_point_idx,
+                "dropoff_idx": dropoff_point_idx,
+                "detour_seconds": self.detour_scorer.estimate(lobby, passenger_location, passenger_destination),
+                "route_match": True
+            })
+        
+        return available_lobbies
+    
+    async def find_random_lobby_by_distance(self, 
+                                        passenger_id: int, 
+                                        passenger_location: Tuple[float, float],
+                                        passenger_destination: Optional[Tuple[float, float]] = None,
+                                        max_distance: float = 5.0) -> Optional[Dict[str, Any]]:
+        """距離制限内のランダムなロビーを見つける（ドライバーのルートを考慮）"""
+        available_lobbies = await self._collect_candidates(
+            passenger_id,
+            passenger_location,
+            passenger_destination,
+            max_distance
+        )
+        
+        if not available_lobbies:
+            return None
+        
+        # ルートマッチのあるロビーを優先
+        route_matches = [l for l in available_lobbies if l.get("route_match", False)]
+        
+        if route_matches:
+            # ルートマッチのあるロビーから選択
+            # ドライバーの遠回り時間が短い順にソート（同じなら出発地の距離が近い順）
+            route_matches.sort(key=lambda x: (x["detour_seconds"], x["start_distance"]))
             
-            # ルートマッチのあるロビーを優先
-            route_matches = [l for l in available_lobbies if l.get("route_match", False)]
+            # 遠回りが少ない上位3つのロビーからランダムに選択
+            top_count = min(3, len(route_matches))
+            selected = random.choice(route_matches[:top_count])
+        else:
+            # ルートマッチがない場合も遠回り時間の短い順に選択
+            available_lobbies.sort(key=lambda x: (x["detour_seconds"], x["start_distance"]))
+            top_count = min(3, len(available_lobbies))
+            selected = random.choice(available_lobbies[:top_count])
+        
+        return self._to_lobby_info(selected)
+    
+    def _to_lobby_info(self, candidate: Dict[str, Any]) -> Dict[str, Any]:
+        """候補情報をAPIで返すロビー情報に変換"""
+        return {
+            "lobby": candidate["lobby"].to_dict(),
+            "start_distance": candidate["start_distance"],
+            "destination_distance": candidate["destination_distance"],
+            "estimated_detour_seconds": candidate["detour_seconds"] if candidate.get("detour_seconds", float('inf')) != float('inf') else None,
+            "route_match": candidate.get("route_match", False)
+        }
+    
+    async def assign_batch(self, requests: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        複数の参加リクエストをまとめてロビーに割り当てる
+        
+        ルートマッチを優先しつつ、スコアラーで見積もったドライバーの遠回り時間が
+        小さい組から貪欲に確定する
+        
+        Args:
+            requests: [{"passenger_id", "passenger_location", "passenger_destination", "max_distance"}, ...]
             
-            if route_matches:
-                # ルートマッチのあるロビーから選択
-                # 出発地の距離が近い順にソート
-                route_matches.sort(key=lambda x: x["start_distance"])
-                
-                # 距離が近い上位3つのロビーからランダムに選択
-                top_count = min(3, len(route_matches))
-                selected = random.choice(route_matches[:top_count])
-            else:
-                # ルートマッチがない場合は従来の方法で選択
-                available_lobbies.sort(key=lambda x: x["start_distance"])
-                top_count = min(3, len(available_lobbies))
-                selected = random.choice(available_lobbies[:top_count])
+        Returns:
+            リクエストと同じ順序のロビー情報のリスト（割り当てがない場合はNone）
+        """
+        pairs = []
+        for i, request in enumerate(requests):
+            candidates = await self._collect_candidates(
+                request["passenger_id"],
+                request["passenger_location"],
+                request.get("passenger_destination"),
+                request.get("max_distance", 5.0)
+            )
+            for candidate in candidates:
+                pairs.append((not candidate.get("route_match", False), candidate["detour_seconds"], i, candidate))
+        
+        pairs.sort(key=lambda x: (x[0], x[1]))
+        
+        assignments: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        remaining_seats: Dict[int, int] = {}
+        for _, _, i, candidate in pairs:
+            if assignments[i] is not None:
+                continue
             
-            return {
-                "lobby": selected["lobby"].to_dict(),
-                "start_distance": selected["start_distance"],
-                "destination_distance": selected["destination_distance"],
-                "route_match": selected.get("route_match", False)
-            }
+            lobby = candidate["lobby"]
+            seats = remaining_seats.get(lobby.lobby_id, lobby.max_passengers - len(lobby.get_passengers()))
+            if seats <= 0:
+                continue
+            
+            remaining_seats[lobby.lobby_id] = seats - 1
+            assignments[i] = self._to_lobby_info(candidate)
+        
+        return assignments
+    
+    async def _plan_insertion(self, lobby: RideLobby, passenger_location: Tuple[float, float], passenger_destination: Optional[Tuple[float, float]]) -> Optional[Tuple[List[List[Optional[float]]], List[int], float]]:
+        """
+        乗客をロビーの訪問順序に挿入した場合の所要時間行列・訪問順序・遠回り時間を計算
+        （新しい乗車地・降車地に関わる行・列だけを取得する）
+        """
+        plan = lobby.route_plan
+        if plan is None or passenger_destination is None:
+            return None
+
+        coordinates = plan.candidate_coordinates(passenger_location, passenger_destination)
+        try:
+            route_service = self._create_route_service(
+                coordinates=coordinates,
+                start_index=plan.DRIVER_START,
+                end_index=plan.DRIVER_END
+            )
+            matrix = await route_service.build_distance_matrix(known_matrix=plan.matrix)
+        except Exception as e:
+            print(f"⚠️ ロビー {lobby.lobby_id} の所要時間行列の取得に失敗しました: {e}")
+            return None
+
+        insertion = plan.best_insertion(matrix, len(coordinates) - 2, len(coordinates) - 1)
+        if insertion is None:
+            return None
+
+        order, detour = insertion
+        return matrix, order, detour
     
     async def request_ride(self, passenger_id: int, lobby_id: int, passenger_location: tuple, passenger_destination: tuple) -> Dict[str, Any]:
         """乗車者がロビーに参加リクエスト"""
-        async with self.lock:
+        async with self.lobby_store.lock(lobby_id):
             # ロビーの存在確認
-            if lobby_id not in self.ride_lobbies:
+            lobby = await self.lobby_store.get(lobby_id)
+            if lobby is None:
                 return {"success": False, "error": "ロビーが存在しません"}
             
-            lobby = self.ride_lobbies[lobby_id]
-            
             # ロビーのステータス確認
             if lobby.status != LobbyStatus.OPEN:
                 return {"success": False, "error": "このロビーは参加を受け付けていません"}
             
-            # すでに別のロビーに所属していないか確認
-            if passenger_id in self.user_lobbies:
-                return {"success": False, "error": "すでに別のロビーに所属しています"}
-            
             # ロビーの最大乗客数を確認
             if lobby.is_full():
                 return {"success": False, "error": "ロビーが満員です"}
@@ -392,6 +901,13 @@ class MatchingService:
             if passenger_id in lobby.participants:
                 return {"success": False, "error": "すでにリクエスト済みです"}
             
+            # すでに別のロビーに所属していないか確認し、他ロビーへの同時参加を防ぐため先に予約
+            if not await self.lobby_store.claim_user(passenger_id, lobby.lobby_id):
+                return {"success": False, "error": "すでに別のロビーに所属しています"}
+            
+            # 現在の訪問順序に挿入した場合の遠回り時間を計算
+            insertion = await self._plan_insertion(lobby, passenger_location, passenger_destination)
+            
             # データベースに乗客情報を保存
             user_data = {
                 "match_id": lobby.lobby_id,
@@ -407,21 +923,30 @@ class MatchingService:
             try:
                 user = await self.match_crud.add_match_user(user_data)  # データベースに保存
             except Exception as e:
-                # データベース保存が失敗した場合、メモリから削除
+                # データベース保存が失敗した場合、予約を取り消す
+                await self.lobby_store.release_user(passenger_id, lobby.lobby_id)
                 return {"success": False, "error": f"DB保存に失敗しました: {str(e)}"}
             
             lobby.add_user(passenger_id, UserRole.PASSENGER, (user.user_start_lat, user.user_start_lng), (user.user_destination_lat, user.user_destination_lng), user_status=user.user_status) # ロビーにリクエストを追加
             
-            # ユーザーの持つロビーIDを追加
-            self.user_lobbies[user.user_id] = user.match_id
+            detour_seconds = None
+            if insertion is not None:
+                matrix, order, detour_seconds = insertion
+                lobby.route_plan.add_passenger(passenger_id, passenger_location, passenger_destination, matrix, order)
+            else:
+                # 挿入できなかった場合は、確定時に訪問順序を一から計算する
+                lobby.route_plan = None
             
             isfull = lobby.is_full()
+            await self.lobby_store.save(lobby)
+            await self._refresh_lobby_index(lobby)
             
             return {
                 "success": True,
                 "isfull": isfull,
                 "message": "乗車リクエストを送信しました",
-                "lobby": lobby.to_dict()
+                "lobby": lobby.to_dict(),
+                "detour_seconds": detour_seconds
             }
     
     async def request_random_ride(self, 
@@ -430,6 +955,15 @@ class MatchingService:
                          passenger_destination: Optional[Tuple[float, float]] = None, 
                          max_distance: float = 5.0) -> Dict[str, Any]:
         """乗客が距離内のランダムなロビーに参加リクエスト（ドライバーのルートを考慮）"""
+        # バッチモードの場合はまとめて割り当てる
+        if self.batch_engine:
+            return await self.batch_engine.submit(
+                passenger_id,
+                passenger_location,
+                passenger_destination,
+                max_distance
+            )
+        
         # 距離内のランダムなロビーを見つける
         lobby_info = await self.find_random_lobby_by_distance(
             passenger_id, 
@@ -441,6 +975,14 @@ class MatchingService:
         if not lobby_info:
             return {"success": False, "error": "条件に合うロビーが見つかりませんでした"}
         
+        return await self.join_selected_lobby(passenger_id, lobby_info, passenger_location, passenger_destination)
+    
+    async def join_selected_lobby(self,
+                                  passenger_id: int,
+                                  lobby_info: Dict[str, Any],
+                                  passenger_location: Tuple[float, float],
+                                  passenger_destination: Optional[Tuple[float, float]] = None) -> Dict[str, Any]:
+        """選ばれたロビーに参加リクエストし、満員になった場合は参加者に通知"""
         # 見つかったロビーにリクエスト
         lobby_id = lobby_info["lobby"]["lobby_id"]
         result = await self.request_ride(passenger_id, lobby_id, passenger_location, passenger_destination)
@@ -450,6 +992,7 @@ class MatchingService:
             result["start_distance"] = lobby_info["start_distance"]
             result["destination_distance"] = lobby_info["destination_distance"]
             result["route_match"] = lobby_info.get("route_match", False)
+            result["estimated_detour_seconds"] = lobby_info.get("estimated_detour_seconds")
         
             # ロビーが満員になった場合の処理
             if result["isfull"]:
@@ -459,8 +1002,8 @@ class MatchingService:
                     return {"success": False, "error": f"DB更新に失敗しました: {str(e)}"}
                 
                 print("ロビーが満員になりました")
-                lobby = self.ride_lobbies[lobby_id]
-                participants = list(lobby.participants.keys())
+                lobby = await self._get_lobby(lobby_id)
+                participants = list(lobby.participants.keys()) if lobby else []
                 print(f"connection_manager: {self.connection_manager.active_connections}")
                 # 全参加者に通知
                 for user_id in participants:
@@ -475,19 +1018,18 @@ class MatchingService:
 
     async def cancel_ride_request(self, passenger_id: int, lobby_id: int = None) -> Dict[str, Any]:
         """乗車者がリクエストをキャンセル"""
-        async with self.lock:
-            # lobby_idが指定されていない場合は、ユーザーのロビーを使用
+        # lobby_idが指定されていない場合は、ユーザーのロビーを使用
+        if lobby_id is None:
+            lobby_id = await self.lobby_store.get_user_lobby(passenger_id)
             if lobby_id is None:
-                if passenger_id not in self.user_lobbies:
-                    return {"success": False, "error": "ロビーに所属していません"}
-                lobby_id = self.user_lobbies[passenger_id]
+                return {"success": False, "error": "ロビーに所属していません"}
 
+        async with self.lobby_store.lock(lobby_id):
             # ロビーの存在確認
-            if lobby_id not in self.ride_lobbies:
+            lobby = await self.lobby_store.get(lobby_id)
+            if lobby is None:
                 return {"success": False, "error": "ロビーが存在しません"}
 
-            lobby = self.ride_lobbies[lobby_id]
-
             # リクエストの存在確認
             if passenger_id not in lobby.participants:
                 return {"success": False, "error": "リクエストが存在しません"}
@@ -505,12 +1047,20 @@ class MatchingService:
 
             # メモリ上から削除
             del lobby.participants[passenger_id]
-            if passenger_id in self.user_lobbies:
-                del self.user_lobbies[passenger_id]
+            if lobby.route_plan is not None:
+                lobby.route_plan.remove_passenger(passenger_id)
+            await self.lobby_store.release_user(passenger_id, lobby_id)
 
             # ロビーがWAITING_APPROVALだった場合、空きができたのでOPENに戻す
-            if lobby.status == LobbyStatus.WAITING_APPROVAL and not lobby.is_full():
+            reopened = lobby.status == LobbyStatus.WAITING_APPROVAL and not lobby.is_full()
+            if reopened:
                 lobby.status = LobbyStatus.OPEN
+            await self.lobby_store.save(lobby)
+
+            # 空きができたロビーを空間インデックスに戻す
+            await self._refresh_lobby_index(lobby)
+
+            if reopened:
                 try:
                     await self.match_crud.update_match(match_id=lobby_id, status=LobbyStatus.OPEN)
                 except Exception as e:
@@ -539,14 +1089,13 @@ class MatchingService:
     
     async def approve_ride(self, user_id: int, lobby_id: int):
         """マッチングした人を承認する"""
-        async with self.lock:
-        # ロビーの存在確認
-            if lobby_id not in self.ride_lobbies:
+        async with self.lobby_store.lock(lobby_id):
+            # ロビーの存在確認
+            lobby = await self.lobby_store.get(lobby_id)
+            if lobby is None:
                 print(f"match_id_type: {type(lobby_id)}")
                 return {"success": False, "error": "ロビーが存在しません"}
             
-            lobby = self.ride_lobbies[lobby_id]
-            
             # 権限とステータスチェック
             if user_id not in lobby.participants:
                 return {"success": False, "error": "リクエストが存在しません"}
@@ -556,7 +1105,8 @@ class MatchingService:
                 await self.match_crud.update_match_user(match_id=lobby_id, user_id=user_id, user_status=UserStatus.APPROVED)
             except Exception as e:
                 return {"success": False, "error": f"DB更新に失敗しました: {str(e)}"}
-            self.ride_lobbies[lobby_id].participants[user_id].user_status = UserStatus.APPROVED
+            lobby.participants[user_id].user_status = UserStatus.APPROVED
+            await self.lobby_store.save(lobby)
             
             # 双方承認済みかどうか
             is_confirmed = lobby.get_approve_status()
@@ -565,53 +1115,51 @@ class MatchingService:
             if is_confirmed:
                 print("DBへのマッチ保存を開始")
                 print(f"マッチング完了: {lobby.lobby_id} - ロビーのユーザー: {lobby.participants}")
-                match = await self._complete_matching(lobby) # とりあえず今日はここまで。　続きはcomplete_matchingのDBステータスの更新
-                return {"success": True, "match": match}
+                return await self._complete_matching(lobby)
             
             return {"success": True, "message": "承認されましたが、まだ全員の承認が完了していません"}
     
     async def get_available_lobbies(self, passenger_location: Tuple[float, float], max_distance: float = 5.0) -> List[Dict[str, Any]]:
         """乗客が利用可能なロビー一覧を取得"""
-        async with self.lock:
-            available_lobbies = []
-            
-            for lobby in self.ride_lobbies.values():
-                # オープン状態で満員でないロビーのみ対象
-                if lobby.status != LobbyStatus.OPEN or lobby.is_full():
-                    continue
-                
-                # 距離チェック
-                distance = await self.calculate_distance(passenger_location, lobby.participants[lobby.get_driver().user_id].user_location)
-                if distance <= max_distance:
-                    lobby_info = lobby.to_dict()
-                    lobby_info["distance"] = distance
-                    available_lobbies.append(lobby_info)
-            
-            # 距離順にソート
-            available_lobbies.sort(key=lambda x: x["distance"])
+        lobbies = await self._find_candidate_lobbies(passenger_location, None, max_distance)
+        
+        available_lobbies = []
+        
+        for lobby in lobbies:
+            # オープン状態で満員でないロビーのみ対象
+            if lobby.status != LobbyStatus.OPEN or lobby.is_full():
+                continue
             
-            return available_lobbies
+            # 距離チェック
+            distance = await self.calculate_distance(passenger_location, lobby.participants[lobby.get_driver().user_id].user_location)
+            if distance <= max_distance:
+                lobby_info = lobby.to_dict()
+                lobby_info["distance"] = distance
+                available_lobbies.append(lobby_info)
+        
+        # 距離順にソート
+        available_lobbies.sort(key=lambda x: x["distance"])
+        
+        return available_lobbies
     
     async def get_all_lobbies(self) -> List[Dict[str, Any]]:
         """全ロビー情報を取得"""
-        async with self.lock:
-            all_lobbies = []
-            for lobby in self.ride_lobbies.values():
-                all_lobbies.append(lobby.to_dict())
-            return all_lobbies
+        all_lobbies = []
+        for lobby in await self.lobby_store.all():
+            all_lobbies.append(lobby.to_dict())
+        return all_lobbies
     
     async def get_lobby_info(self, lobby_id: str) -> Dict[str, Any]:
         """ロビーの詳細情報を取得"""
-        async with self.lock:
-            if lobby_id not in self.ride_lobbies:
-                return {"success": False, "error": "ロビーが存在しません"}
-            
-            lobby = self.ride_lobbies[lobby_id]
-            return {
-                "success": True,
-                "lobby": lobby.to_dict(),
-                "participants": [user.user_id for user in lobby.participants.values()]
-            }
+        lobby = await self.lobby_store.get(lobby_id)
+        if lobby is None:
+            return {"success": False, "error": "ロビーが存在しません"}
+        
+        return {
+            "success": True,
+            "lobby": lobby.to_dict(),
+            "participants": [user.user_id for user in lobby.participants.values()]
+        }
     
     async def get_lobby_users(self, lobby_id: int) -> List[int]:
         
@@ -630,7 +1178,7 @@ class MatchingService:
 
         return results
     
-    async def _complete_matching(self, lobby: RideLobby) -> Match:
+    async def _complete_matching(self, lobby: RideLobby) -> Dict[str, Any]:
         """マッチングを完了してデータベースに保存"""
         # ロビーのステータスを更新
         print(f"マッチング完了: {lobby.lobby_id} - ロビーのユーザー: {lobby.participants}")
@@ -656,40 +1204,60 @@ class MatchingService:
 
         # ロビーのステータスを更新
         lobby.status = match.status # ロビーのステータスを更新
+        await self.lobby_store.unindex(lobby.lobby_id) # マッチング確定したロビーは検索対象外
         for user in users:
             lobby.participants[user["user_id"]].user_status = user["user_status"] # ロビーの参加者のステータスを更新
+        await self.lobby_store.save(lobby)
         
         # 案内ルートを生成
-        coordinates = [lobby.get_driver().user_location]  # ドライバー出発地
-        pickups_deliveries = []
-        
-        for i, (pid, info) in enumerate(lobby.participants.items()):
-            coordinates.append(info.user_location)
-            coordinates.append(info.user_destination)
-            pickups_deliveries.append((1 + i * 2, 1 + i * 2 + 1))
+        plan = lobby.route_plan
+        if plan is not None and set(plan.passenger_nodes) == {user.user_id for user in lobby.get_passengers()}:
+            # 参加時に取得済みの所要時間行列を使い、Matrix APIを呼ばずに訪問順序を確定する
+            print(f"経路座標: {plan.coordinates}")
+            route_service = self._create_route_service(
+                coordinates=plan.coordinates, # 経路座標
+                pickups_deliveries=plan.pickups_deliveries(), # ピックアップとドロップオフの座標
+                start_index=plan.DRIVER_START, # ドライバーの出発地
+                end_index=plan.DRIVER_END, # ドライバーの目的地
+                solver_profile=lobby.solver_profile # ロビーのプロファイル
+            )
+            geodata = await route_service.get_geojson_route(distance_matrix=plan.matrix)
+        else:
+            coordinates = [lobby.get_driver().user_location]  # ドライバー出発地
+            pickups_deliveries = []
+            
+            for i, (pid, info) in enumerate(lobby.participants.items()):
+                coordinates.append(info.user_location)
+                coordinates.append(info.user_destination)
+                pickups_deliveries.append((1 + i * 2, 1 + i * 2 + 1))
 
-        coordinates.append(lobby.get_driver().user_destination)  # ドライバーの目的地
-        
-        print(f"経路座標: {coordinates}")
-        
-        route_service = RouteGenerateService(
-            api_key=settings.mapbox_api_key, # Mapbox APIキー
-            coordinates=coordinates, # 経路座標
-            pickups_deliveries=pickups_deliveries, # ピックアップとドロップオフの座標
-            start_index=0, # ドライバーの出発地
-            end_index=len(coordinates) - 1 # ドライバーの目的地
-        )
+            coordinates.append(lobby.get_driver().user_destination)  # ドライバーの目的地
+            
+            print(f"経路座標: {coordinates}")
+            
+            route_service = self._create_route_service(
+                coordinates=coordinates, # 経路座標
+                pickups_deliveries=pickups_deliveries, # ピックアップとドロップオフの座標
+                start_index=0, # ドライバーの出発地
+                end_index=len(coordinates) - 1, # ドライバーの目的地
+                solver_profile=lobby.solver_profile # ロビーのプロファイル
+            )
 
-        geodata = await route_service.get_geojson_route()
+            geodata = await route_service.get_geojson_route()
+
+        # 訪問順序の計算結果（プロファイル・目的関数値・計算時間）
+        solver_metadata = route_service.solver_metadata
+        print(f"訪問順序の計算結果（ロビー {lobby.lobby_id}）: {solver_metadata}")
 
         if geodata:
             print("✔ 経路生成成功")
         else:
             print("❌ 経路生成に失敗しました")
         
-        # DBに保存
+        # DBに保存（ポリライン＋概要と案内ステップに分けて保存）
+        route_summary, route_steps = compact_route(geodata, settings.route_polyline_precision)
         try:
-            match = await self.match_crud.update_match(match_id=match.match_id, route_geojson=geodata, status=LobbyStatus.NAVIGATING)
+            match = await self.match_crud.update_match(match_id=match.match_id, route_summary=route_summary, route_steps=route_steps, status=LobbyStatus.NAVIGATING)
         except Exception as e:
             return {"success": False, "error": f"DB更新に失敗しました: {str(e)}"}
         
@@ -713,47 +1281,31 @@ class MatchingService:
                     "match_id": match.match_id,
                     "participants": match_participants
                 })
-            
-            # ユーザー情報をクリア
-            if user_id in self.user_lobbies:
-                del self.user_lobbies[user_id]
         
-        # ロビーを削除
-        if lobby.lobby_id in self.ride_lobbies:
-            del self.ride_lobbies[lobby.lobby_id]
+        # ロビーを削除し、ユーザー情報をクリア
+        await self.lobby_store.remove(lobby.lobby_id, match_participants)
         
         print(f"DBにマッチを保存: {match.match_id}")
-        return match
+        return {"success": True, "match": match, "solver": solver_metadata}
     
 
-    async def _find_closest_point_on_route(self, 
+    def _find_closest_point_on_route(self, 
                                      point: Tuple[float, float], 
-                                     route_coordinates: List[Tuple[float, float]],
+                                     route_corridor: RouteCorridor,
                                      max_distance: float) -> Tuple[int, float]:
         """
         ルート上で指定された点に最も近い点のインデックスと距離を返す
         
         Args:
             point: 基準点の座標 (lat, lng)
-            route_coordinates: ルート上の座標点リスト [(lat, lng), ...]
+            route_corridor: ルート座標を保持するRouteCorridor
             max_distance: 許容最大距離（km）
             
         Returns:
             (最も近い点のインデックス, 距離) - 見つからない場合は (-1, inf)
         """
-        if not route_coordinates:
+        if point is None or len(route_corridor) == 0:
             return -1, float('inf')
         
-        min_distance = float('inf')
-        closest_idx = -1
-        
-        for i, route_point in enumerate(route_coordinates):
-            distance = await self.calculate_distance(point, route_point)
-            if distance < min_distance:
-                min_distance = distance
-                closest_idx = i
-        
-        if min_distance <= max_distance:
-            return closest_idx, min_distance
-        else:
-            return -1, float('inf')
\ No newline at end of file
+        # 全線分への距離をベクトル化して一括計算
+        return route_corridor.closest_segment(point, max_distance)
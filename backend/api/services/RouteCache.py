@@ -0,0 +1,277 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import brotli
+
+Coordinate = Tuple[float, float]
+
+class DurationMatrixCache:
+    """スナップした座標ペアごとの所要時間を保持する、TTL付きLRUキャッシュ"""
+    def __init__(self, precision: int = 4, ttl_seconds: float = 3600.0, max_entries: int = 100000):
+        """
+        :param precision: 座標をスナップする小数点以下の桁数（4桁で約11m）
+        :param ttl_seconds: キャッシュの有効期間（秒）
+        :param max_entries: 保持するペア数の上限（超えた分は古い順に削除）
+        """
+        self.precision = precision
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # (出発地, 目的地) -> (所要時間, 有効期限)
+        self.entries: "OrderedDict[Tuple[Coordinate, Coordinate], Tuple[float, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def snap(self, coordinate: Coordinate) -> Coordinate:
+        """座標を指定の精度に丸める"""
+        return (round(float(coordinate[0]), self.precision), round(float(coordinate[1]), self.precision))
+
+    def get(self, origin: Coordinate, destination: Coordinate) -> Optional[float]:
+        """キャッシュ済みの所要時間を返す（ない・期限切れの場合はNone）"""
+        key = (self.snap(origin), self.snap(destination))
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        duration, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return duration
+
+    def set(self, origin: Coordinate, destination: Coordinate, duration: Optional[float]):
+        """所要時間を保存（経路がない場合のNoneは保存しない）"""
+        if duration is None:
+            return
+
+        key = (self.snap(origin), self.snap(destination))
+        self.entries[key] = (duration, time.monotonic() + self.ttl_seconds)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class DirectionsCache:
+    """経由地の並びと検索条件ごとにDirections APIのレスポンスを保持するキャッシュ（メモリ＋任意でディスク）"""
+    def __init__(self, precision: int = 5, max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None):
+        """
+        :param precision: キーを作るときに座標を丸める小数点以下の桁数
+        :param max_bytes: メモリに保持するレスポンスの合計サイズの上限（超えた分は古い順に削除）
+        :param disk_dir: ディスクキャッシュのディレクトリ（Noneの場合はメモリのみ）
+        """
+        self.precision = precision
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        # キー -> JSONにシリアライズしたレスポンス
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.total_bytes = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def make_key(self, coordinates: List[Coordinate], params: Dict[str, Any]) -> str:
+        """丸めた座標の並びとリクエストパラメータ（access_tokenを除く）からキーを作成"""
+        rounded = [[round(float(lat), self.precision), round(float(lng), self.precision)] for lat, lng in coordinates]
+        options = {k: v for k, v in params.items() if k != "access_token"}
+        raw = json.dumps({"coordinates": rounded, "params": options}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, payload: bytes):
+        # 書き込み途中のファイルを読まないよう一時ファイルから置き換える
+        tmp_path = f"{self._disk_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self._disk_path(key))
+
+    def _store_memory(self, key: str, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= len(old)
+
+        self.entries[key] = payload
+        self.total_bytes += len(payload)
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    async def get(self, coordinates: List[Coordinate], params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みのレスポンスを返す（呼び出し側で変更できるよう毎回新しい辞書を返す）"""
+        key = self.make_key(coordinates, params)
+
+        payload = self.entries.get(key)
+        if payload is not None:
+            self.entries.move_to_end(key)
+            return json.loads(payload)
+
+        if self.disk_dir:
+            payload = await asyncio.to_thread(self._read_disk, key)
+            if payload is not None:
+                self._store_memory(key, payload)
+                return json.loads(payload)
+
+        return None
+
+    async def set(self, coordinates: List[Coordinate], params: Dict[str, Any], data: Dict[str, Any]):
+        """レスポンスを保存"""
+        key = self.make_key(coordinates, params)
+        payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self._store_memory(key, payload)
+
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, key, payload)
+            except OSError as e:
+                print(f"⚠️ ルートのディスクキャッシュに保存できませんでした: {e}")
+
+
+class RoutePayload:
+    """シリアライズ済みのレスポンスと、その圧縮版・ETag"""
+    # Content-Encoding -> ETagの末尾（圧縮方式ごとに別の表現として区別する）
+    ETAG_SUFFIXES = {"identity": "", "gzip": "-gz", "br": "-br"}
+
+    def __init__(self, digest: str, bodies: Dict[str, bytes]):
+        """
+        :param digest: 非圧縮のレスポンスのハッシュ値
+        :param bodies: Content-Encoding -> レスポンスのバイト列（identityは必須）
+        """
+        self.digest = digest
+        self.bodies = bodies
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def etag(self, encoding: str) -> str:
+        """圧縮方式ごとの強いETag"""
+        return f'"{self.digest}{self.ETAG_SUFFIXES[encoding]}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Matchのいずれかのタグが同じ内容を指しているか（圧縮方式の違いは問わない）"""
+        if not if_none_match:
+            return False
+
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            for suffix in ("-gz", "-br"):
+                if tag.endswith(suffix):
+                    tag = tag[:-len(suffix)]
+                    break
+            if tag == self.digest:
+                return True
+        return False
+
+    def select_encoding(self, accept_encoding: Optional[str]) -> str:
+        """Accept-Encodingから返す圧縮方式を選ぶ（br > gzip > identity）"""
+        accepted: Dict[str, float] = {}
+        for item in (accept_encoding or "").split(","):
+            name, _, params = item.strip().partition(";")
+            name = name.strip().lower()
+            if not name:
+                continue
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name] = quality
+
+        for encoding in ("br", "gzip"):
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            if encoding in self.bodies and quality > 0:
+                return encoding
+        return "identity"
+
+
+class RoutePayloadCache:
+    """ルート取得APIのレスポンスを、マッチIDとルートのバージョンごとにシリアライズ・圧縮済みで保持するキャッシュ"""
+    def __init__(self,
+                 max_bytes: int = 16 * 1024 * 1024,
+                 compress_min_bytes: int = 1024,
+                 gzip_level: int = 6,
+                 brotli_quality: int = 5):
+        """
+        :param max_bytes: 保持するレスポンス（圧縮版を含む）の合計サイズの上限（超えた分は古い順に削除）
+        :param compress_min_bytes: このサイズ未満のレスポンスは圧縮しない
+        :param gzip_level: gzipの圧縮レベル
+        :param brotli_quality: brotliの圧縮品質
+        """
+        self.max_bytes = max_bytes
+        self.compress_min_bytes = compress_min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.entries: "OrderedDict[Tuple[Any, ...], RoutePayload]" = OrderedDict()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(match_id: int, route_version: int, *variant: Any) -> Tuple[Any, ...]:
+        """マッチID・ルートのバージョンと、レスポンスを変えるその他の値（参加ユーザーのバージョン・format・stepsなど）からキーを作成"""
+        return (match_id, route_version, *variant)
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[RoutePayload]:
+        payload = self.entries.get(key)
+        if payload is not None:
+            self.entries.move_to_end(key)
+        return payload
+
+    def _encode(self, data: Dict[str, Any]) -> RoutePayload:
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        bodies = {"identity": body}
+        if len(body) >= self.compress_min_bytes:
+            # mtime=0 で同じ内容なら同じバイト列になるようにする
+            bodies["gzip"] = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+            bodies["br"] = brotli.compress(body, quality=self.brotli_quality)
+        return RoutePayload(hashlib.sha256(body).hexdigest()[:32], bodies)
+
+    async def set(self, key: Tuple[Any, ...], data: Dict[str, Any]) -> RoutePayload:
+        """レスポンスをシリアライズ・圧縮して保存（圧縮はスレッドで行う）"""
+        payload = await asyncio.to_thread(self._encode, data)
+        if payload.size > self.max_bytes:
+            return payload
+
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+
+        self.entries[key] = payload
+        self.total_bytes += payload.size
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+        return payload
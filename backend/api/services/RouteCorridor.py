@@ -0,0 +1,192 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+# 地球の平均半径（km）
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(point: Tuple[float, float], lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """1点から複数点への距離（km）をまとめて計算"""
+    lat1 = np.radians(float(point[0]))
+    lng1 = np.radians(float(point[1]))
+    lat2 = np.radians(lats)
+    lng2 = np.radians(lngs)
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def _segment_distances(points: np.ndarray, starts: np.ndarray, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """平面座標上で各点から対応する線分までの距離と垂線の足の位置 t を計算"""
+    rel = points - starts
+    lengths_sq = np.einsum("ij,ij->i", vectors, vectors)
+    t = np.divide(
+        np.einsum("ij,ij->i", rel, vectors),
+        lengths_sq,
+        out=np.zeros_like(lengths_sq),
+        where=lengths_sq > 0
+    )
+    t = np.clip(t, 0.0, 1.0)
+    nearest = starts + vectors * t[:, None]
+    diff = points - nearest
+    return np.hypot(diff[:, 0], diff[:, 1]), t
+
+def douglas_peucker(points_xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas–Peucker法で折れ線を簡略化し、残す頂点のマスクを返す
+
+    Args:
+        points_xy: 平面座標（km）の配列 shape=(n, 2)
+        tolerance: 許容誤差（km）。元の頂点は簡略化後の折れ線からこの距離以内に収まる
+
+    Returns:
+        残す頂点を True とした bool 配列
+    """
+    n = len(points_xy)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+
+        inner = points_xy[start + 1:end]
+        starts = np.broadcast_to(points_xy[start], inner.shape)
+        vectors = np.broadcast_to(points_xy[end] - points_xy[start], inner.shape)
+        distances, _ = _segment_distances(inner, starts, vectors)
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return keep
+
+class RouteCorridor:
+    """ドライバーのルート座標をNumPy配列で保持し、乗降地点の近傍探索を行う"""
+    def __init__(self,
+                 route_coordinates: List[Tuple[float, float]],
+                 buffer_km: float = 0.0,
+                 simplify_tolerance_km: Optional[float] = None):
+        """
+        :param route_coordinates: ルート上の座標点リスト [(lat, lng), ...]
+        :param buffer_km: 外接矩形（エンベロープ）を広げる距離（km）
+        :param simplify_tolerance_km: 簡略化ルートの許容誤差（km）。Noneの場合は簡略化しない
+        """
+        self.points = np.asarray(route_coordinates, dtype=np.float64).reshape(-1, 2)
+        self.buffer_km = float(buffer_km)
+        self.envelope: Optional[Tuple[float, float, float, float]] = None  # (min_lat, min_lng, max_lat, max_lng)
+        self.simplified: Optional["RouteCorridor"] = None
+        self.simplify_tolerance_km = 0.0
+
+        if len(self.points) == 0:
+            return
+
+        self.envelope = self._buffered_bounds(self.buffer_km)
+
+        if simplify_tolerance_km is not None and len(self.points) > 2:
+            self.simplify_tolerance_km = float(simplify_tolerance_km)
+            keep = douglas_peucker(self._project(self.points[0]), self.simplify_tolerance_km)
+            self.simplified = RouteCorridor(self.points[keep])
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _buffered_bounds(self, buffer_km: float) -> Tuple[float, float, float, float]:
+        """ルートの外接矩形をbuffer_kmだけ広げた範囲を返す"""
+        min_lat, min_lng = self.points.min(axis=0)
+        max_lat, max_lng = self.points.max(axis=0)
+
+        km_per_deg = np.radians(1.0) * EARTH_RADIUS_KM
+        # 経度方向は高緯度側ほど1度が短くなるため、緯度の絶対値が大きい側で換算
+        cos_lat = max(np.cos(np.radians(max(abs(min_lat), abs(max_lat)))), 0.01)
+        d_lat = buffer_km / km_per_deg
+        d_lng = buffer_km / (km_per_deg * cos_lat)
+        return (float(min_lat - d_lat), float(min_lng - d_lng), float(max_lat + d_lat), float(max_lng + d_lng))
+
+    def may_contain(self, point: Tuple[float, float], radius_km: float) -> bool:
+        """
+        指定された点がルートからradius_km以内に入り得るかを簡易判定する（偽陽性あり、偽陰性なし）
+
+        Args:
+            point: 判定する座標 (lat, lng)
+            radius_km: 許容最大距離（km）
+
+        Returns:
+            入り得る場合はTrue、確実に入らない場合はFalse
+        """
+        if self.envelope is None:
+            return False
+
+        # エンベロープ判定（作成時のバッファより大きい半径の場合のみ再計算）
+        envelope = self.envelope if radius_km <= self.buffer_km else self._buffered_bounds(radius_km)
+        lat, lng = float(point[0]), float(point[1])
+        if not (envelope[0] <= lat <= envelope[2] and envelope[1] <= lng <= envelope[3]):
+            return False
+
+        # 簡略化ルートとの距離判定（元ルートとの誤差は許容誤差以内）
+        if self.simplified is not None:
+            idx, _ = self.simplified.closest_segment(point, radius_km + self.simplify_tolerance_km)
+            return idx != -1
+        return True
+
+    def _project(self, point: Tuple[float, float]) -> np.ndarray:
+        """基準点を原点とする正距円筒図法の平面座標（km）にルートを投影"""
+        lat0 = np.radians(float(point[0]))
+        scale = np.radians(1.0) * EARTH_RADIUS_KM
+        x = (self.points[:, 1] - float(point[1])) * scale * np.cos(lat0)
+        y = (self.points[:, 0] - float(point[0])) * scale
+        return np.column_stack((x, y))
+
+    def closest_vertex(self, point: Tuple[float, float], max_distance: float) -> Tuple[int, float]:
+        """
+        ルート上の頂点のうち、指定された点に最も近いもののインデックスと距離を返す
+
+        Args:
+            point: 基準点の座標 (lat, lng)
+            max_distance: 許容最大距離（km）
+
+        Returns:
+            (最も近い頂点のインデックス, 距離) - 見つからない場合は (-1, inf)
+        """
+        if len(self.points) == 0:
+            return -1, float('inf')
+
+        distances = haversine_km(point, self.points[:, 0], self.points[:, 1])
+        idx = int(np.argmin(distances))
+        distance = float(distances[idx])
+
+        if distance <= max_distance:
+            return idx, distance
+        return -1, float('inf')
+
+    def closest_segment(self, point: Tuple[float, float], max_distance: float) -> Tuple[int, float]:
+        """
+        ルートの線分のうち、指定された点に最も近いものを探し、その線分上の最近傍点に近い頂点のインデックスと距離を返す
+
+        Args:
+            point: 基準点の座標 (lat, lng)
+            max_distance: 許容最大距離（km）
+
+        Returns:
+            (最も近い頂点のインデックス, 線分までの距離) - 見つからない場合は (-1, inf)
+        """
+        if len(self.points) < 2:
+            return self.closest_vertex(point, max_distance)
+
+        projected = self._project(point)
+        starts = projected[:-1]
+        vectors = projected[1:] - starts
+
+        # 原点（基準点）から各線分への距離と垂線の足の位置 t ∈ [0, 1]
+        distances, t = _segment_distances(np.zeros_like(starts), starts, vectors)
+        segment = int(np.argmin(distances))
+        distance = float(distances[segment])
+
+        if distance <= max_distance:
+            return segment + int(t[segment] >= 0.5), distance
+        return -1, float('inf')
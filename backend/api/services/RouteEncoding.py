@@ -0,0 +1,110 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+# ステップから取り除く、容量の大きいキー（形状は全体のポリラインから復元できる）
+_STEP_HEAVY_KEYS = ("geometry", "intersections", "voiceInstructions", "bannerInstructions")
+
+
+def encode_polyline(coordinates: List[List[float]], precision: int = 6) -> str:
+    """
+    [lng, lat] のリストをエンコード済みポリライン文字列に変換
+    （Google/Mapboxのポリライン形式。精度5または6）
+    """
+    factor = 10 ** precision
+    result = []
+    previous_lat = 0
+    previous_lng = 0
+    for lng, lat in coordinates:
+        lat_value = int(round(lat * factor))
+        lng_value = int(round(lng * factor))
+        for delta in (lat_value - previous_lat, lng_value - previous_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        previous_lat = lat_value
+        previous_lng = lng_value
+    return "".join(result)
+
+
+def decode_polyline(encoded: str, precision: int = 6) -> List[List[float]]:
+    """エンコード済みポリライン文字列を [lng, lat] のリストに戻す"""
+    factor = 10 ** precision
+    coordinates = []
+    index = 0
+    lat = 0
+    lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = 0
+            value = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append([lng / factor, lat / factor])
+    return coordinates
+
+
+def compact_route(data: Optional[Dict[str, Any]], precision: int = 6) -> Tuple[Optional[Dict[str, Any]], Optional[List[List[Dict[str, Any]]]]]:
+    """
+    Directions APIのレスポンスを、ポリライン＋概要と区間ごとの案内ステップに分ける
+
+    Returns:
+        (概要, ステップ)。ルートがない場合は (None, None)
+        概要: {"polyline", "precision", "duration", "distance", "legs", "waypoints"}
+        ステップ: 区間ごとのステップのリスト（形状などの大きいキーは除く）
+    """
+    if not data or not data.get("routes"):
+        return None, None
+
+    route = data["routes"][0]
+    summary = {
+        "polyline": encode_polyline(route["geometry"]["coordinates"], precision),
+        "precision": precision,
+        "duration": route.get("duration"),
+        "distance": route.get("distance"),
+        "legs": [
+            {"duration": leg.get("duration"), "distance": leg.get("distance"), "summary": leg.get("summary", "")}
+            for leg in route.get("legs", [])
+        ],
+        "waypoints": [
+            {"name": waypoint.get("name", ""), "location": waypoint.get("location")}
+            for waypoint in data.get("waypoints", [])
+        ]
+    }
+    steps = [
+        [{k: v for k, v in step.items() if k not in _STEP_HEAVY_KEYS} for step in leg.get("steps", [])]
+        for leg in route.get("legs", [])
+    ]
+    return summary, steps
+
+
+def expand_route(summary: Dict[str, Any], steps: Optional[List[List[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+    """ポリライン＋概要を、Directions APIと同じGeoJSON形式のレスポンスに戻す"""
+    legs = []
+    for i, leg in enumerate(summary.get("legs", [])):
+        leg = dict(leg)
+        leg["steps"] = steps[i] if steps and i < len(steps) else []
+        legs.append(leg)
+
+    return {
+        "code": "Ok",
+        "routes": [{
+            "geometry": {
+                "type": "LineString",
+                "coordinates": decode_polyline(summary["polyline"], summary.get("precision", 6))
+            },
+            "legs": legs,
+            "duration": summary.get("duration"),
+            "distance": summary.get("distance")
+        }],
+        "waypoints": summary.get("waypoints", [])
+    }
@@ -1,7 +1,11 @@
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 from typing import List, Tuple, Optional
-import httpx
+import asyncio
+from services.MapboxClient import MapboxClient
+from services.RoutingBackend import RoutingBackend, MapboxRoutingBackend
+from services.RouteCache import DurationMatrixCache, DirectionsCache
+from services.RouteSolver import RouteSolverPool, solve_pickup_delivery
+from services.RoutePlanner import EXACT_MAX_PAIRS, solve_exact_pickup_delivery
+from services.Enums import SolverProfile
 
 
 class RouteGenerateService:
@@ -11,7 +15,15 @@ class RouteGenerateService:
         coordinates: List[Tuple[float, float]], # 各地点の (latitude, longitude) のリスト
         start_index: int, # ドライバーの開始地点のインデックス
         end_index: int ,# ドライバーの目的地のインデックス
-        pickups_deliveries: List[Tuple[int, int]] = [] # 拾い上げる地点と降ろす地点のインデックスのリスト
+        pickups_deliveries: List[Tuple[int, int]] = [], # 拾い上げる地点と降ろす地点のインデックスのリスト
+        client: Optional[MapboxClient] = None, # アプリ全体で共有するMapboxクライアント
+        matrix_cache: Optional[DurationMatrixCache] = None, # 地点間の所要時間キャッシュ
+        directions_cache: Optional[DirectionsCache] = None, # 経由地の並びごとのルートキャッシュ
+        solver_pool: Optional[RouteSolverPool] = None, # 訪問順序を計算するプール
+        solver_profile: str = SolverProfile.FAST, # 訪問順序計算のプロファイル
+        solver_time_limit_ms: Optional[int] = None, # 訪問順序計算の制限時間（ミリ秒）
+        exact_max_pairs: int = EXACT_MAX_PAIRS, # この乗客数以下ならOR-Toolsを使わず全列挙する
+        backend: Optional[RoutingBackend] = None # 経路探索のバックエンド
     ):
         """
         :param api_key: MapboxのAPIキー
@@ -19,31 +31,111 @@ class RouteGenerateService:
         :param pickups_deliveries: [(pickup_index, dropoff_index), ...]
         :param start_index: ドライバーの開始地点のインデックス
         :param end_index: ドライバーの目的地のインデックス
+        :param client: 共有のMapboxClient（Noneの場合はリクエストごとに接続を作成）
+        :param matrix_cache: 共有のDurationMatrixCache（Noneの場合は毎回Matrix APIを呼ぶ）
+        :param directions_cache: 共有のDirectionsCache（Noneの場合は毎回Directions APIを呼ぶ）
+        :param solver_pool: 共有のRouteSolverPool（Noneの場合は別スレッドで計算）
+        :param solver_profile: 訪問順序計算のプロファイル（SolverProfile）
+        :param solver_time_limit_ms: 訪問順序計算の制限時間（Noneの場合はプロファイルの既定値）
+        :param exact_max_pairs: この乗客数以下ならOR-Toolsを使わず全列挙で厳密解を求める
+        :param backend: 経路探索のバックエンド（Noneの場合はapi_key・clientでMapboxを使う）
         """
         self.api_key = api_key
         self.coordinates = coordinates
         self.pickups_deliveries = pickups_deliveries
         self.start_index = start_index
         self.end_index = end_index
+        self.client = client
+        self.matrix_cache = matrix_cache
+        self.directions_cache = directions_cache
+        self.solver_pool = solver_pool
+        self.solver_profile = solver_profile
+        self.solver_time_limit_ms = solver_time_limit_ms
+        self.exact_max_pairs = exact_max_pairs
+        self.solve_result: Optional[dict] = None  # 直近の計算結果（計算時間・目的関数値）
+        self.backend = backend if backend is not None else MapboxRoutingBackend(api_key, client)
 
-    async def build_distance_matrix(self) -> List[List[int]]:
+    @property
+    def solver_metadata(self) -> Optional[dict]:
+        """直近の訪問順序計算の情報（プロファイル・目的関数値・計算時間）。未計算・解なしの場合はNone"""
+        if not self.solve_result:
+            return None
+        return {
+            "profile": self.solve_result["profile"],
+            "objective": self.solve_result["objective"],
+            "elapsed_ms": round(self.solve_result["elapsed_ms"], 3)
+        }
+
+    async def build_distance_matrix(self, known_matrix: Optional[List[List[Optional[float]]]] = None) -> List[List[int]]:
         """
-        Mapbox Matrix APIを使用して、地点間の距離行列を作成
+        バックエンド（Mapbox Matrix APIなど）を使用して、地点間の距離行列を作成
+        既知の行列・キャッシュがある場合は、埋まっていない行・列だけをリクエストする
+
+        Args:
+            known_matrix: 先頭の地点について計算済みの行列（地点を追加したときに使う）
         """
-        coord_str = ";".join([f"{lon},{lat}" for lat, lon in self.coordinates])
-        url = f"https://api.mapbox.com/directions-matrix/v1/mapbox/driving/{coord_str}"
-        params = {
-            "access_token": self.api_key
-        }
+        size = len(self.coordinates)
+        matrix: List[List[Optional[float]]] = [[None] * size for _ in range(size)]
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-        
-        print("レスポンス:", response.json())
-        
-        return data["durations"]
+        for i, origin in enumerate(self.coordinates):
+            for j, destination in enumerate(self.coordinates):
+                if i == j:
+                    matrix[i][j] = 0
+                elif known_matrix is not None and i < len(known_matrix) and j < len(known_matrix) and known_matrix[i][j] is not None:
+                    matrix[i][j] = known_matrix[i][j]
+                elif self.matrix_cache is not None:
+                    matrix[i][j] = self.matrix_cache.get(origin, destination)
+
+        missing = [(i, j) for i in range(size) for j in range(size) if matrix[i][j] is None]
+        if not missing:
+            print("距離行列をキャッシュから作成しました")
+            return matrix
+
+        # 行がまるごと欠けている地点（新しく追加した地点など）は全地点への行を取得し、
+        # 残りの欠けている要素はその出発地・目的地の組み合わせだけ取得する
+        full_rows = [i for i in range(size) if all(matrix[i][j] is None for j in range(size) if j != i)]
+        if full_rows and len(full_rows) < size:
+            await self._fill_matrix(matrix, full_rows, list(range(size)))
+            missing = [(i, j) for i, j in missing if i not in full_rows and matrix[i][j] is None]
+
+        if missing:
+            sources = sorted({i for i, _ in missing})
+            destinations = sorted({j for _, j in missing})
+            await self._fill_matrix(matrix, sources, destinations)
+
+        return matrix
+
+    async def _fill_matrix(self, matrix: List[List[Optional[float]]], sources: List[int], destinations: List[int]):
+        """バックエンドから取得した所要時間を、空いている要素に書き込みキャッシュに保存する"""
+        durations = await self._fetch_matrix(sources, destinations)
+
+        for row, i in enumerate(sources):
+            for col, j in enumerate(destinations):
+                if matrix[i][j] is None:
+                    matrix[i][j] = durations[row][col]
+                    if self.matrix_cache is not None:
+                        self.matrix_cache.set(self.coordinates[i], self.coordinates[j], durations[row][col])
+
+    async def _fetch_matrix(self, sources: List[int], destinations: List[int]) -> List[List[Optional[float]]]:
+        """
+        指定した出発地・目的地の組み合わせだけバックエンドから取得する
+
+        Args:
+            sources: 出発地のインデックス（self.coordinates 上）
+            destinations: 目的地のインデックス（self.coordinates 上）
+
+        Returns:
+            len(sources) x len(destinations) の所要時間（秒）
+        """
+        # リクエストに必要な座標だけに絞る
+        used = sorted(set(sources) | set(destinations))
+        local_index = {index: k for k, index in enumerate(used)}
+
+        return await self.backend.matrix(
+            [self.coordinates[i] for i in used],
+            [local_index[i] for i in sources],
+            [local_index[j] for j in destinations]
+        )
 
     def create_data_model(self, distance_matrix: List[List[int]]) -> dict:
         return {
@@ -53,80 +145,72 @@ class RouteGenerateService:
             "ends": [self.end_index]
         }
 
+    def _is_small(self) -> bool:
+        """全列挙で解ける規模か（ドライバーの出発地・目的地以外の地点数で判定）"""
+        return len(self.coordinates) - 2 <= self.exact_max_pairs * 2
+
+    def _solve_exact(self, distance_matrix: List[List[int]]) -> Optional[List[int]]:
+        self.solve_result = solve_exact_pickup_delivery(
+            distance_matrix,
+            self.pickups_deliveries,
+            self.start_index,
+            self.end_index
+        )
+        return self.solve_result["route_order"] if self.solve_result else None
+
     def solve_route_order(self, distance_matrix: List[List[int]]) -> Optional[List[int]]:
         """
-        OR-Tools を使って訪問順序を計算する（pickup → dropoff の制約付き）
+        訪問順序を計算する（pickup → dropoff の制約付き）
+        少人数なら全列挙、それ以外は OR-Tools を使う
         """
-        print("訪問順序計算中...")
-        data = self.create_data_model(distance_matrix)
-
-        manager = pywrapcp.RoutingIndexManager(
-            len(data["distance_matrix"]),
-            1,  # 車両数 = 1
-            data["starts"],
-            data["ends"]
-        )
+        if self._is_small():
+            return self._solve_exact(distance_matrix)
 
-        routing = pywrapcp.RoutingModel(manager)
+        self.solve_result = solve_pickup_delivery(
+            distance_matrix,
+            self.pickups_deliveries,
+            self.start_index,
+            self.end_index,
+            self.solver_profile,
+            self.solver_time_limit_ms
+        )
+        return self.solve_result["route_order"] if self.solve_result else None
 
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(data["distance_matrix"][from_node][to_node])
+    async def solve_route_order_async(self, distance_matrix: List[List[int]]) -> Optional[List[int]]:
+        """
+        訪問順序をイベントループを止めずに計算する
+        少人数なら全列挙（一瞬で終わるのでその場で）、それ以外は
+        共有のプールがあればそこで、なければ別スレッドで実行する
+        """
+        if self._is_small():
+            return self._solve_exact(distance_matrix)
 
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+        if self.solver_pool is None:
+            return await asyncio.to_thread(self.solve_route_order, distance_matrix)
 
-        # ✅ ここで「time」ディメンションを追加
-        routing.AddDimension(
-            transit_callback_index,
-            0,          # slack（余裕時間）
-            100000,     # 最大走行時間（適当な大きい値）
-            True,       # 最初のノードの時間を0に固定する
-            "time"      # ディメンション名（CumulVarで使う）
+        self.solve_result = await self.solver_pool.solve(
+            distance_matrix,
+            self.pickups_deliveries,
+            self.start_index,
+            self.end_index,
+            self.solver_profile,
+            self.solver_time_limit_ms
         )
-        time_dimension = routing.GetDimensionOrDie("time")
-
-        # ✅ pickup → dropoff の順序制約
-        for pickup, delivery in data["pickups_deliveries"]:
-            pickup_index = manager.NodeToIndex(pickup)
-            delivery_index = manager.NodeToIndex(delivery)
-            routing.AddPickupAndDelivery(pickup_index, delivery_index)
-            routing.solver().Add(routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index))
-            routing.solver().Add(
-                time_dimension.CumulVar(pickup_index) <= time_dimension.CumulVar(delivery_index)
-            )
-
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-
-        solution = routing.SolveWithParameters(search_parameters)
-
-        if solution:
-            index = routing.Start(0)
-            route_order = []
-            while not routing.IsEnd(index):
-                route_order.append(manager.IndexToNode(index))
-                index = solution.Value(routing.NextVar(index))
-            route_order.append(manager.IndexToNode(index))
-            print("訪問順序計算完了")
-            print(f"訪問順序: {route_order}")
-            return route_order
-        else:
-            return None
+        return self.solve_result["route_order"] if self.solve_result else None
 
-
-    async def get_geojson_route(self) -> Optional[dict]:
+    async def get_geojson_route(self, distance_matrix: Optional[List[List[int]]] = None) -> Optional[dict]:
         """
         全体処理：
-        ① 距離行列作成 → ② 最適訪問順算出 → ③ Mapbox Directions APIでルート取得
+        ① 距離行列作成 → ② 最適訪問順算出 → ③ バックエンド（Mapbox Directions APIなど）でルート取得
         → 最終的に GeoJSON を返す
+
+        Args:
+            distance_matrix: 計算済みの距離行列（ロビーで保持している場合は①を省略する）
         """
         print("経路生成中...")
-        distance_matrix = await self.build_distance_matrix()
-        route_order = self.solve_route_order(distance_matrix)
+        if distance_matrix is None:
+            distance_matrix = await self.build_distance_matrix()
+        route_order = await self.solve_route_order_async(distance_matrix)
 
         if not route_order:
             return None
@@ -134,24 +218,30 @@ class RouteGenerateService:
         ordered_coords = [self.coordinates[i] for i in route_order]
         
         
-        coord_str = ";".join([f"{lon},{lat}" for lat, lon in ordered_coords])
-        
         print(f"リクエストに使うもの: {ordered_coords}")
         
-        url = f"https://api.mapbox.com/directions/v5/mapbox/driving/{coord_str}"
-        params = {
-            "access_token": self.api_key,
+        options = {
             "geometries": "geojson",
             "overview": "full",
             "steps": "true"
         }
+        # バックエンドごとにレスポンスが異なるため、キャッシュのキーにバックエンド名を含める
+        cache_params = {"backend": self.backend.name, **options}
+
+        data = None
+        if self.directions_cache is not None:
+            data = await self.directions_cache.get(ordered_coords, cache_params)
+            if data is not None:
+                print("ルートをキャッシュから取得しました")
 
-        async with httpx.AsyncClient() as client:
-            request = client.build_request("GET", url, params=params)
-            print(f"Request URL: {request.url}")
-            response = await client.send(request)
-            response.raise_for_status()
-            data = response.json()
+        if data is None:
+            data = await self.backend.directions(ordered_coords, options)
+            if self.directions_cache is not None and data.get("routes"):
+                await self.directions_cache.set(ordered_coords, cache_params, data)
+        
+        if not data.get("routes"):
+            print(f"ルートが見つかりませんでした: {data.get('code')}")
+            return None
         
         # print(f'return_data: {data["routes"][0]["geometry"]}')
         
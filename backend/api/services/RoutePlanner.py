@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Optional, Tuple
+import math
+import time
+
+# 厳密解を列挙で求める乗客数（pickup/dropoffのペア数）の既定の上限
+EXACT_MAX_PAIRS = 4
+
+
+def _cost(distance_matrix: List[List[Optional[float]]], from_node: int, to_node: int) -> float:
+    """地点間のコスト（経路がない場合は無限大）"""
+    value = distance_matrix[from_node][to_node]
+    if value is None or not math.isfinite(value):
+        return math.inf
+    return int(value)
+
+
+def route_cost(distance_matrix: List[List[Optional[float]]], route_order: List[int]) -> float:
+    """訪問順序に沿った総コスト（OR-Toolsの目的関数値と同じく整数化した所要時間の合計）"""
+    return sum(_cost(distance_matrix, a, b) for a, b in zip(route_order, route_order[1:]))
+
+
+def solve_exact_pickup_delivery(
+    distance_matrix: List[List[Optional[float]]],
+    pickups_deliveries: List[Tuple[int, int]],
+    start_index: int,
+    end_index: int
+) -> Optional[Dict[str, Any]]:
+    """
+    少人数向けに、pickup → dropoff の制約を満たす訪問順序を全列挙して最短のものを返す
+    （分枝限定で、途中で最良解を超えた順序は打ち切る）
+
+    Args:
+        distance_matrix: 地点間の所要時間行列
+        pickups_deliveries: [(pickup_index, dropoff_index), ...]
+        start_index: ドライバーの開始地点のインデックス
+        end_index: ドライバーの目的地のインデックス
+
+    Returns:
+        solve_pickup_delivery と同じ形式の辞書。解がない場合はNone
+    """
+    started_at = time.perf_counter()
+    pickup_of = {delivery: pickup for pickup, delivery in pickups_deliveries}
+    nodes = [i for i in range(len(distance_matrix)) if i != start_index and i != end_index]
+
+    best_cost = math.inf
+    best_order: Optional[List[int]] = None
+    order = [start_index]
+    visited = set()
+
+    def search(current: int, cost: float):
+        nonlocal best_cost, best_order
+        if cost >= best_cost:
+            return
+
+        if len(visited) == len(nodes):
+            total = cost + _cost(distance_matrix, current, end_index)
+            if total < best_cost:
+                best_cost = total
+                best_order = order + [end_index]
+            return
+
+        for node in nodes:
+            if node in visited:
+                continue
+            pickup = pickup_of.get(node)
+            if pickup is not None and pickup not in visited:
+                continue  # 乗車前に降車はできない
+
+            visited.add(node)
+            order.append(node)
+            search(node, cost + _cost(distance_matrix, current, node))
+            order.pop()
+            visited.remove(node)
+
+    search(start_index, 0)
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+
+    if best_order is None:
+        print(f"訪問順序が見つかりませんでした（{elapsed_ms:.3f}ms）")
+        return None
+
+    print(f"訪問順序計算完了（列挙, {elapsed_ms:.3f}ms, 目的関数値: {best_cost}）")
+    print(f"訪問順序: {best_order}")
+    return {
+        "route_order": best_order,
+        "objective": best_cost,
+        "elapsed_ms": elapsed_ms,
+        "profile": "exact"
+    }
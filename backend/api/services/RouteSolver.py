@@ -0,0 +1,207 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import math
+import multiprocessing
+import time
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from services.Enums import SolverProfile
+
+# 経路がない区間のコスト（timeディメンションの上限を超えるため、その区間は使われない）
+UNREACHABLE_COST = 10 ** 9
+
+# プロファイルごとの既定の制限時間（ミリ秒）
+DEFAULT_TIME_LIMIT_MS = {
+    SolverProfile.FAST: 200,
+    SolverProfile.QUALITY: 2000,
+}
+
+
+def build_search_parameters(profile: str, time_limit_ms: Optional[int] = None):
+    """
+    プロファイルに応じた探索パラメータを作成
+
+    Args:
+        profile: SolverProfile.FAST / SolverProfile.QUALITY
+        time_limit_ms: 制限時間（ミリ秒）。Noneの場合はプロファイルの既定値
+    """
+    if profile not in DEFAULT_TIME_LIMIT_MS:
+        raise ValueError(f"不明なプロファイルです: {profile}")
+    if time_limit_ms is None:
+        time_limit_ms = DEFAULT_TIME_LIMIT_MS[profile]
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    )
+    if profile == SolverProfile.QUALITY:
+        # 制限時間いっぱいまで局所解から抜け出しながら改善する
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        )
+    else:
+        # 初期解を局所最適まで改善したら終了する
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GREEDY_DESCENT
+        )
+    search_parameters.time_limit.FromMilliseconds(time_limit_ms)
+    return search_parameters
+
+
+def solve_pickup_delivery(
+    distance_matrix: List[List[int]],
+    pickups_deliveries: List[Tuple[int, int]],
+    start_index: int,
+    end_index: int,
+    profile: str = SolverProfile.FAST,
+    time_limit_ms: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    OR-Tools を使って訪問順序を計算する（pickup → dropoff の制約付き）
+    プロセスプールから呼び出せるよう、モジュールレベルの関数にしている
+
+    Args:
+        distance_matrix: 地点間の所要時間行列
+        pickups_deliveries: [(pickup_index, dropoff_index), ...]
+        start_index: ドライバーの開始地点のインデックス
+        end_index: ドライバーの目的地のインデックス
+        profile: 探索のプロファイル（SolverProfile）
+        time_limit_ms: 制限時間（ミリ秒）。Noneの場合はプロファイルの既定値
+
+    Returns:
+        {"route_order": 訪問順序, "objective": 目的関数値（総所要時間）,
+         "elapsed_ms": 計算時間, "profile": プロファイル}。解がない場合はNone
+    """
+    print(f"訪問順序計算中...（{profile}）")
+    started_at = time.perf_counter()
+    # NumPy配列や経路なし（None / inf）を含む行列も扱えるよう、整数のリストに変換しておく
+    distance_matrix = [
+        [UNREACHABLE_COST if value is None or not math.isfinite(value) else int(value) for value in row]
+        for row in distance_matrix
+    ]
+    manager = pywrapcp.RoutingIndexManager(
+        len(distance_matrix),
+        1,  # 車両数 = 1
+        [start_index],
+        [end_index]
+    )
+
+    routing = pywrapcp.RoutingModel(manager)
+
+    def distance_callback(from_index, to_index):
+        from_node = manager.IndexToNode(from_index)
+        to_node = manager.IndexToNode(to_index)
+        return distance_matrix[from_node][to_node]
+
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # ✅ ここで「time」ディメンションを追加
+    routing.AddDimension(
+        transit_callback_index,
+        0,          # slack（余裕時間）
+        100000,     # 最大走行時間（適当な大きい値）
+        True,       # 最初のノードの時間を0に固定する
+        "time"      # ディメンション名（CumulVarで使う）
+    )
+    time_dimension = routing.GetDimensionOrDie("time")
+
+    # ✅ pickup → dropoff の順序制約
+    for pickup, delivery in pickups_deliveries:
+        pickup_index = manager.NodeToIndex(pickup)
+        delivery_index = manager.NodeToIndex(delivery)
+        routing.AddPickupAndDelivery(pickup_index, delivery_index)
+        routing.solver().Add(routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index))
+        routing.solver().Add(
+            time_dimension.CumulVar(pickup_index) <= time_dimension.CumulVar(delivery_index)
+        )
+
+    search_parameters = build_search_parameters(profile, time_limit_ms)
+
+    solution = routing.SolveWithParameters(search_parameters)
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+
+    if solution:
+        index = routing.Start(0)
+        route_order = []
+        while not routing.IsEnd(index):
+            route_order.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        route_order.append(manager.IndexToNode(index))
+        objective = solution.ObjectiveValue()
+        print(f"訪問順序計算完了（{elapsed_ms:.1f}ms, 目的関数値: {objective}）")
+        print(f"訪問順序: {route_order}")
+        return {
+            "route_order": route_order,
+            "objective": objective,
+            "elapsed_ms": elapsed_ms,
+            "profile": profile
+        }
+    else:
+        print(f"訪問順序が見つかりませんでした（{elapsed_ms:.1f}ms）")
+        return None
+
+
+class RouteSolverPool:
+    """訪問順序の計算をイベントループの外（プロセス/スレッドプール）で実行するプール"""
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, use_processes: bool = True):
+        """
+        :param max_workers: 同時に計算するワーカー数
+        :param max_pending: 実行中＋待機中の計算数の上限（超えた分は空くまで待つ）
+        :param use_processes: Trueならプロセスプール、Falseならスレッドプールを使う
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+        self.executor: Optional[Executor] = None
+        self.semaphore = asyncio.Semaphore(max_pending)
+
+    def start(self):
+        """プールを作成（アプリ起動時に呼ぶ）"""
+        if self.executor is not None:
+            return
+
+        if self.use_processes:
+            # イベントループやスレッドを抱えたままforkしないようspawnで起動
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="route-solver")
+
+    async def close(self):
+        """プールを閉じる（アプリ終了時に呼ぶ）"""
+        if self.executor is not None:
+            executor, self.executor = self.executor, None
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+    async def solve(
+        self,
+        distance_matrix: List[List[int]],
+        pickups_deliveries: List[Tuple[int, int]],
+        start_index: int,
+        end_index: int,
+        profile: str = SolverProfile.FAST,
+        time_limit_ms: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """訪問順序をプールで計算し、結果を待つ（戻り値は solve_pickup_delivery と同じ）"""
+        if self.executor is None:
+            self.start()
+
+        if self.semaphore.locked():
+            print("⚠️ 経路計算の待ちが上限に達しているため、空くまで待機します")
+
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                solve_pickup_delivery,
+                distance_matrix,
+                pickups_deliveries,
+                start_index,
+                end_index,
+                profile,
+                time_limit_ms
+            )
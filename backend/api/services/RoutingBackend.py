@@ -0,0 +1,140 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import httpx
+from services.MapboxClient import MapboxClient, MAPBOX_BASE_URL
+
+Coordinate = Tuple[float, float]
+
+# Mapbox Matrix APIで1リクエストに指定できる座標数の上限
+MAPBOX_MATRIX_MAX_COORDINATES = 25
+
+class RoutingBackend:
+    """経路探索バックエンドの共通インターフェース（Mapbox・ローカル道路グラフ）"""
+    name = "base"  # キャッシュのキーに使うバックエンド名
+
+    async def matrix(self, coordinates: List[Coordinate], sources: List[int], destinations: List[int]) -> List[List[Optional[float]]]:
+        """
+        地点間の所要時間を取得
+
+        Args:
+            coordinates: 地点の (latitude, longitude) のリスト
+            sources: 出発地のインデックス（coordinates 上）
+            destinations: 目的地のインデックス（coordinates 上）
+
+        Returns:
+            len(sources) x len(destinations) の所要時間（秒）。経路がない場合はNone
+        """
+        raise NotImplementedError
+
+    async def directions(self, coordinates: List[Coordinate], options: Dict[str, str]) -> Dict[str, Any]:
+        """
+        経由地を順にたどるルートを取得
+
+        Args:
+            coordinates: 経由地の (latitude, longitude) のリスト（訪問順）
+            options: geometries / overview / steps などの検索条件
+
+        Returns:
+            Mapbox Directions APIと同じ形式のレスポンス
+        """
+        raise NotImplementedError
+
+
+class MapboxRoutingBackend(RoutingBackend):
+    """Mapbox Matrix API / Directions APIを使うバックエンド"""
+    name = "mapbox"
+
+    def __init__(self,
+                 api_key: str,
+                 client: Optional[MapboxClient] = None,
+                 matrix_max_coordinates: int = MAPBOX_MATRIX_MAX_COORDINATES,
+                 matrix_concurrency: int = 4):
+        """
+        :param api_key: MapboxのAPIキー
+        :param client: 共有のMapboxClient（Noneの場合はリクエストごとに接続を作成）
+        :param matrix_max_coordinates: Matrix APIの1リクエストあたりの座標数の上限（超える場合は分割する）
+        :param matrix_concurrency: 分割したMatrix APIリクエストを同時に送る数の上限
+        """
+        self.api_key = api_key
+        self.client = client
+        self.matrix_max_coordinates = matrix_max_coordinates
+        self.matrix_semaphore = asyncio.Semaphore(matrix_concurrency)
+
+    async def _get_json(self, path: str, params: dict) -> dict:
+        """共有クライアントがあれば使い回してMapbox APIを呼び出す"""
+        if self.client:
+            return await self.client.get_json(path, params)
+
+        async with httpx.AsyncClient(base_url=MAPBOX_BASE_URL) as client:
+            response = await client.get(path, params=params)
+            response.raise_for_status()
+            return response.json()
+
+    async def matrix(self, coordinates: List[Coordinate], sources: List[int], destinations: List[int]) -> List[List[Optional[float]]]:
+        async def fetch_tile(source_chunk: List[int], destination_chunk: List[int]) -> List[List[Optional[float]]]:
+            # リクエストに必要な座標だけに絞る
+            used = sorted(set(source_chunk) | set(destination_chunk))
+            local_index = {index: k for k, index in enumerate(used)}
+            async with self.matrix_semaphore:
+                return await self._matrix_request(
+                    [coordinates[i] for i in used],
+                    [local_index[i] for i in source_chunk],
+                    [local_index[j] for j in destination_chunk]
+                )
+
+        if len(set(sources) | set(destinations)) <= self.matrix_max_coordinates:
+            return await fetch_tile(sources, destinations)
+
+        # 座標数の上限を超える場合は、出発地・目的地をタイルに分けて並行に取得し、結果をつなぎ合わせる
+        source_size, destination_size = self._tile_sizes(len(sources), len(destinations))
+        source_chunks = [sources[k:k + source_size] for k in range(0, len(sources), source_size)]
+        destination_chunks = [destinations[k:k + destination_size] for k in range(0, len(destinations), destination_size)]
+        print(f"Matrix APIを {len(source_chunks)}x{len(destination_chunks)} のリクエストに分割します")
+
+        tiles = await asyncio.gather(*[
+            fetch_tile(source_chunk, destination_chunk)
+            for source_chunk in source_chunks
+            for destination_chunk in destination_chunks
+        ])
+
+        durations: List[List[Optional[float]]] = []
+        for a in range(len(source_chunks)):
+            row_tiles = tiles[a * len(destination_chunks):(a + 1) * len(destination_chunks)]
+            for row in range(len(source_chunks[a])):
+                durations.append([value for tile in row_tiles for value in tile[row]])
+        return durations
+
+    def _tile_sizes(self, source_count: int, destination_count: int) -> Tuple[int, int]:
+        """1タイルの出発地・目的地の数（合計が座標数の上限以内になるように分ける）"""
+        limit = self.matrix_max_coordinates
+        if source_count < limit // 2:
+            return source_count, limit - source_count
+        if destination_count < limit // 2:
+            return limit - destination_count, destination_count
+        return limit // 2, limit - limit // 2
+
+    async def _matrix_request(self, coordinates: List[Coordinate], sources: List[int], destinations: List[int]) -> List[List[Optional[float]]]:
+        """Matrix APIへの1回分のリクエスト"""
+        coord_str = ";".join([f"{lon},{lat}" for lat, lon in coordinates])
+        path = f"/directions-matrix/v1/mapbox/driving/{coord_str}"
+        params = {
+            "access_token": self.api_key
+        }
+        if len(sources) < len(coordinates):
+            params["sources"] = ";".join(str(i) for i in sources)
+        if len(destinations) < len(coordinates):
+            params["destinations"] = ";".join(str(j) for j in destinations)
+
+        data = await self._get_json(path, params)
+
+        print("レスポンス:", data)
+
+        return data["durations"]
+
+    async def directions(self, coordinates: List[Coordinate], options: Dict[str, str]) -> Dict[str, Any]:
+        coord_str = ";".join([f"{lon},{lat}" for lat, lon in coordinates])
+        path = f"/directions/v5/mapbox/driving/{coord_str}"
+        params = {"access_token": self.api_key, **options}
+
+        print(f"Request URL: {MAPBOX_BASE_URL}{path}")
+        return await self._get_json(path, params)
@@ -0,0 +1,148 @@
+import os
+
+# 設定の必須項目（テストでは外部APIに接続しないためダミー値）
+os.environ.setdefault("MAPBOX_API_KEY", "test")
+os.environ.setdefault("JWT_SECRET_KEY", "test")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+import asyncio
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+from models.models import Base, MatchUser
+from services.RoutingBackend import RoutingBackend
+import services.BatchMatchingEngine as batch_matching_engine_module
+import services.MatchingService as matching_service_module
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeRoutingBackend(RoutingBackend):
+    """直線距離と一定の速度で所要時間・ルートを返すバックエンド（Mapboxに接続しない）"""
+    name = "fake"
+    speed_mps = 10.0
+
+    def _seconds(self, a: Tuple[float, float], b: Tuple[float, float]) -> float:
+        # DBから読んだ座標はDecimalのためfloatにそろえる
+        a = (float(a[0]), float(a[1]))
+        b = (float(b[0]), float(b[1]))
+        lat = math.radians((a[0] + b[0]) / 2)
+        dx = (b[1] - a[1]) * 111320 * math.cos(lat)
+        dy = (b[0] - a[0]) * 110540
+        return math.hypot(dx, dy) / self.speed_mps
+
+    async def matrix(self, coordinates, sources, destinations):
+        return [[self._seconds(coordinates[i], coordinates[j]) for j in destinations] for i in sources]
+
+    async def directions(self, coordinates, options):
+        legs = [
+            {"duration": self._seconds(a, b), "distance": self._seconds(a, b) * self.speed_mps, "summary": "", "steps": []}
+            for a, b in zip(coordinates, coordinates[1:])
+        ]
+        return {
+            "code": "Ok",
+            "routes": [{
+                "geometry": {"type": "LineString", "coordinates": [[float(lng), float(lat)] for lat, lng in coordinates]},
+                "legs": legs,
+                "duration": sum(leg["duration"] for leg in legs),
+                "distance": sum(leg["distance"] for leg in legs)
+            }],
+            "waypoints": [{"name": "", "location": [float(lng), float(lat)]} for lat, lng in coordinates]
+        }
+
+
+class FakeConnectionManager:
+    """送信したメッセージを記録するだけのConnectionManager"""
+    def __init__(self):
+        self.active_connections: Dict[int, List[Any]] = {}
+        self.sent: List[Tuple[Optional[int], Any]] = []
+
+    async def send_to_json_user(self, user_id: int, message: dict):
+        self.sent.append((user_id, message))
+
+    async def send_to_text_user(self, user_id: int, message: str):
+        self.sent.append((user_id, message))
+
+    async def broadcast(self, message: str):
+        self.sent.append((None, message))
+
+
+@pytest.fixture
+async def session_factory(tmp_path, monkeypatch):
+    """SQLiteのテスト用DB（MatchingServiceなどが開く専用セッションもこのDBに向ける）"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    factory = sessionmaker(bind=engine, class_=AsyncSession, autocommit=False, autoflush=False)
+    monkeypatch.setattr(matching_service_module, "AsyncSessionLocal", factory)
+    monkeypatch.setattr(batch_matching_engine_module, "AsyncSessionLocal", factory)
+    yield factory
+    await engine.dispose()
+
+
+# 列を追加する前の matches / match_history テーブル
+LEGACY_TABLES = [
+    """CREATE TABLE matches (
+        match_id INTEGER PRIMARY KEY,
+        status VARCHAR(50) NOT NULL,
+        route_geojson JSON,
+        max_passengers INTEGER NOT NULL,
+        max_distance DECIMAL(10, 6) NOT NULL,
+        preferences JSON,
+        created_at DATETIME,
+        updated_at DATETIME
+    )""",
+    """CREATE TABLE match_history (
+        id INTEGER PRIMARY KEY,
+        match_id INTEGER NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        route_geojson JSON,
+        max_passengers INTEGER NOT NULL,
+        max_distance DECIMAL(10, 6) NOT NULL,
+        preferences JSON,
+        created_at DATETIME,
+        completed_at DATETIME
+    )""",
+]
+
+
+@pytest.fixture
+async def legacy_engine(tmp_path, monkeypatch):
+    """列を追加する前のスキーマのDB（database の関数・MatchingService の専用セッションはこのDBを使う）"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.db'}")
+    async with engine.begin() as connection:
+        for statement in LEGACY_TABLES:
+            await connection.execute(text(statement))
+        await connection.run_sync(lambda sync_connection: MatchUser.__table__.create(sync_connection))
+    monkeypatch.setattr(database, "engine", engine)
+    factory = sessionmaker(bind=engine, class_=AsyncSession, autocommit=False, autoflush=False)
+    monkeypatch.setattr(matching_service_module, "AsyncSessionLocal", factory)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def matching_service():
+    """テストごとに作り直すMatchingService（シングルトンを初期化する）"""
+    matching_service_module.MatchingService._instance = None
+    service = matching_service_module.MatchingService()
+    service.set_routing_backend(FakeRoutingBackend())
+    service.set_connection_manager(FakeConnectionManager())
+    yield service
+    matching_service_module.MatchingService._instance = None
+
+
+async def wait_route_tasks(service) -> None:
+    """バックグラウンドのルート生成が終わるまで待つ"""
+    while service.route_tasks:
+        await asyncio.gather(*list(service.route_tasks))
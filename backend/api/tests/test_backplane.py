@@ -0,0 +1,55 @@
+import pytest
+
+from services.Backplane import Backplane
+from services.ConnectionManager import ConnectionManager
+from tests.conftest import wait_route_tasks
+
+pytestmark = pytest.mark.anyio
+
+
+class FailingBackplane(Backplane):
+    """送信が常に失敗するバックプレーン（Redisの障害の代わり）"""
+    name = "failing"
+
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    async def publish(self, message):
+        self.attempts += 1
+        raise ConnectionError("backplane is down")
+
+
+async def test_publish_failure_is_not_raised_to_caller():
+    backplane = FailingBackplane()
+    manager = ConnectionManager(backplane=backplane)
+    await manager.start()
+
+    await manager.send_to_json_user(1, {"type": "ride_request"})
+    await manager.send_to_text_user(1, "hello")
+    await manager.broadcast("hello")
+
+    assert backplane.attempts == 3
+
+
+async def test_matching_succeeds_when_notifications_fail(session_factory, matching_service):
+    backplane = FailingBackplane()
+    manager = ConnectionManager(backplane=backplane)
+    await manager.start()
+    matching_service.set_connection_manager(manager)
+
+    async with session_factory() as session:
+        matching_service.set_db(session)
+        created = await matching_service.create_driver_lobby(1, (35.68, 139.76), (35.70, 139.78))
+        assert created["success"], created
+    await wait_route_tasks(matching_service)
+
+    async with session_factory() as session:
+        matching_service.set_db(session)
+        requested = await matching_service.request_ride(2, created["lobby_id"], (35.685, 139.765), (35.695, 139.775))
+        assert requested["success"], requested
+
+    # コミット後の通知は送ろうとしたが、失敗してもマッチングの結果は変わらない
+    assert backplane.attempts > 0
+    lobby = await matching_service.lobby_store.get(created["lobby_id"])
+    assert 2 in [passenger.user_id for passenger in lobby.get_passengers()]
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+from sqlalchemy.future import select
+
+from models.models import MatchUser
+from services.BatchMatchingEngine import BatchMatchingEngine
+from services.Enums import UserRole
+from tests.conftest import wait_route_tasks
+
+pytestmark = pytest.mark.anyio
+
+DRIVER_START = (35.68, 139.76)
+DRIVER_DESTINATION = (35.70, 139.78)
+
+
+async def test_batched_joins_each_commit_on_their_own_session(session_factory, matching_service):
+    # 同じ方向に向かうドライバーのロビー（1人乗り）を3つ作成
+    driver_ids = [1, 2, 3]
+    for driver_id in driver_ids:
+        async with session_factory() as session:
+            matching_service.set_db(session)
+            result = await matching_service.create_driver_lobby(driver_id, DRIVER_START, DRIVER_DESTINATION)
+            assert result["success"]
+    await wait_route_tasks(matching_service)
+
+    matching_service.set_batch_engine(BatchMatchingEngine(matching_service, window_seconds=0.05))
+
+    async def request(passenger_id: int):
+        # 各リクエストは自分のセッションを持ち、結果を受け取った時点で閉じる
+        async with session_factory() as session:
+            matching_service.set_db(session)
+            return await matching_service.request_random_ride(passenger_id, (35.685, 139.765), (35.695, 139.775))
+
+    passenger_ids = [11, 12, 13]
+    results = await asyncio.gather(*[request(passenger_id) for passenger_id in passenger_ids])
+
+    assert all(result["success"] for result in results), results
+    assert len({result["lobby"]["lobby_id"] for result in results}) == len(passenger_ids)
+
+    async with session_factory() as session:
+        rows = (await session.execute(
+            select(MatchUser.user_id).where(MatchUser.user_role == UserRole.PASSENGER)
+        )).scalars().all()
+    assert sorted(rows) == passenger_ids
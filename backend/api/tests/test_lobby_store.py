@@ -0,0 +1,236 @@
+import asyncio
+
+import pytest
+
+from services.Enums import UserRole, UserStatus
+from services.LobbyStore import InMemoryLobbyStore, LobbyLockLost, LobbyLockTimeout, LocalStateBackend, SharedLobbyStore
+from services.MatchingService import RideLobby
+
+pytestmark = pytest.mark.anyio
+
+TOKYO = (35.68, 139.76)
+YOKOHAMA = (35.44, 139.64)
+
+
+def _lobby(lobby_id: int, driver_id: int, start=TOKYO, destination=(35.70, 139.78)) -> RideLobby:
+    return RideLobby(lobby_id, driver_id, start, destination, UserStatus.IN_LOBBY, max_distance=2.0, max_passengers=3)
+
+
+@pytest.fixture(params=["memory", "shared"])
+def store(request):
+    if request.param == "memory":
+        return InMemoryLobbyStore()
+    return SharedLobbyStore(LocalStateBackend(), RideLobby)
+
+
+async def test_add_get_save(store):
+    await store.add(_lobby(1, 10), [10])
+    assert await store.get_user_lobby(10) == 1
+
+    async with store.lock(1):
+        lobby = await store.get(1)
+        lobby.add_user(20, UserRole.PASSENGER, (35.685, 139.765), (35.695, 139.775), user_status=UserStatus.IN_LOBBY)
+        await store.save(lobby)
+
+    lobby = await store.get(1)
+    assert sorted(lobby.participants) == [10, 20]
+    assert [lobby.lobby_id for lobby in await store.all()] == [1]
+    assert [lobby.lobby_id for lobby in await store.get_many([2, 1])] == [1]
+
+
+async def test_claim_and_release_user(store):
+    await store.add(_lobby(1, 10), [10])
+    await store.add(_lobby(2, 11), [11])
+
+    assert await store.claim_user(20, 1)
+    assert not await store.claim_user(20, 2)  # 所属中は他のロビーに入れない
+    assert not await store.claim_user(11, 1)
+    assert await store.get_user_lobby(20) == 1
+
+    await store.release_user(20, 2)  # 別のロビーからは外せない
+    assert await store.get_user_lobby(20) == 1
+    await store.release_user(20, 1)
+    assert await store.get_user_lobby(20) is None
+    assert await store.claim_user(20, 2)
+
+
+async def test_remove_releases_only_own_users(store):
+    await store.add(_lobby(1, 10), [10])
+    await store.add(_lobby(2, 11), [11])
+    await store.claim_user(20, 2)
+    await store.index(1, [TOKYO])
+
+    await store.remove(1, [10, 20])
+
+    assert await store.get(1) is None
+    assert await store.get_user_lobby(10) is None
+    assert await store.get_user_lobby(20) == 2
+    assert 1 not in await store.query(TOKYO, 1.0)
+
+
+async def test_index_query_and_refresh(store):
+    await store.add(_lobby(1, 10), [10])
+    await store.index(1, [TOKYO, None])
+    assert await store.query(TOKYO, 1.0) == {1}
+    assert await store.query(YOKOHAMA, 1.0) == set()
+
+    # 登録済みの場合は reindex=True のときだけ登録し直す
+    await store.index(1, [YOKOHAMA])
+    assert await store.query(YOKOHAMA, 1.0) == set()
+    await store.index(1, [YOKOHAMA], reindex=True)
+    assert await store.query(YOKOHAMA, 1.0) == {1}
+    assert await store.query(TOKYO, 1.0) == set()
+
+    await store.unindex(1)
+    assert await store.query(YOKOHAMA, 1.0) == set()
+
+    # 存在しないロビーは登録しない
+    await store.index(2, [TOKYO])
+    assert await store.query(TOKYO, 1.0) == set()
+
+
+async def test_lock_serializes_updates(store):
+    await store.add(_lobby(1, 10), [10])
+
+    async def increment():
+        async with store.lock(1):
+            lobby = await store.get(1)
+            max_distance = lobby.max_distance
+            await asyncio.sleep(0.001)
+            lobby.max_distance = max_distance + 1
+            await store.save(lobby)
+
+    await asyncio.gather(*[increment() for _ in range(5)])
+    assert (await store.get(1)).max_distance == 7.0
+
+
+async def test_shared_store_is_visible_to_other_workers():
+    backend = LocalStateBackend()
+    worker_a = SharedLobbyStore(backend, RideLobby)
+    worker_b = SharedLobbyStore(backend, RideLobby)
+
+    lobby = _lobby(1, 10)
+    lobby.set_route(None, [TOKYO, (35.69, 139.77)])
+    await worker_a.add(lobby, [10])
+    await worker_a.index(1, lobby.get_index_points())
+
+    assert await worker_b.get_user_lobby(10) == 1
+    assert not await worker_b.claim_user(10, 2)
+    assert await worker_b.query(TOKYO, 1.0) == {1}
+    assert (await worker_b.get(1)).route_coordinates == [TOKYO, (35.69, 139.77)]
+
+
+async def test_local_state_backend_expiry():
+    backend = LocalStateBackend()
+    assert await backend.set("key", "a", nx=True, px=20)
+    assert not await backend.set("key", "b", nx=True)
+    assert await backend.get("key") == "a"
+
+    await asyncio.sleep(0.03)
+    assert await backend.get("key") is None
+    assert await backend.set("key", "b", nx=True)
+    assert not await backend.delete_if_equal("key", "a")
+    assert await backend.delete_if_equal("key", "b")
+
+
+async def test_shared_lock_waits_for_lease_expiry():
+    backend = LocalStateBackend()
+    store = SharedLobbyStore(backend, RideLobby, lock_ttl_ms=1000, lock_timeout_ms=20)
+    await store.add(_lobby(1, 10), [10])
+
+    # 他のワーカーがロックを持っている間は取得できない
+    await backend.set(store._key("lock", 1), "other-worker", nx=True, px=50)
+    with pytest.raises(LobbyLockTimeout):
+        async with store.lock(1):
+            pass
+
+    # 他のワーカーが落ちてもリースが切れれば取得できる
+    await asyncio.sleep(0.06)
+    async with store.lock(1):
+        assert await backend.get(store._key("lock", 1)) not in (None, "other-worker")
+    assert await backend.get(store._key("lock", 1)) is None
+
+
+async def test_shared_lock_lease_is_extended_while_held():
+    backend = LocalStateBackend()
+    store = SharedLobbyStore(backend, RideLobby, lock_ttl_ms=60, lock_timeout_ms=20)
+    await store.add(_lobby(1, 10), [10])
+
+    async with store.lock(1):
+        # 有効期限より長い処理（Mapbox・訪問順序計算など）の間も、他のワーカーはロックを取れない
+        await asyncio.sleep(0.15)
+        assert not await backend.set(store._key("lock", 1), "other-worker", nx=True, px=1000)
+        lobby = await store.get(1)
+        lobby.max_distance = 5.0
+        await store.save(lobby)
+
+    assert (await store.get(1)).max_distance == 5.0
+    assert await backend.get(store._key("lock", 1)) is None
+
+
+async def test_shared_lock_lost_lease_does_not_overwrite_other_worker():
+    backend = LocalStateBackend()
+    store = SharedLobbyStore(backend, RideLobby, lock_ttl_ms=1000, lock_timeout_ms=20)
+    other = SharedLobbyStore(backend, RideLobby)
+    await store.add(_lobby(1, 10), [10])
+
+    async with store.lock(1):
+        lobby = await store.get(1)
+        # 延長が間に合わずリースが切れ、他のワーカーがロックを取って変更した
+        await backend.delete(store._key("lock", 1))
+        async with other.lock(1):
+            changed = await other.get(1)
+            changed.max_distance = 9.0
+            await other.save(changed)
+
+            lobby.max_distance = 5.0
+            with pytest.raises(LobbyLockLost):
+                await store.save(lobby)
+            with pytest.raises(LobbyLockLost):
+                await store.save_route(lobby)
+            other_token = await backend.get(store._key("lock", 1))
+
+        # 自分の解放で他のワーカーのロックを消さない
+        assert await backend.set(store._key("lock", 1), other_token, nx=True, px=1000)
+        assert await backend.get(store._key("lock", 1)) == other_token
+
+    # 他のワーカーの変更とロックはそのまま
+    assert (await other.get(1)).max_distance == 9.0
+    assert await backend.get(store._key("lock", 1)) == other_token
+
+
+class InterleavingBackend(LocalStateBackend):
+    """ルートの取得を待っている間に、別の処理（hook）を割り込ませる"""
+    def __init__(self):
+        super().__init__()
+        self.during_route_mget = None
+
+    async def mget(self, keys):
+        values = await super().mget(keys)
+        if self.during_route_mget is not None and any(":route:" in key for key in keys):
+            hook, self.during_route_mget = self.during_route_mget, None
+            await hook()
+        return values
+
+
+async def test_get_many_survives_remove_during_route_fetch():
+    backend = InterleavingBackend()
+    worker_a = SharedLobbyStore(backend, RideLobby)
+    worker_b = SharedLobbyStore(backend, RideLobby)
+    first = _lobby(1, 10)
+    first.set_route(None, [TOKYO, (35.69, 139.77)])
+    await worker_a.add(first, [10])
+    await worker_a.add(_lobby(2, 11), [11])
+
+    # worker_b はロビー1だけルートをキャッシュしており、ロビー2のルートは取得が必要
+    await worker_b.get(1)
+    backend.during_route_mget = lambda: worker_b.remove(1, [10])
+
+    lobbies = await worker_b.get_many([1, 2])
+
+    # 状態を読んだ後に削除されたロビー1も、キャッシュに頼らずルートを取り直して復元する
+    assert [lobby.lobby_id for lobby in lobbies] == [1, 2]
+    assert lobbies[0].route_coordinates == []  # ルートのキーも削除済み
+    assert await worker_b.get(1) is None
+    assert (await worker_b.get(2)).lobby_id == 2
+
@@ -0,0 +1,100 @@
+import heapq
+import math
+import random
+
+import numpy as np
+import pytest
+
+from services.LocalRoadGraph import LocalRoadGraph
+
+
+def _grid_graph(size: int, seed: int, with_distances: bool) -> LocalRoadGraph:
+    """格子状の道路グラフ（一方通行あり・最後のノードは孤立）"""
+    rng = random.Random(seed)
+    node_count = size * size + 1
+    edges = {node: [] for node in range(node_count)}
+    for row in range(size):
+        for col in range(size):
+            node = row * size + col
+            for d_row, d_col in ((0, 1), (1, 0)):
+                if row + d_row >= size or col + d_col >= size:
+                    continue
+                neighbor = (row + d_row) * size + col + d_col
+                meters = rng.uniform(80, 200)
+                for a, b in ((node, neighbor), (neighbor, node)):
+                    if rng.random() < 0.15:
+                        continue  # 一方通行
+                    edges[a].append((b, meters / rng.uniform(5, 15), meters))
+
+    indptr = [0]
+    indices, durations, distances = [], [], []
+    for node in range(node_count):
+        for neighbor, duration, meters in edges[node]:
+            indices.append(neighbor)
+            durations.append(duration)
+            distances.append(meters)
+        indptr.append(len(indices))
+
+    lat = [35.68 + (node // size) * 0.001 for node in range(node_count)]
+    lng = [139.76 + (node % size) * 0.001 for node in range(node_count)]
+    return LocalRoadGraph(
+        np.array(indptr), np.array(indices), np.array(durations), np.array(lat), np.array(lng),
+        np.array(distances) if with_distances else None
+    )
+
+
+def _dijkstra(graph: LocalRoadGraph, source: int) -> list:
+    """比較用の素朴なダイクストラ（全ノードへの所要時間）"""
+    result = [math.inf] * graph.node_count
+    result[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if cost > result[node]:
+            continue
+        for edge in range(graph.indptr[node], graph.indptr[node + 1]):
+            neighbor = graph.indices[edge]
+            if cost + graph.durations[edge] < result[neighbor]:
+                result[neighbor] = cost + graph.durations[edge]
+                heapq.heappush(heap, (result[neighbor], neighbor))
+    return result
+
+
+@pytest.mark.parametrize("with_distances", [True, False])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_many_to_many_matches_plain_dijkstra(seed, with_distances):
+    graph = _grid_graph(8, seed, with_distances)
+    rng = random.Random(seed)
+    isolated = graph.node_count - 1
+    sources = rng.sample(range(isolated), 5) + [isolated]
+    sources.append(sources[0])  # 同じ出発ノードの重複
+    targets = rng.sample(range(isolated), 6) + [isolated, sources[1]]
+
+    matrix = graph.many_to_many(sources, targets)
+
+    assert matrix.shape == (len(sources), len(targets))
+    for row, source in enumerate(sources):
+        expected = _dijkstra(graph, source)
+        for col, target in enumerate(targets):
+            assert matrix[row, col] == pytest.approx(expected[target])
+
+
+def test_many_to_many_agrees_with_shortest_path():
+    graph = _grid_graph(6, 7, True)
+    nodes = list(range(0, 36, 5))
+    matrix = graph.many_to_many(nodes, nodes)
+
+    for row, source in enumerate(nodes):
+        for col, target in enumerate(nodes):
+            path = graph.shortest_path(source, target)
+            if path is None:
+                assert matrix[row, col] == math.inf
+            else:
+                assert matrix[row, col] == pytest.approx(path[0])
+
+
+def test_many_to_many_empty():
+    graph = _grid_graph(3, 1, True)
+    assert graph.many_to_many([], [0, 1]).shape == (0, 2)
+    assert graph.many_to_many([0], []).shape == (1, 0)
+
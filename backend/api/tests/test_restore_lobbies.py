@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+import database
+from models.models import Match, MatchUser
+from services.Enums import LobbyStatus, RouteStatus, UserRole, UserStatus
+from services.RouteEncoding import compact_route
+from tests.conftest import FakeRoutingBackend, wait_route_tasks
+
+pytestmark = pytest.mark.anyio
+
+DRIVER_START = (35.68, 139.76)
+DRIVER_DESTINATION = (35.70, 139.78)
+
+
+def _match_user(match_id: int, user_id: int, role: str, user_status: str = UserStatus.IN_LOBBY) -> MatchUser:
+    return MatchUser(
+        match_id=match_id,
+        user_id=user_id,
+        user_start_lat=DRIVER_START[0],
+        user_start_lng=DRIVER_START[1],
+        user_destination_lat=DRIVER_DESTINATION[0],
+        user_destination_lng=DRIVER_DESTINATION[1],
+        user_role=role,
+        user_status=user_status
+    )
+
+
+async def _seed(session_factory):
+    directions = await FakeRoutingBackend().directions([DRIVER_START, DRIVER_DESTINATION], {})
+    route_summary, route_steps = compact_route(directions)
+    async with session_factory() as session:
+        session.add_all([
+            # 募集中（ルートあり・乗客1人）
+            Match(match_id=1, status=LobbyStatus.OPEN, route_summary=route_summary, route_steps=route_steps,
+                  max_passengers=3, max_distance=2.0, preferences={}),
+            _match_user(1, 10, UserRole.DRIVER),
+            _match_user(1, 20, UserRole.PASSENGER),
+            # 承認待ち（ルート生成中に再起動した）
+            Match(match_id=2, status=LobbyStatus.WAITING_APPROVAL, max_passengers=2, max_distance=2.0,
+                  preferences={"solver_profile": "quality"}),
+            _match_user(2, 11, UserRole.DRIVER, UserStatus.APPROVED),
+            # 案内中のマッチは復元しない
+            Match(match_id=3, status=LobbyStatus.NAVIGATING, max_passengers=1, max_distance=2.0, preferences={}),
+            _match_user(3, 12, UserRole.DRIVER, UserStatus.NAVIGATING),
+            # ドライバーがいないマッチは復元しない
+            Match(match_id=4, status=LobbyStatus.OPEN, max_passengers=1, max_distance=2.0, preferences={}),
+        ])
+        await session.commit()
+
+
+async def test_restore_open_and_waiting_lobbies(session_factory, matching_service):
+    await _seed(session_factory)
+
+    assert await matching_service.restore_lobbies() == 2
+    await wait_route_tasks(matching_service)
+    store = matching_service.lobby_store
+
+    open_lobby = await store.get(1)
+    assert open_lobby.status == LobbyStatus.OPEN
+    assert open_lobby.route_status == RouteStatus.READY
+    assert sorted(open_lobby.participants) == [10, 20]
+    assert [user.user_id for user in open_lobby.get_passengers()] == [20]
+
+    waiting_lobby = await store.get(2)
+    assert waiting_lobby.status == LobbyStatus.WAITING_APPROVAL
+    assert waiting_lobby.solver_profile == "quality"
+    assert waiting_lobby.route_status == RouteStatus.READY  # 復元後に作り直した
+    assert waiting_lobby.get_driver().user_status == UserStatus.APPROVED
+
+    assert await store.get(3) is None
+    assert await store.get(4) is None
+    assert [await store.get_user_lobby(user_id) for user_id in (10, 20, 11)] == [1, 1, 2]
+    assert await store.get_user_lobby(12) is None
+    # 空間インデックスには参加できる（募集中の）ロビーだけを登録する
+    assert await store.query(DRIVER_START, 1.0) == {1}
+
+    # 2回目は保存先に残っているロビーを使い、二重に登録しない
+    assert await matching_service.restore_lobbies() == 0
+
+
+async def test_warm_start_on_legacy_schema(legacy_engine, matching_service):
+    directions = await FakeRoutingBackend().directions([DRIVER_START, DRIVER_DESTINATION], {})
+    async with legacy_engine.begin() as connection:
+        await connection.execute(
+            text("INSERT INTO matches (match_id, status, route_geojson, max_passengers, max_distance, preferences) VALUES (1, 'open', :route, 2, 2.0, '{}')"),
+            {"route": json.dumps(directions)}
+        )
+        await connection.execute(
+            text("INSERT INTO match_users (match_id, user_id, user_start_lat, user_start_lng, user_destination_lat, user_destination_lng, user_role, user_status) "
+                 "VALUES (1, 10, 35.68, 139.76, 35.70, 139.78, 'driver', 'in_lobby')")
+        )
+
+    # main.py の warm 起動と同じ順序（列を揃えてから復元）
+    await database.create_tables()
+    assert await matching_service.restore_lobbies() == 1
+    await wait_route_tasks(matching_service)
+
+    lobby = await matching_service.lobby_store.get(1)
+    assert lobby.route_status == RouteStatus.READY
+    assert lobby.route_summary == compact_route(directions)[0]
+    assert await matching_service.lobby_store.query(DRIVER_START, 1.0) == {1}
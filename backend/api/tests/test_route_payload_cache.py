@@ -0,0 +1,102 @@
+import json
+
+import brotli
+import pytest
+from starlette.requests import Request
+
+from cruds.MatchCRUD import MatchCRUD
+from models.models import MatchUser
+from routers.Matched import get_route
+from services.Enums import LobbyStatus, RouteFormat
+from services.RouteCache import RoutePayloadCache
+from services.RouteEncoding import compact_route
+from tests.conftest import FakeConnectionManager, FakeRoutingBackend
+
+pytestmark = pytest.mark.anyio
+
+COORDINATES = [(35.68, 139.76), (35.685, 139.765), (35.69, 139.77)]
+
+
+def _request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+def _match_user(match_id: int, user_id: int, role: str) -> MatchUser:
+    return MatchUser(
+        match_id=match_id,
+        user_id=user_id,
+        user_start_lat=35.68,
+        user_start_lng=139.76,
+        user_destination_lat=35.69,
+        user_destination_lng=139.77,
+        user_role=role,
+        user_status="accepted"
+    )
+
+
+async def _get_route(session_factory, payload_cache: RoutePayloadCache, match_id: int) -> dict:
+    async with session_factory() as session:
+        response = await get_route(
+            match_id, _request(), format=RouteFormat.POLYLINE, steps=False,
+            db=session, connection_manager=FakeConnectionManager(), payload_cache=payload_cache
+        )
+    return json.loads(response.body)
+
+
+async def test_route_cache_follows_users_without_match_update(session_factory):
+    directions = await FakeRoutingBackend().directions(COORDINATES, {})
+    route_summary, route_steps = compact_route(directions)
+    async with session_factory() as session:
+        crud = MatchCRUD(session)
+        match = await crud.create_match({"status": LobbyStatus.OPEN, "max_passengers": 2, "max_distance": 5.0, "preferences": {}})
+        await crud.update_match(match_id=match.match_id, route_summary=route_summary, route_steps=route_steps)
+        session.add(_match_user(match.match_id, 1, "driver"))
+        await session.commit()
+
+    payload_cache = RoutePayloadCache()
+    first = await _get_route(session_factory, payload_cache, match.match_id)
+    assert [user["user_id"] for user in first["users"]] == [1]
+    assert (await _get_route(session_factory, payload_cache, match.match_id)) == first
+    assert len(payload_cache) == 1
+
+    # ルートを書き込まずに参加ユーザーだけ増やす
+    async with session_factory() as session:
+        session.add(_match_user(match.match_id, 2, "passenger"))
+        await session.commit()
+
+    second = await _get_route(session_factory, payload_cache, match.match_id)
+    assert [user["user_id"] for user in second["users"]] == [1, 2]
+    assert second["route"] == first["route"]
+
+
+async def test_route_payload_is_compressed_with_brotli():
+    payload_cache = RoutePayloadCache(compress_min_bytes=0)
+    data = {"route": "x" * 2000}
+    payload = await payload_cache.set(payload_cache.make_key(1, "v1"), data)
+
+    encoding = payload.select_encoding("gzip, deflate, br")
+    assert encoding == "br"
+    assert json.loads(brotli.decompress(payload.bodies[encoding])) == data
+    assert payload.etag(encoding).endswith('-br"')
+    assert payload.matches(payload.etag("gzip"))
+
+
+async def test_route_cache_follows_route_writes_within_same_second(session_factory):
+    async with session_factory() as session:
+        crud = MatchCRUD(session)
+        match = await crud.create_match({"status": LobbyStatus.OPEN, "max_passengers": 2, "max_distance": 5.0, "preferences": {}})
+        session.add(_match_user(match.match_id, 1, "driver"))
+        await session.commit()
+
+    payload_cache = RoutePayloadCache()
+    routes = []
+    for coordinates in (COORDINATES, COORDINATES[::-1]):
+        directions = await FakeRoutingBackend().directions(coordinates, {})
+        route_summary, route_steps = compact_route(directions)
+        async with session_factory() as session:
+            # 更新日時（秒単位）が変わらない間にルートを書き込み直す
+            await MatchCRUD(session).update_match(match_id=match.match_id, route_summary=route_summary, route_steps=route_steps)
+        routes.append((await _get_route(session_factory, payload_cache, match.match_id))["route"])
+
+    assert routes[0] != routes[1]
+    assert routes[1]["polyline"] == route_summary["polyline"]
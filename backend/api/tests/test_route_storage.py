@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import database
+from cruds.MatchCRUD import MatchCRUD
+from services.Enums import LobbyStatus, RouteFormat
+from services.MatchedService import MatchedService
+from services.RouteEncoding import compact_route
+from tests.conftest import FakeRoutingBackend
+
+pytestmark = pytest.mark.anyio
+
+COORDINATES = [(35.68, 139.76), (35.685, 139.765), (35.69, 139.77)]
+
+
+async def _columns(engine, table_name: str):
+    async with engine.connect() as connection:
+        return await connection.run_sync(
+            lambda sync_connection: {column["name"] for column in inspect(sync_connection).get_columns(table_name)}
+        )
+
+
+async def test_update_match_stores_route_summary_and_steps(session_factory):
+    directions = await FakeRoutingBackend().directions(COORDINATES, {})
+    route_summary, route_steps = compact_route(directions)
+
+    async with session_factory() as session:
+        crud = MatchCRUD(session)
+        match = await crud.create_match({"status": LobbyStatus.OPEN, "max_passengers": 1, "max_distance": 5.0, "preferences": {}})
+        updated = await crud.update_match(match_id=match.match_id, route_summary=route_summary, route_steps=route_steps, status=LobbyStatus.NAVIGATING)
+
+    assert updated.status == LobbyStatus.NAVIGATING
+    async with session_factory() as session:
+        crud = MatchCRUD(session)
+        assert (await crud.get_match(match.match_id)).route_summary == route_summary
+        assert await crud.get_route_steps(match.match_id) == route_steps
+
+
+async def test_create_tables_adds_route_columns_to_existing_tables(legacy_engine):
+    # 起動時（main.py）と同じ経路
+    await database.create_tables()
+    # 2回目は何もしない
+    await database.create_tables()
+
+    for table_name in ("matches", "match_history"):
+        assert {"route_summary", "route_steps"} <= await _columns(legacy_engine, table_name)
+    assert "route_version" in await _columns(legacy_engine, "matches")
+
+
+async def test_legacy_route_geojson_is_served_after_migration(legacy_engine):
+    directions = await FakeRoutingBackend().directions(COORDINATES, {})
+    async with legacy_engine.begin() as connection:
+        await connection.execute(
+            text("INSERT INTO matches (match_id, status, route_geojson, max_passengers, max_distance, preferences) VALUES (1, 'navigating', :route, 1, 5.0, '{}')"),
+            {"route": json.dumps(directions)}
+        )
+
+    await database.create_tables()
+
+    factory = sessionmaker(bind=legacy_engine, class_=AsyncSession)
+    async with factory() as session:
+        service = MatchedService(session, None)
+        polyline_route = await service.get_matched_route(1, RouteFormat.POLYLINE)
+        geojson_route = await service.get_matched_route(1, RouteFormat.GEOJSON)
+        steps = await service.get_route_steps(1)
+
+    assert polyline_route["polyline"] == compact_route(directions)[0]["polyline"]
+    assert len(geojson_route["routes"][0]["geometry"]["coordinates"]) == len(COORDINATES)
+    assert steps == [[], []]
@@ -0,0 +1,61 @@
+import pytest
+
+from config import settings
+from services.Enums import SolverProfile
+from tests.conftest import wait_route_tasks
+
+pytestmark = pytest.mark.anyio
+
+
+async def _create_and_fill_lobby(session_factory, matching_service, **kwargs) -> int:
+    async with session_factory() as session:
+        matching_service.set_db(session)
+        result = await matching_service.create_driver_lobby(1, (35.68, 139.76), (35.70, 139.78), **kwargs)
+        assert result["success"], result
+    await wait_route_tasks(matching_service)
+
+    async with session_factory() as session:
+        matching_service.set_db(session)
+        result = await matching_service.request_ride(2, result["lobby_id"], (35.685, 139.765), (35.695, 139.775))
+        assert result["success"], result
+    return result["lobby"]["lobby_id"]
+
+
+async def _approve_all(session_factory, matching_service, lobby_id: int) -> dict:
+    result = None
+    for user_id in (1, 2):
+        async with session_factory() as session:
+            matching_service.set_db(session)
+            result = await matching_service.approve_ride(user_id, lobby_id)
+    return result
+
+
+async def test_lobby_solver_profile_is_used_and_reported(session_factory, matching_service, monkeypatch):
+    # 全列挙を使わずOR-Toolsで解かせる
+    monkeypatch.setattr(settings, "route_exact_max_passengers", 0)
+    lobby_id = await _create_and_fill_lobby(session_factory, matching_service, solver_profile=SolverProfile.QUALITY)
+    assert (await matching_service.lobby_store.get(lobby_id)).solver_profile == SolverProfile.QUALITY
+
+    result = await _approve_all(session_factory, matching_service, lobby_id)
+
+    assert result["success"], result
+    assert result["solver"]["profile"] == SolverProfile.QUALITY
+    assert result["solver"]["objective"] > 0
+    assert result["solver"]["elapsed_ms"] >= 0
+
+
+async def test_small_lobby_reports_exact_solver(session_factory, matching_service):
+    lobby_id = await _create_and_fill_lobby(session_factory, matching_service)
+
+    result = await _approve_all(session_factory, matching_service, lobby_id)
+
+    assert result["success"], result
+    assert result["solver"]["profile"] == "exact"
+
+
+async def test_unknown_solver_profile_is_rejected(session_factory, matching_service):
+    async with session_factory() as session:
+        matching_service.set_db(session)
+        result = await matching_service.create_driver_lobby(1, (35.68, 139.76), (35.70, 139.78), solver_profile="slow")
+    assert not result["success"]
+    assert await matching_service.lobby_store.get_user_lobby(1) is None
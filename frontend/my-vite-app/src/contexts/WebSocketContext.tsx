@@ -1,5 +1,5 @@
 // src/contexts/WebSocketContext.tsx
-import { createContext, useContext, useEffect, useState } from 'react'
+import { createContext, useContext, useEffect, useRef, useState } from 'react'
 import { useMatchStatusStore } from '../store/matchStatusStore'
 import { useRestoreMatchStatus } from '../hooks/useRestoreMatchStatus'
 
@@ -9,6 +9,9 @@ export const WebSocketProvider = ({ children }: { children: React.ReactNode }) =
   const [socket, setSocket] = useState<WebSocket | null>(null)
   const [reconnectAttempts, setReconnectAttempts] = useState(0)
   const maxReconnectAttempts = 5
+  // 再接続時に切断中のメッセージを受け取るためのセッションIDと最後に受け取った通番
+  const sessionIdRef = useRef<string | null>(null)
+  const lastSeqRef = useRef<number | null>(null)
 
   const userId = useMatchStatusStore((state) => state.userId)
 
@@ -18,16 +21,16 @@ export const WebSocketProvider = ({ children }: { children: React.ReactNode }) =
       return
     }
 
-    const ws = new WebSocket(`ws://localhost:8000/ws?user_id=${userId}`)
+    const resume =
+      sessionIdRef.current !== null && lastSeqRef.current !== null
+        ? `&session_id=${sessionIdRef.current}&last_seq=${lastSeqRef.current}`
+        : ''
+    const ws = new WebSocket(`ws://localhost:8000/ws?user_id=${userId}${resume}`)
     setSocket(ws)
 
     ws.onopen = () => {
       console.log('✅ WebSocket 接続完了')
       setReconnectAttempts(0)
-    const restore = async () => {
-      await useRestoreMatchStatus(userId)
-    }
-    restore()
     }
 
     ws.onclose = () => {
@@ -46,6 +49,21 @@ export const WebSocketProvider = ({ children }: { children: React.ReactNode }) =
       const data = JSON.parse(event.data)
       console.log('WebSocketメッセージ受信:', data)
 
+      if (data.type === 'session') {
+        sessionIdRef.current = data.session_id
+        // 再開できた場合は、続けて届く再送メッセージの通番で進める
+        // （ここで進めると、再送の途中で切れたときに受け取っていないメッセージを飛ばしてしまう）
+        // 再開できなかった場合（初回接続・切断が長すぎた場合）は状態を取り直すので、この時点の通番から受け取る
+        if (!data.resumed) {
+          lastSeqRef.current = data.seq
+          await useRestoreMatchStatus(userId)
+        }
+        return
+      }
+      if (typeof data.seq === 'number') {
+        lastSeqRef.current = data.seq
+      }
+
       if (data.type === 'status_update') {
         await useRestoreMatchStatus(userId)
       }